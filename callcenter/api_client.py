@@ -4,13 +4,21 @@ Call Center PBX API Client
 Client để gọi API lấy CDR từ PBX
 """
 
+import asyncio
 import httpx
 import logging
-from datetime import date, datetime
-from typing import List, Dict, Optional
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Optional, Union
 
 from .config import config
 
+# HTTP/2 cần package h2 (pip install 'httpx[http2]')
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -28,6 +36,39 @@ class PBXApiClient:
         self.api_key = config.pbx_api_key
         self.timeout = config.request_timeout
         self.batch_size = config.batch_size
+        self.concurrency = max(1, config.pbx_concurrency)
+        self.window_hours = max(1, config.pbx_window_hours)
+        
+        # AsyncClient dùng chung (keep-alive, HTTP/2), gắn với event loop tạo ra nó
+        self._client = None
+        self._client_loop = None
+        self._semaphore = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """AsyncClient dùng chung cho mọi request trong event loop hiện tại"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop or self._client.is_closed:
+            # Mỗi asyncio.run() là 1 loop mới -> client của loop cũ không dùng lại được
+            self._client = httpx.AsyncClient(
+                verify=False,
+                timeout=self.timeout,
+                http2=config.pbx_http2 and HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency
+                )
+            )
+            self._client_loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+    
+    async def aclose(self):
+        """Đóng AsyncClient (gọi khi job kết thúc)"""
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+        self._semaphore = None
     
     def _get_headers(self) -> Dict:
         """Tạo headers cho request"""
@@ -40,22 +81,29 @@ class PBXApiClient:
             headers['Authorization'] = f'Bearer {self.api_key}'
         return headers
     
-    async def fetch_cdr_records(self, date_from: date, date_to: date, 
+    @staticmethod
+    def _format_bound(value: Union[date, datetime], end: bool = False) -> str:
+        """date -> cả ngày (00:00:00 / 23:59:59), datetime -> giữ nguyên giờ"""
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return f"{value.isoformat()} {'23:59:59' if end else '00:00:00'}"
+    
+    async def fetch_cdr_records(self, date_from: Union[date, datetime], date_to: Union[date, datetime],
                                  offset: int = 0) -> Dict:
         """
         Lấy CDR records từ PBX API
         
         Args:
-            date_from: Ngày bắt đầu
-            date_to: Ngày kết thúc
+            date_from: Ngày (hoặc thời điểm) bắt đầu
+            date_to: Ngày (hoặc thời điểm) kết thúc
             offset: Offset cho pagination
             
         Returns:
             Dict với keys: data, total, limit, offset
         """
         # Format datetime với space: YYYY-MM-DD HH:MM:SS
-        from_str = f"{date_from.isoformat()} 00:00:00"
-        to_str = f"{date_to.isoformat()} 23:59:59"
+        from_str = self._format_bound(date_from)
+        to_str = self._format_bound(date_to, end=True)
         
         params = {
             'domain': self.domain,
@@ -65,24 +113,25 @@ class PBXApiClient:
             'offset': offset
         }
         
-        logger.info(f"Fetching CDR records: {date_from} -> {date_to}, offset={offset}")
+        logger.info(f"Fetching CDR records: {from_str} -> {to_str}, offset={offset}")
         
         try:
-            async with httpx.AsyncClient(verify=False, timeout=self.timeout) as client:
+            client = self._get_client()
+            async with self._semaphore:
                 response = await client.get(
                     self.api_url,
                     params=params,
                     headers=self._get_headers()
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    data = result.get('data', [])
-                    logger.info(f"✅ Fetched {len(data)} records")
-                    return result
-                else:
-                    logger.error(f"❌ API error: {response.status_code} - {response.text}")
-                    return {'data': [], 'total': 0, 'error': response.text}
+            
+            if response.status_code == 200:
+                result = response.json()
+                data = result.get('data', [])
+                logger.info(f"✅ Fetched {len(data)} records")
+                return result
+            else:
+                logger.error(f"❌ API error: {response.status_code} - {response.text}")
+                return {'data': [], 'total': 0, 'error': response.text}
                     
         except httpx.TimeoutException:
             logger.error(f"❌ Request timeout after {self.timeout}s")
@@ -94,6 +143,150 @@ class PBXApiClient:
             logger.error(f"❌ Unexpected error: {e}")
             return {'data': [], 'total': 0, 'error': str(e)}
     
+    def _hour_windows(self, date_from: date, date_to: date) -> List[tuple]:
+        """Chia khoảng ngày thành các cửa sổ window_hours giờ"""
+        start = datetime.combine(date_from, datetime.min.time())
+        end = datetime.combine(date_to, datetime.max.time()).replace(microsecond=0)
+        step = timedelta(hours=self.window_hours)
+        windows = []
+        while start <= end:
+            windows.append((start, min(start + step - timedelta(seconds=1), end)))
+            start += step
+        return windows
+    
+    async def _put_sequential(self, date_from, date_to, result: Dict, pages: asyncio.Queue,
+                              skip_uuids: set = None) -> int:
+        """Theo next_offset từng trang một (bắt đầu từ trang result đã lấy), trả về số trang lỗi"""
+        offset = result.get('offset') or 0
+        while True:
+            if 'error' in result:
+                logger.error(f"❌ Error fetching records: {result['error']}")
+                return 1
+            
+            records = result.get('data', [])
+            if not records:
+                return 0
+            if skip_uuids:
+                records = [r for r in records if r.get('uuid') not in skip_uuids]
+            if records:
+                await pages.put(records)
+            
+            # Check pagination - API uses next_offset
+            next_offset = result.get('next_offset')
+            if next_offset is None or next_offset <= offset:
+                # No more pages
+                return 0
+            
+            offset = next_offset
+            result = await self.fetch_cdr_records(date_from, date_to, offset)
+    
+    async def _put_offsets(self, date_from, date_to, offsets: List[int], pages: asyncio.Queue) -> int:
+        """Worker: lấy lần lượt các offset trong danh sách dùng chung, trả về số trang lỗi"""
+        failed = 0
+        while offsets:
+            result = await self.fetch_cdr_records(date_from, date_to, offsets.pop(0))
+            if 'error' in result:
+                failed += 1
+            elif result.get('data'):
+                await pages.put(result['data'])
+        return failed
+    
+    async def iter_cdr_pages(self, date_from: date, date_to: date, stats: Dict = None):
+        """
+        Async generator: lần lượt trả về từng trang CDR (List[Dict]), không giữ lại trang đã trả
+        
+        Trang đầu tiên quyết định cách lấy các trang còn lại:
+        - API trả total: tính trước các offset, concurrency worker lấy đồng thời
+        - Không có total nhưng còn trang: chia khoảng ngày thành cửa sổ window_hours giờ,
+          các cửa sổ lấy song song, trong mỗi cửa sổ đi theo next_offset
+        Hàng đợi giữa các request và người dùng generator có giới hạn (concurrency trang),
+        nên ghi DB chậm sẽ làm chậm việc tải thay vì dồn trang vào bộ nhớ
+        
+        Trang lỗi sau khi hết retry không làm dừng generator; số trang lỗi được ghi vào
+        stats['failed_pages'] (nếu truyền stats) để job biết dữ liệu bị thiếu
+        
+        Usage:
+            stats = {}
+            async for records in api_client.iter_cdr_pages(date_from, date_to, stats):
+                repo.upsert_records_batch(records)
+            if stats['failed_pages']:
+                ...
+        """
+        if stats is None:
+            stats = {}
+        stats['failed_pages'] = 0
+        
+        first = await self.fetch_cdr_records(date_from, date_to, 0)
+        if 'error' in first:
+            logger.error(f"❌ Error fetching records: {first['error']}")
+            stats['failed_pages'] = 1
+            return
+        
+        records = first.get('data', [])
+        if not records:
+            return
+        yield records
+        
+        total = first.get('total')
+        page_size = len(records)  # Kích thước trang thực tế (server có thể giới hạn < limit)
+        next_offset = first.get('next_offset')
+        pages = asyncio.Queue(maxsize=self.concurrency)
+        
+        if isinstance(total, int) and total > page_size:
+            # Biết trước tổng -> lấy đồng thời các trang còn lại
+            offsets = list(range(page_size, total, page_size))
+            logger.info(f"⚡ {total} records: lấy {len(offsets)} trang còn lại, {self.concurrency} request đồng thời")
+            producers = [self._put_offsets(date_from, date_to, offsets, pages)
+                         for _ in range(min(self.concurrency, len(offsets)))]
+        elif next_offset is not None and next_offset > 0:
+            windows = self._hour_windows(date_from, date_to)
+            if len(windows) > 1:
+                # Không có total -> các cửa sổ giờ song song (bỏ records đã có ở trang đầu)
+                logger.info(f"⚡ Không có total: chia {len(windows)} cửa sổ {self.window_hours}h, "
+                            f"{self.concurrency} request đồng thời")
+                skip_uuids = {r.get('uuid') for r in records}
+                producers = [self._window_pages(window_from, window_to, pages, skip_uuids)
+                             for window_from, window_to in windows]
+            else:
+                producers = [self._put_sequential(
+                    date_from, date_to,
+                    await self.fetch_cdr_records(date_from, date_to, next_offset),
+                    pages
+                )]
+        else:
+            return
+        del records, first
+        
+        async def run_producers():
+            try:
+                failed_pages = sum(await asyncio.gather(*producers))
+                if failed_pages:
+                    stats['failed_pages'] += failed_pages
+                    logger.error(f"❌ {failed_pages} trang lỗi, dữ liệu có thể thiếu")
+            except Exception as e:
+                # Không biết chính xác bao nhiêu trang bị bỏ -> ít nhất 1
+                stats['failed_pages'] += 1
+                logger.error(f"❌ Error fetching records: {e}")
+            await pages.put(None)
+        
+        task = asyncio.ensure_future(run_producers())
+        try:
+            while True:
+                page = await pages.get()
+                if page is None:
+                    break
+                yield page
+        finally:
+            # Người dùng dừng giữa chừng -> huỷ các request còn lại
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+    
+    async def _window_pages(self, window_from: datetime, window_to: datetime, pages: asyncio.Queue,
+                            skip_uuids: set) -> int:
+        first = await self.fetch_cdr_records(window_from, window_to, 0)
+        return await self._put_sequential(window_from, window_to, first, pages, skip_uuids)
+    
     async def fetch_all_cdr_records(
         self, 
         date_from: date, 
@@ -101,7 +294,8 @@ class PBXApiClient:
         batch_callback=None
     ) -> List[Dict]:
         """
-        Lấy tất cả CDR records với pagination
+        Lấy tất cả CDR records (giữ toàn bộ trong bộ nhớ)
+        Job sync nên dùng iter_cdr_pages() để xử lý từng trang
         
         Args:
             date_from: Ngày bắt đầu
@@ -113,20 +307,7 @@ class PBXApiClient:
             List tất cả records
         """
         all_records = []
-        offset = 0
-        total_fetched = 0
-        
-        while True:
-            result = await self.fetch_cdr_records(date_from, date_to, offset)
-            
-            if 'error' in result:
-                logger.error(f"❌ Error fetching records: {result['error']}")
-                break
-            
-            records = result.get('data', [])
-            if not records:
-                break
-            
+        async for records in self.iter_cdr_pages(date_from, date_to):
             # Call batch callback to save records immediately
             if batch_callback:
                 try:
@@ -134,29 +315,21 @@ class PBXApiClient:
                     logger.info(f"💾 Batch of {len(records)} records saved to database")
                 except Exception as e:
                     logger.error(f"❌ Error in batch callback: {e}")
-                
-            all_records.extend(records)
-            total_fetched += len(records)
             
-            # Check pagination - API uses next_offset
-            next_offset = result.get('next_offset')
-            if next_offset is None or next_offset <= offset:
-                # No more pages
-                break
-            
-            offset = next_offset
-            logger.info(f"📥 Progress: {len(all_records)} records fetched, next_offset={next_offset}")
+            all_records.extend(records)
+            logger.info(f"📥 Progress: {len(all_records)} records fetched")
         
         logger.info(f"✅ Total fetched: {len(all_records)} records")
         return all_records
     
     def test_connection(self) -> bool:
         """Test kết nối đến PBX API"""
-        import asyncio
-        
         async def _test():
             today = date.today()
-            result = await self.fetch_cdr_records(today, today)
+            try:
+                result = await self.fetch_cdr_records(today, today)
+            finally:
+                await self.aclose()
             return 'error' not in result
         
         try:
@@ -173,5 +346,10 @@ api_client = PBXApiClient()
 # Sync wrapper function for non-async usage
 def fetch_cdr_sync(date_from: date, date_to: date) -> List[Dict]:
     """Synchronous wrapper để lấy CDR records"""
-    import asyncio
-    return asyncio.run(api_client.fetch_all_cdr_records(date_from, date_to))
+    async def _fetch():
+        try:
+            return await api_client.fetch_all_cdr_records(date_from, date_to)
+        finally:
+            await api_client.aclose()
+    
+    return asyncio.run(_fetch())
@@ -29,6 +29,7 @@ class CallCenterConfig:
     retry_interval_minutes: int = int(os.getenv('CALLCENTER_RETRY_INTERVAL_MINUTES', '15'))
     max_retries: int = int(os.getenv('CALLCENTER_MAX_RETRIES', '3'))
     batch_size: int = int(os.getenv('CALLCENTER_BATCH_SIZE', '500'))  # Tăng từ 200 lên 500
+    raw_data_mode: str = os.getenv('CALLCENTER_RAW_DATA', 'json')  # json | gzip | none
     default_days_back: int = int(os.getenv('CALLCENTER_DEFAULT_DAYS_BACK', '30'))
     
     # Timezone
@@ -36,6 +37,11 @@ class CallCenterConfig:
     
     # Request timeout (seconds)
     request_timeout: int = int(os.getenv('PBX_REQUEST_TIMEOUT', '60'))
+    
+    # PBX HTTP client: 1 AsyncClient dùng chung cho cả job
+    pbx_http2: bool = os.getenv('PBX_HTTP2', 'true').lower() == 'true'  # cần package h2
+    pbx_concurrency: int = int(os.getenv('PBX_CONCURRENCY', '4'))  # Số request CDR đồng thời
+    pbx_window_hours: int = int(os.getenv('PBX_WINDOW_HOURS', '1'))  # Cửa sổ giờ khi API không trả total
 
 
 # Global config instance
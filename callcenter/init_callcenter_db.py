@@ -4,20 +4,43 @@ Call Center Database Schema
 Khởi tạo SQLite database cho Call Center Records
 """
 
-import sqlite3
+import sys
 from pathlib import Path
-from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "database"))
+from sqlite_conn import get_writer, get_reader
+from search_index import ensure_search_index
+from table_stats import ensure_table_stats
 
 # Database path
 DB_PATH = Path(__file__).parent.parent / "database" / "callcenter.db"
 
 
-def get_connection():
-    """Lấy connection đến database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+# Cộng dồn 1 nhóm callcenter_records vào callcenter_daily_stats
+# {sign}: '' (cộng) hoặc '-' (trừ), {join}: giới hạn records (vd: chỉ các uuid của batch)
+DAILY_STATS_UPSERT_SQL = """
+    INSERT INTO callcenter_daily_stats
+        (day, extension, direction, call_status, call_count, total_duration, total_billsec)
+    SELECT COALESCE(substr(r.start_time, 1, 10), ''),
+           COALESCE(r.caller_id_number, ''),
+           COALESCE(r.direction, ''),
+           COALESCE(r.call_status, r.disposition, ''),
+           {sign}COUNT(*),
+           {sign}COALESCE(SUM(r.duration), 0),
+           {sign}COALESCE(SUM(r.billsec), 0)
+    FROM callcenter_records r {join}
+    WHERE true
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT(day, extension, direction, call_status) DO UPDATE SET
+        call_count = call_count + excluded.call_count,
+        total_duration = total_duration + excluded.total_duration,
+        total_billsec = total_billsec + excluded.total_billsec
+"""
+
+
+def get_connection(readonly: bool = False):
+    """Lấy connection đến database (writer dùng chung của process, hoặc reader read-only)"""
+    return get_reader(DB_PATH) if readonly else get_writer(DB_PATH)
 
 
 def init_callcenter_database():
@@ -147,6 +170,21 @@ def init_callcenter_database():
         )
     """)
     
+    # Bảng tổng hợp theo ngày - dashboard đọc bảng này thay vì quét callcenter_records
+    # NULL được lưu thành '' để làm khoá chính
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS callcenter_daily_stats (
+            day TEXT NOT NULL,                 -- YYYY-MM-DD (theo start_time)
+            extension TEXT NOT NULL,           -- caller_id_number
+            direction TEXT NOT NULL,
+            call_status TEXT NOT NULL,         -- call_status (legacy: disposition)
+            call_count INTEGER NOT NULL DEFAULT 0,
+            total_duration INTEGER NOT NULL DEFAULT 0,
+            total_billsec INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, extension, direction, call_status)
+        ) WITHOUT ROWID
+    """)
+    
     # View thống kê theo Extension/Nhân viên
     cursor.execute("""
         CREATE VIEW IF NOT EXISTS v_employee_call_stats AS
@@ -179,6 +217,9 @@ def init_callcenter_database():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_direction ON callcenter_records(direction)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_call_status ON callcenter_records(call_status)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_start_time ON callcenter_records(start_time)")
+    # Lọc theo extension + khoảng thời gian (chi tiết cuộc gọi của nhân viên)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_records_caller_epoch ON callcenter_records(caller_id_number, start_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_stats_extension ON callcenter_daily_stats(extension, day)")
     
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_employees_extension ON callcenter_employees(extension)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_employees_vttech_id ON callcenter_employees(vttech_id)")
@@ -187,6 +228,17 @@ def init_callcenter_database():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_logs_sync_type ON callcenter_sync_logs(sync_type)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_logs_date ON callcenter_sync_logs(date_from, date_to)")
     
+    # Database cũ: tạo bảng tổng hợp lần đầu từ records đã có
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM callcenter_daily_stats)")
+    if not cursor.fetchone()[0]:
+        cursor.execute(DAILY_STATS_UPSERT_SQL.format(sign='', join=''))
+    
+    # Full-text search theo số điện thoại (caller/destination)
+    ensure_search_index(conn, 'callcenter_records_fts')
+    
+    # Số dòng / bảng (trigger table_stats)
+    ensure_table_stats(conn)
+    
     conn.commit()
     conn.close()
     
@@ -229,6 +281,18 @@ def migrate_database():
     print("✅ Migration completed")
 
 
+def rebuild_daily_stats():
+    """Tính lại toàn bộ callcenter_daily_stats từ callcenter_records"""
+    conn = get_connection()
+    try:
+        conn.execute("DELETE FROM callcenter_daily_stats")
+        conn.execute(DAILY_STATS_UPSERT_SQL.format(sign='', join=''))
+        conn.commit()
+    finally:
+        conn.close()
+    print("✅ Daily stats rebuilt")
+
+
 def reset_database():
     """Reset database - XÓA TẤT CẢ DATA"""
     if DB_PATH.exists():
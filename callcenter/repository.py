@@ -6,21 +6,109 @@ Các hàm tiện ích để đọc/ghi dữ liệu CDR vào SQLite
 
 import sqlite3
 import json
+import gzip
+import base64
 from pathlib import Path
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 
-from .init_callcenter_db import get_connection, DB_PATH
+from .config import config
+from .init_callcenter_db import get_connection, DB_PATH, DAILY_STATS_UPSERT_SQL
+from table_stats import CALLCENTER_COUNTED_TABLES, recount_table_stats
+
+
+# ============== BATCH WRITE ==============
+
+# Các field của CDR (PBX format) theo đúng thứ tự tham số ?1..?13 trong PBX_UPSERT_SQL
+PBX_FIELDS = (
+    'uuid', 'direction', 'caller_id_number', 'outbound_caller_id_number',
+    'destination_number', 'start_epoch', 'end_epoch', 'answer_epoch',
+    'duration', 'billsec', 'sip_hangup_disposition', 'call_status', 'record_path'
+)
+
+# Ép kiểu epoch/duration và đổi epoch -> ISO datetime (giờ địa phương, giống
+# datetime.fromtimestamp().isoformat()) trong SQLite thay vì từng dòng trong Python
+_EPOCH = "COALESCE(CAST(?{n} AS INTEGER), 0)"
+_ISO_TIME = ("CASE WHEN CAST(?{n} AS INTEGER) <> 0 "
+             "THEN strftime('%Y-%m-%dT%H:%M:%S', CAST(?{n} AS INTEGER), 'unixepoch', 'localtime') END")
+
+PBX_UPSERT_SQL = f"""
+    INSERT OR REPLACE INTO callcenter_records 
+    (uuid, direction, caller_id_number, outbound_caller_id_number, 
+     destination_number, start_epoch, end_epoch, answer_epoch,
+     duration, billsec, sip_hangup_disposition, call_status, record_path,
+     caller_id, destination, start_time, answer_time, end_time, disposition,
+     raw_data, updated_at)
+    VALUES (?1, ?2, ?3, ?4, ?5,
+            {_EPOCH.format(n=6)}, {_EPOCH.format(n=7)}, {_EPOCH.format(n=8)},
+            {_EPOCH.format(n=9)}, {_EPOCH.format(n=10)},
+            ?11, ?12, ?13,
+            ?3, ?5,
+            {_ISO_TIME.format(n=6)}, {_ISO_TIME.format(n=8)}, {_ISO_TIME.format(n=7)},
+            ?12,
+            ?14, ?15)
+"""
+
+LEGACY_FIELDS = (
+    'uuid', 'caller_id', 'caller_name', 'destination', 'direction',
+    'duration', 'billsec', 'start_time', 'answer_time', 'end_time',
+    'disposition', 'recording_path'
+)
+
+LEGACY_UPSERT_SQL = """
+    INSERT OR REPLACE INTO callcenter_records 
+    (uuid, caller_id, caller_name, destination, direction,
+     duration, billsec, start_time, answer_time, end_time,
+     disposition, recording_path, raw_data, updated_at)
+    VALUES (?, ?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Giới hạn DAILY_STATS_UPSERT_SQL vào các uuid của batch đang ghi
+BATCH_STATS_JOIN = "JOIN temp._cc_batch_uuids b ON b.uuid = r.uuid"
+
+# Dòng lỗi khi ghi: lỗi SQLite, kiểu dữ liệu không bind được, số quá lớn
+_ROW_ERRORS = (sqlite3.Error, OverflowError, ValueError, TypeError)
+
+
+def raw_data_encoder(mode: str = None) -> Callable[[Dict], Optional[str]]:
+    """
+    Hàm mã hoá raw_data theo CALLCENTER_RAW_DATA:
+    json (mặc định) | gzip (base64 + gzip, vẫn là TEXT) | none (không lưu)
+    """
+    mode = (mode or config.raw_data_mode).lower()
+    if mode == 'none':
+        return lambda data: None
+    if mode == 'gzip':
+        return lambda data: base64.b64encode(gzip.compress(
+            json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8'),
+            compresslevel=6
+        )).decode('ascii')
+    return lambda data: json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def decode_raw_data(value: Optional[str]) -> Optional[str]:
+    """raw_data đã lưu (json hoặc gzip) -> chuỗi JSON"""
+    if not value or value.lstrip().startswith(('{', '[')):
+        return value
+    try:
+        return gzip.decompress(base64.b64decode(value)).decode('utf-8')
+    except Exception:
+        return value
 
 
 class CallCenterRepository:
     """Repository class cho Call Center database"""
     
-    def __init__(self):
+    def __init__(self, readonly: bool = False, conn_provider=None):
+        """conn_provider: hàm trả về connection (vd. connection theo request của dashboard)"""
         self.db_path = DB_PATH
+        self.readonly = readonly
+        self.conn_provider = conn_provider
     
     def get_conn(self):
-        return get_connection()
+        if self.conn_provider:
+            return self.conn_provider()
+        return get_connection(readonly=self.readonly)
     
     # ============== PBX RECORD METHODS ==============
     
@@ -38,163 +126,76 @@ class CallCenterRepository:
     
     def upsert_pbx_record(self, data: Dict) -> bool:
         """Insert hoặc update PBX call record với format mới"""
-        conn = self.get_conn()
+        return self.upsert_pbx_records_batch([data])['success'] == 1
+    
+    def _executemany_isolated(self, conn: sqlite3.Connection, sql: str, rows: List[tuple],
+                              label: str = 'record') -> int:
+        """
+        executemany cả batch trong 1 savepoint. Nếu lỗi: rollback savepoint, chia đôi
+        batch và ghi lại từng nửa cho đến khi khoanh được dòng lỗi. Trả về số dòng lỗi
+        """
+        if not rows:
+            return 0
+        conn.execute("SAVEPOINT cc_batch")
         try:
-            raw_data = json.dumps(data, ensure_ascii=False, default=str)
-            
-            # Convert epoch to datetime for legacy fields
-            start_epoch = int(data.get('start_epoch', 0) or 0)
-            end_epoch = int(data.get('end_epoch', 0) or 0)
-            answer_epoch = int(data.get('answer_epoch', 0) or 0)
-            
-            start_time = datetime.fromtimestamp(start_epoch).isoformat() if start_epoch else None
-            end_time = datetime.fromtimestamp(end_epoch).isoformat() if end_epoch else None
-            answer_time = datetime.fromtimestamp(answer_epoch).isoformat() if answer_epoch else None
-            
-            conn.execute("""
-                INSERT OR REPLACE INTO callcenter_records 
-                (uuid, direction, caller_id_number, outbound_caller_id_number, 
-                 destination_number, start_epoch, end_epoch, answer_epoch,
-                 duration, billsec, sip_hangup_disposition, call_status, record_path,
-                 caller_id, destination, start_time, answer_time, end_time, disposition,
-                 raw_data, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data.get('uuid'),
-                data.get('direction'),
-                data.get('caller_id_number'),
-                data.get('outbound_caller_id_number'),
-                data.get('destination_number'),
-                start_epoch,
-                end_epoch,
-                answer_epoch,
-                int(data.get('duration', 0) or 0),
-                int(data.get('billsec', 0) or 0),
-                data.get('sip_hangup_disposition'),
-                data.get('call_status'),
-                data.get('record_path'),
-                # Legacy fields
-                data.get('caller_id_number'),  # caller_id = extension
-                data.get('destination_number'),  # destination
-                start_time,
-                answer_time,
-                end_time,
-                data.get('call_status'),  # disposition = call_status
-                raw_data,
-                datetime.now().isoformat()
-            ))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"❌ Error upserting PBX record {data.get('uuid')}: {e}")
-            return False
-        finally:
-            conn.close()
+            conn.executemany(sql, rows)
+        except _ROW_ERRORS as e:
+            conn.execute("ROLLBACK TO cc_batch")
+            conn.execute("RELEASE cc_batch")
+            if len(rows) == 1:
+                print(f"❌ Error inserting {label} {rows[0][0]}: {e}")
+                return 1
+            mid = len(rows) // 2
+            return (self._executemany_isolated(conn, sql, rows[:mid], label)
+                    + self._executemany_isolated(conn, sql, rows[mid:], label))
+        conn.execute("RELEASE cc_batch")
+        return 0
     
-    def upsert_pbx_records_batch(self, records: List[Dict]) -> Dict[str, int]:
-        """Insert nhiều PBX records cùng lúc"""
+    def _write_batch(self, sql: str, rows: List[tuple], label: str) -> Dict[str, int]:
+        """
+        Ghi rows bằng 1 executemany trong 1 transaction, dòng lỗi được cô lập bằng savepoint.
+        callcenter_daily_stats được cập nhật trong cùng transaction: trừ phần của các
+        records cũ (bị REPLACE) rồi cộng phần của records sau khi ghi
+        """
         conn = self.get_conn()
-        success_count = 0
         failed_count = 0
         
         try:
-            for data in records:
-                try:
-                    raw_data = json.dumps(data, ensure_ascii=False, default=str)
-                    
-                    start_epoch = int(data.get('start_epoch', 0) or 0)
-                    end_epoch = int(data.get('end_epoch', 0) or 0)
-                    answer_epoch = int(data.get('answer_epoch', 0) or 0)
-                    
-                    start_time = datetime.fromtimestamp(start_epoch).isoformat() if start_epoch else None
-                    end_time = datetime.fromtimestamp(end_epoch).isoformat() if end_epoch else None
-                    answer_time = datetime.fromtimestamp(answer_epoch).isoformat() if answer_epoch else None
-                    
-                    conn.execute("""
-                        INSERT OR REPLACE INTO callcenter_records 
-                        (uuid, direction, caller_id_number, outbound_caller_id_number, 
-                         destination_number, start_epoch, end_epoch, answer_epoch,
-                         duration, billsec, sip_hangup_disposition, call_status, record_path,
-                         caller_id, destination, start_time, answer_time, end_time, disposition,
-                         raw_data, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        data.get('uuid'),
-                        data.get('direction'),
-                        data.get('caller_id_number'),
-                        data.get('outbound_caller_id_number'),
-                        data.get('destination_number'),
-                        start_epoch,
-                        end_epoch,
-                        answer_epoch,
-                        int(data.get('duration', 0) or 0),
-                        int(data.get('billsec', 0) or 0),
-                        data.get('sip_hangup_disposition'),
-                        data.get('call_status'),
-                        data.get('record_path'),
-                        data.get('caller_id_number'),
-                        data.get('destination_number'),
-                        start_time,
-                        answer_time,
-                        end_time,
-                        data.get('call_status'),
-                        raw_data,
-                        datetime.now().isoformat()
-                    ))
-                    success_count += 1
-                except Exception as e:
-                    print(f"❌ Error inserting PBX record {data.get('uuid')}: {e}")
-                    failed_count += 1
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _cc_batch_uuids (uuid TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM temp._cc_batch_uuids")
+            conn.executemany("INSERT OR IGNORE INTO temp._cc_batch_uuids VALUES (?)",
+                             [(row[0],) for row in rows])
+            conn.execute(DAILY_STATS_UPSERT_SQL.format(sign='-', join=BATCH_STATS_JOIN))
+            
+            failed_count = self._executemany_isolated(conn, sql, rows, label)
             
+            conn.execute(DAILY_STATS_UPSERT_SQL.format(sign='', join=BATCH_STATS_JOIN))
             conn.commit()
         except Exception as e:
             print(f"❌ Error in batch insert: {e}")
+            conn.rollback()
+            failed_count = len(rows)
         finally:
             conn.close()
         
-        return {'success': success_count, 'failed': failed_count}
+        return {'success': len(rows) - failed_count, 'failed': failed_count}
+    
+    def upsert_pbx_records_batch(self, records: List[Dict]) -> Dict[str, int]:
+        """Insert nhiều PBX records cùng lúc: chuẩn hoá cả trang thành tuples rồi 1 executemany"""
+        encode = raw_data_encoder()
+        now = datetime.now().isoformat()
+        rows = [
+            tuple([data.get(field) for field in PBX_FIELDS] + [encode(data), now])
+            for data in records
+        ]
+        return self._write_batch(PBX_UPSERT_SQL, rows, 'PBX record')
     
     # Legacy method for backward compatibility
     def upsert_record(self, data: Dict) -> bool:
         """Legacy: Insert hoặc update call record"""
-        # Check if it's new PBX format
-        if 'caller_id_number' in data or 'call_status' in data:
-            return self.upsert_pbx_record(data)
-        
-        # Old format
-        conn = self.get_conn()
-        try:
-            raw_data = json.dumps(data, ensure_ascii=False, default=str)
-            
-            conn.execute("""
-                INSERT OR REPLACE INTO callcenter_records 
-                (uuid, caller_id, caller_name, destination, direction,
-                 duration, billsec, start_time, answer_time, end_time,
-                 disposition, recording_path, raw_data, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data.get('uuid'),
-                data.get('caller_id'),
-                data.get('caller_name'),
-                data.get('destination'),
-                data.get('direction'),
-                data.get('duration', 0),
-                data.get('billsec', 0),
-                data.get('start_time'),
-                data.get('answer_time'),
-                data.get('end_time'),
-                data.get('disposition'),
-                data.get('recording_path'),
-                raw_data,
-                datetime.now().isoformat()
-            ))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"❌ Error upserting record {data.get('uuid')}: {e}")
-            return False
-        finally:
-            conn.close()
+        return self.upsert_records_batch([data])['success'] == 1
     
     def upsert_records_batch(self, records: List[Dict]) -> Dict[str, int]:
         """Batch insert - auto detect format"""
@@ -202,45 +203,13 @@ class CallCenterRepository:
             return self.upsert_pbx_records_batch(records)
         
         # Legacy batch insert
-        conn = self.get_conn()
-        success_count = 0
-        failed_count = 0
-        
-        try:
-            for data in records:
-                try:
-                    raw_data = json.dumps(data, ensure_ascii=False, default=str)
-                    conn.execute("""
-                        INSERT OR REPLACE INTO callcenter_records 
-                        (uuid, caller_id, caller_name, destination, direction,
-                         duration, billsec, start_time, answer_time, end_time,
-                         disposition, recording_path, raw_data, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        data.get('uuid'),
-                        data.get('caller_id'),
-                        data.get('caller_name'),
-                        data.get('destination'),
-                        data.get('direction'),
-                        data.get('duration', 0),
-                        data.get('billsec', 0),
-                        data.get('start_time'),
-                        data.get('answer_time'),
-                        data.get('end_time'),
-                        data.get('disposition'),
-                        data.get('recording_path'),
-                        raw_data,
-                        datetime.now().isoformat()
-                    ))
-                    success_count += 1
-                except Exception as e:
-                    print(f"❌ Error inserting record: {e}")
-                    failed_count += 1
-            conn.commit()
-        finally:
-            conn.close()
-        
-        return {'success': success_count, 'failed': failed_count}
+        encode = raw_data_encoder()
+        now = datetime.now().isoformat()
+        rows = [
+            tuple([data.get(field) for field in LEGACY_FIELDS] + [encode(data), now])
+            for data in records
+        ]
+        return self._write_batch(LEGACY_UPSERT_SQL, rows, 'record')
     
     def get_record_by_uuid(self, uuid: str) -> Optional[Dict]:
         """Lấy record theo UUID"""
@@ -251,7 +220,11 @@ class CallCenterRepository:
                 (uuid,)
             )
             row = cursor.fetchone()
-            return dict(row) if row else None
+            if not row:
+                return None
+            record = dict(row)
+            record['raw_data'] = decode_raw_data(record.get('raw_data'))
+            return record
         finally:
             conn.close()
     
@@ -298,33 +271,34 @@ class CallCenterRepository:
             conn.close()
     
     def get_records_stats(self) -> Dict:
-        """Lấy thống kê records"""
+        """Lấy thống kê records (từ bảng tổng hợp callcenter_daily_stats)"""
         conn = self.get_conn()
         try:
-            # Total records
-            cursor = conn.execute("SELECT COUNT(*) FROM callcenter_records")
-            total = cursor.fetchone()[0]
-            
             # By direction
             cursor = conn.execute("""
-                SELECT direction, COUNT(*) as count 
-                FROM callcenter_records 
+                SELECT direction, SUM(call_count) as count 
+                FROM callcenter_daily_stats 
                 GROUP BY direction
+                HAVING SUM(call_count) > 0
             """)
-            by_direction = {row['direction']: row['count'] for row in cursor.fetchall()}
+            by_direction = {row['direction'] or None: row['count'] for row in cursor.fetchall()}
             
             # By disposition
             cursor = conn.execute("""
-                SELECT disposition, COUNT(*) as count 
-                FROM callcenter_records 
-                GROUP BY disposition
+                SELECT call_status, SUM(call_count) as count 
+                FROM callcenter_daily_stats 
+                GROUP BY call_status
+                HAVING SUM(call_count) > 0
             """)
-            by_disposition = {row['disposition']: row['count'] for row in cursor.fetchall()}
+            by_disposition = {row['call_status'] or None: row['count'] for row in cursor.fetchall()}
             
-            # Date range
+            # Total records
+            total = sum(by_direction.values())
+            
+            # Date range (2 truy vấn con để cả MIN và MAX đều dùng idx_records_start_time)
             cursor = conn.execute("""
-                SELECT MIN(start_time) as min_date, MAX(start_time) as max_date 
-                FROM callcenter_records
+                SELECT (SELECT MIN(start_time) FROM callcenter_records) as min_date,
+                       (SELECT MAX(start_time) FROM callcenter_records) as max_date
             """)
             row = cursor.fetchone()
             
@@ -367,13 +341,14 @@ class CallCenterRepository:
         conn = self.get_conn()
         try:
             cursor = conn.execute("""
-                SELECT call_status, COUNT(*) as count,
-                       SUM(duration) as total_duration,
-                       SUM(billsec) as total_billsec
-                FROM callcenter_records 
+                SELECT call_status, SUM(call_count) as count,
+                       SUM(total_duration) as total_duration,
+                       SUM(total_billsec) as total_billsec
+                FROM callcenter_daily_stats 
                 GROUP BY call_status
+                HAVING SUM(call_count) > 0
             """)
-            return {row['call_status']: {
+            return {row['call_status'] or None: {
                 'count': row['count'],
                 'total_duration': row['total_duration'] or 0,
                 'total_billsec': row['total_billsec'] or 0
@@ -487,58 +462,90 @@ class CallCenterRepository:
         finally:
             conn.close()
     
+    EMPTY_CALL_STATS = {
+        'total_calls': 0, 'outbound_calls': 0, 'inbound_calls': 0,
+        'answered_calls': 0, 'canceled_calls': 0, 'no_answer_calls': 0, 'busy_calls': 0,
+        'total_duration': 0, 'total_billsec': 0
+    }
+    
+    # call_status -> cột thống kê của get_employee_call_stats
+    EMPLOYEE_STATUS_COLUMNS = {
+        'ANSWERED': 'answered_calls',
+        'CANCELED': 'canceled_calls',
+        'NO_ANSWER': 'no_answer_calls',
+        'BUSY': 'busy_calls',
+    }
+    
+    def _extension_call_stats(self, conn: sqlite3.Connection, extension: str = None,
+                              date_from: date = None, date_to: date = None) -> Dict[str, Dict]:
+        """
+        Tổng hợp cuộc gọi theo extension từ callcenter_daily_stats (day = ngày địa phương
+        của start_epoch, nên lọc theo ngày tương đương lọc start_epoch theo ngày)
+        """
+        sql = """
+            SELECT extension, direction, call_status,
+                   SUM(call_count) as calls,
+                   SUM(total_duration) as duration,
+                   SUM(total_billsec) as billsec
+            FROM callcenter_daily_stats
+            WHERE extension <> ''
+        """
+        params = []
+        if extension:
+            sql += " AND extension = ?"
+            params.append(extension)
+        if date_from:
+            sql += " AND day >= ?"
+            params.append(date_from.isoformat())
+        if date_to:
+            sql += " AND day <= ?"
+            params.append(date_to.isoformat())
+        sql += " GROUP BY extension, direction, call_status"
+        
+        stats = {}
+        for row in conn.execute(sql, params):
+            s = stats.setdefault(row['extension'], dict(self.EMPTY_CALL_STATS))
+            s['total_calls'] += row['calls']
+            s['total_duration'] += row['duration']
+            s['total_billsec'] += row['billsec']
+            if row['direction'] in ('outbound', 'inbound'):
+                s[f"{row['direction']}_calls"] += row['calls']
+            column = self.EMPLOYEE_STATUS_COLUMNS.get(row['call_status'])
+            if column:
+                s[column] += row['calls']
+        return stats
+    
     def get_employee_call_stats(self, extension: str = None, 
                                 date_from: date = None, date_to: date = None) -> List[Dict]:
-        """Lấy thống kê cuộc gọi theo nhân viên"""
+        """
+        Lấy thống kê cuộc gọi theo nhân viên
+        Số liệu theo extension lấy từ callcenter_daily_stats, ghép với danh sách nhân viên
+        trong Python (nhân viên không có cuộc gọi trong khoảng vẫn có mặt với số 0)
+        """
         conn = self.get_conn()
         try:
             sql = """
-                SELECT 
-                    e.id as employee_id,
-                    e.vttech_id,
-                    e.name as employee_name,
-                    e.extension,
-                    e.group_name,
-                    COUNT(r.id) as total_calls,
-                    SUM(CASE WHEN r.direction = 'outbound' THEN 1 ELSE 0 END) as outbound_calls,
-                    SUM(CASE WHEN r.direction = 'inbound' THEN 1 ELSE 0 END) as inbound_calls,
-                    SUM(CASE WHEN r.call_status = 'ANSWERED' THEN 1 ELSE 0 END) as answered_calls,
-                    SUM(CASE WHEN r.call_status = 'CANCELED' THEN 1 ELSE 0 END) as canceled_calls,
-                    SUM(CASE WHEN r.call_status = 'NO_ANSWER' THEN 1 ELSE 0 END) as no_answer_calls,
-                    SUM(CASE WHEN r.call_status = 'BUSY' THEN 1 ELSE 0 END) as busy_calls,
-                    COALESCE(SUM(r.duration), 0) as total_duration,
-                    COALESCE(SUM(r.billsec), 0) as total_billsec,
-                    COALESCE(AVG(r.billsec), 0) as avg_billsec
-                FROM callcenter_employees e
-                LEFT JOIN callcenter_records r ON e.extension = r.caller_id_number
+                SELECT id as employee_id, vttech_id, name as employee_name, extension, group_name
+                FROM callcenter_employees
+                WHERE is_active = 1
             """
-            
-            where_clauses = ["e.is_active = 1"]
             params = []
-            
             if extension:
-                where_clauses.append("e.extension = ?")
+                sql += " AND extension = ?"
                 params.append(extension)
+            employees = [dict(row) for row in conn.execute(sql, params)]
             
-            if date_from:
-                start_epoch = int(datetime.combine(date_from, datetime.min.time()).timestamp())
-                where_clauses.append("(r.start_epoch >= ? OR r.id IS NULL)")
-                params.append(start_epoch)
-            
-            if date_to:
-                end_epoch = int(datetime.combine(date_to, datetime.max.time()).timestamp())
-                where_clauses.append("(r.start_epoch <= ? OR r.id IS NULL)")
-                params.append(end_epoch)
-            
-            if where_clauses:
-                sql += " WHERE " + " AND ".join(where_clauses)
-            
-            sql += " GROUP BY e.id, e.extension ORDER BY total_calls DESC"
-            
-            cursor = conn.execute(sql, params)
-            return [dict(row) for row in cursor.fetchall()]
+            stats = self._extension_call_stats(conn, extension, date_from, date_to)
         finally:
             conn.close()
+        
+        for employee in employees:
+            employee.update(stats.get(employee['extension'], self.EMPTY_CALL_STATS))
+            employee['avg_billsec'] = (employee['total_billsec'] / employee['total_calls']
+                                       if employee['total_calls'] else 0)
+        
+        employees.sort(key=lambda e: e['total_calls'], reverse=True)
+        return employees
     
     def get_employee_detail_calls(self, extension: str, 
                                    date_from: date = None, date_to: date = None,
@@ -608,6 +615,19 @@ class CallCenterRepository:
     
     # ============== SYNC LOG METHODS ==============
     
+    def refresh_table_stats(self) -> bool:
+        """Đếm lại callcenter_records (không có trigger đếm) cho trang DB của dashboard"""
+        conn = self.get_conn()
+        try:
+            recount_table_stats(conn, CALLCENTER_COUNTED_TABLES)
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"❌ Error counting table_stats: {e}")
+            return False
+        finally:
+            conn.close()
+    
     def create_sync_log(self, sync_type: str, date_from: date, date_to: date) -> int:
         """Tạo sync log mới"""
         conn = self.get_conn()
@@ -64,7 +64,7 @@ class CallCenterSyncJob:
         failed_items = []
         total_records = 0
         
-        # Batch callback to save records immediately
+        # Lưu 1 trang + cập nhật tiến độ sync log
         def save_batch(records):
             nonlocal success_count, failed_count, total_records
             batch_result = self.repo.upsert_records_batch(records)
@@ -81,33 +81,45 @@ class CallCenterSyncJob:
                 failed_count=failed_count
             )
         
+        page_stats = {}
+        
         try:
-            # Fetch records from PBX API with batch callback
-            records = await self.api.fetch_all_cdr_records(
-                date_from, date_to, 
-                batch_callback=save_batch
-            )
+            # Lưu từng trang ngay khi tải xong, không giữ lại records trong bộ nhớ
+            async for records in self.api.iter_cdr_pages(date_from, date_to, page_stats):
+                save_batch(records)
+                logger.info(f"💾 Batch of {len(records)} records saved to database")
             
             logger.info(f"📥 Total processed: {total_records} records")
+            self.repo.refresh_table_stats()
+            
+            # Trang PBX lỗi sau khi hết retry -> records của trang đó không có trong DB
+            failed_pages = page_stats.get('failed_pages', 0)
+            error_msg = None
+            if failed_pages:
+                error_msg = f"{failed_pages} trang CDR lỗi khi tải, dữ liệu có thể thiếu"
+                logger.warning(f"⚠️ {error_msg}")
             
             if total_records == 0:
+                status = 'failed' if failed_pages else 'completed'
                 logger.warning("⚠️ No records found")
                 self.repo.update_sync_log(
                     sync_log_id, 
-                    status='completed',
+                    status=status,
                     total_records=0,
                     success_count=0,
-                    failed_count=0
+                    failed_count=0,
+                    error_message=error_msg
                 )
                 return {
-                    'status': 'completed',
+                    'status': status,
                     'total': 0,
                     'success': 0,
-                    'failed': 0
+                    'failed': 0,
+                    'failed_pages': failed_pages
                 }
             
             # Determine status
-            if failed_count == 0:
+            if failed_count == 0 and failed_pages == 0:
                 status = 'completed'
             elif success_count > 0:
                 status = 'partial'
@@ -121,16 +133,19 @@ class CallCenterSyncJob:
                 total_records=total_records,
                 success_count=success_count,
                 failed_count=failed_count,
+                error_message=error_msg,
                 failed_items=failed_items if failed_items else None
             )
             
-            logger.info(f"✅ Sync completed: {success_count}/{total_records} success, {failed_count} failed")
+            logger.info(f"✅ Sync completed: {success_count}/{total_records} success, {failed_count} failed, "
+                        f"{failed_pages} failed pages")
             
             return {
                 'status': status,
                 'total': total_records,
                 'success': success_count,
                 'failed': failed_count,
+                'failed_pages': failed_pages,
                 'sync_log_id': sync_log_id
             }
             
@@ -216,66 +231,88 @@ class CallCenterMissingCheckJob:
         
         total_missing = 0
         total_synced = 0
+        failed_pages = 0
         
         for day_offset in range(days_back):
             check_date = date.today() - timedelta(days=day_offset + 1)
             
             logger.info(f"📅 Checking date: {check_date}")
             
-            # Get UUIDs from PBX
-            pbx_records = await self.api.fetch_all_cdr_records(check_date, check_date)
-            pbx_uuids = {r['uuid'] for r in pbx_records}
-            
             # Get UUIDs from database
             db_uuids = self.repo.get_uuids_by_date(check_date)
             
+            # Duyệt từng trang PBX: chỉ giữ UUID và các records chưa có trong DB
+            missing_records = {}
+            page_stats = {}
+            async for records in self.api.iter_cdr_pages(check_date, check_date, page_stats):
+                for r in records:
+                    if r['uuid'] not in db_uuids:
+                        missing_records[r['uuid']] = r
+            failed_pages += page_stats.get('failed_pages', 0)
+            
             # Find missing
-            missing_uuids = pbx_uuids - db_uuids
+            missing_uuids = set(missing_records)
             
             if missing_uuids:
                 logger.warning(f"⚠️ Found {len(missing_uuids)} missing records for {check_date}")
                 total_missing += len(missing_uuids)
                 
                 # Sync missing records
-                missing_records = [r for r in pbx_records if r['uuid'] in missing_uuids]
-                result = self.repo.upsert_records_batch(missing_records)
+                result = self.repo.upsert_records_batch(list(missing_records.values()))
                 total_synced += result['success']
                 
                 logger.info(f"✅ Synced {result['success']} missing records")
             else:
                 logger.info(f"✅ No missing records for {check_date}")
         
-        logger.info(f"✅ Missing check completed: {total_missing} missing, {total_synced} synced")
+        if total_synced:
+            self.repo.refresh_table_stats()
+        
+        logger.info(f"✅ Missing check completed: {total_missing} missing, {total_synced} synced, "
+                    f"{failed_pages} failed pages")
         return {
-            'status': 'completed',
+            'status': 'partial' if failed_pages else 'completed',
             'total_missing': total_missing,
-            'total_synced': total_synced
+            'total_synced': total_synced,
+            'failed_pages': failed_pages
         }
 
 
-# Convenience functions
+# Convenience functions (đóng AsyncClient dùng chung của PBX khi job xong)
 async def run_daily_sync() -> Dict:
     """Chạy daily sync (ngày hôm qua)"""
     job = CallCenterSyncJob(sync_type='daily')
-    return await job.run()
+    try:
+        return await job.run()
+    finally:
+        await api_client.aclose()
 
 
 async def run_manual_sync(date_from: date, date_to: date) -> Dict:
     """Chạy manual sync cho khoảng thời gian cụ thể"""
     job = CallCenterSyncJob(sync_type='manual')
-    return await job.run(date_from, date_to)
+    try:
+        return await job.run(date_from, date_to)
+    finally:
+        await api_client.aclose()
 
 
 async def run_retry_sync() -> Dict:
     """Chạy retry job"""
     job = CallCenterRetryJob()
-    return await job.run()
+    try:
+        return await job.run()
+    finally:
+        await api_client.aclose()
 
 
 async def run_missing_check(days_back: int = 3) -> Dict:
     """Chạy missing check"""
     job = CallCenterMissingCheckJob()
-    return await job.run(days_back)
+    try:
+        return await job.run(days_back)
+    finally:
+        await api_client.aclose()
 
 
 # Sync wrappers for cron usage
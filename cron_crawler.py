@@ -12,21 +12,21 @@ Cron setup (chạy lúc 6h sáng hàng ngày):
     0 6 * * * cd /chikiet/toolhotro/apivttech && python3 cron_crawler.py >> logs/cron.log 2>&1
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
 import os
 import sys
 import argparse
 import logging
 import time
+import asyncio
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from vttech import get_client, AsyncVTTechClient, config as vttech_config
+
 # Import database module
 sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from master_sync import content_hash, load_hash_file, save_hash_file
 try:
     from db_repository import db as vttech_db
     USE_DATABASE = True
@@ -48,6 +48,9 @@ LOG_DIR = BASE_DIR / "logs"
 DATA_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 
+# Hash nội dung từng bảng master lần lấy trước (bảng không đổi -> không ghi file mới)
+MASTER_HASH_FILE = DATA_DIR / "master" / "_content_hashes.json"
+
 # ============== LOGGING ==============
 logging.basicConfig(
     level=logging.INFO,
@@ -62,93 +65,24 @@ logger = logging.getLogger(__name__)
 # ============== CRAWLER CLASS ==============
 class VTTechCronCrawler:
     def __init__(self):
-        self.session = requests.Session()
-        self.token = None
-        self.xsrf_token = None
-    
-    def decompress(self, data):
-        """Giải nén response base64+gzip"""
-        try:
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD, use_session_cache=True)
     
     def login(self):
-        """Đăng nhập và lấy token"""
+        """Đăng nhập và lấy token (dùng chung phiên của process)"""
         logger.info("Đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "", "from": "", "sso": "", "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            self.token = data.get("Session")
-            self.session.cookies.set("WebToken", self.token)
-            logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')}")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Đăng nhập thất bại: {e}")
-            return False
+        return self.client.login()
     
     def init_page(self, page_url):
         """Lấy XSRF token từ trang"""
-        try:
-            resp = self.session.get(f"{BASE_URL}{page_url}", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_token = match.group(1)
-                    return True
-        except Exception as e:
-            logger.error(f"Lỗi init_page: {e}")
-        return False
+        return self.client.init_page(page_url)
     
     def call_handler(self, page_url, handler, data):
         """Gọi handler với XSRF token"""
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}{page_url}?handler={handler}",
-                data=data,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'XSRF-TOKEN': self.xsrf_token or ''
-                },
-                timeout=60
-            )
-            if resp.status_code == 200 and resp.content:
-                return self.decompress(resp.text)
-        except Exception as e:
-            logger.error(f"Lỗi call_handler {handler}: {e}")
-        return None
+        return self.client.call_handler(page_url, handler, data, timeout=60)
     
     def call_api(self, endpoint, data=None):
         """Gọi API trực tiếp (không cần XSRF)"""
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}{endpoint}",
-                json=data or {},
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.token}"
-                },
-                timeout=60
-            )
-            if resp.status_code == 200 and resp.content:
-                return self.decompress(resp.text)
-        except Exception as e:
-            logger.error(f"Lỗi call_api {endpoint}: {e}")
-        return None
+        return self.client.call_api(endpoint, data, timeout=60)
     
     def save_json(self, data, filename, subdir=None):
         """Lưu dữ liệu ra file JSON"""
@@ -166,6 +100,26 @@ class VTTechCronCrawler:
 
     # ============== DATA FETCHERS ==============
     
+    def save_daily_revenue(self, date_str, branch_results):
+        """Gắn chi nhánh / ngày vào kết quả LoadDataTotal [(branch, result), ...], lưu JSON, log tổng"""
+        all_revenue = []
+        for branch, result in branch_results:
+            if result:
+                for item in result:
+                    item['BranchID'] = branch['ID']
+                    item['BranchName'] = branch['Name']
+                    item['Date'] = date_str
+                all_revenue.extend(result)
+        
+        if all_revenue:
+            self.save_json(all_revenue, f"revenue_{date_str.replace('-', '')}", "revenue")
+            
+            # Tính tổng
+            total = sum(r.get('Paid', 0) for r in all_revenue)
+            logger.info(f"✅ Tổng doanh thu {date_str}: {total:,.0f} VND")
+        
+        return all_revenue
+    
     def fetch_daily_revenue(self, date_str):
         """Lấy doanh thu theo ngày"""
         logger.info(f"📊 Lấy doanh thu ngày {date_str}...")
@@ -183,28 +137,39 @@ class VTTechCronCrawler:
         date_from = f"{date_str} 00:00:00"
         date_to = f"{date_str} 23:59:59"
         
-        all_revenue = []
-        for branch in branches['Branch']:
-            result = self.call_handler(
+        results = [
+            self.call_handler(
                 "/Customer/ListCustomer/",
                 "LoadDataTotal",
                 {'dateFrom': date_from, 'dateTo': date_to, 'branchID': branch['ID']}
             )
-            if result:
-                for item in result:
-                    item['BranchID'] = branch['ID']
-                    item['BranchName'] = branch['Name']
-                    item['Date'] = date_str
-                all_revenue.extend(result)
+            for branch in branches['Branch']
+        ]
+        return self.save_daily_revenue(date_str, zip(branches['Branch'], results))
+    
+    async def fetch_daily_revenue_async(self, date_str, concurrency=None):
+        """Lấy doanh thu theo ngày - gọi LoadDataTotal cho tất cả chi nhánh đồng thời"""
+        logger.info(f"📊 Lấy doanh thu ngày {date_str} (async)...")
         
-        if all_revenue:
-            self.save_json(all_revenue, f"revenue_{date_str.replace('-', '')}", "revenue")
+        async with AsyncVTTechClient.from_client(self.client, concurrency) as aclient:
+            # Lấy danh sách chi nhánh
+            branches = await aclient.call_handler("/Customer/ListCustomer/", "Initialize", {}, timeout=60)
+            if not branches or 'Branch' not in branches:
+                logger.error("Không lấy được danh sách chi nhánh")
+                return None
             
-            # Tính tổng
-            total = sum(r.get('Paid', 0) for r in all_revenue)
-            logger.info(f"✅ Tổng doanh thu {date_str}: {total:,.0f} VND")
+            date_from = f"{date_str} 00:00:00"
+            date_to = f"{date_str} 23:59:59"
+            
+            results = await aclient.call_handler_many(
+                "/Customer/ListCustomer/",
+                "LoadDataTotal",
+                [{'dateFrom': date_from, 'dateTo': date_to, 'branchID': branch['ID']}
+                 for branch in branches['Branch']],
+                timeout=60
+            )
         
-        return all_revenue
+        return self.save_daily_revenue(date_str, zip(branches['Branch'], results))
     
     def fetch_new_customers(self, date_str):
         """Lấy khách hàng mới theo ngày"""
@@ -253,14 +218,22 @@ class VTTechCronCrawler:
         
         today = datetime.now().strftime("%Y%m%d")
         saved = {}
+        hashes = load_hash_file(MASTER_HASH_FILE)
         
         for key, name in table_names.items():
             if key in result:
                 data = result[key]
-                self.save_json(data, f"{name}_{today}", "master")
                 saved[name] = len(data)
+                digest = content_hash(data)
+                if hashes.get(name) == digest:
+                    logger.info(f"  ⏭️  {name}: {len(data)} records, không đổi")
+                    continue
+                self.save_json(data, f"{name}_{today}", "master")
+                hashes[name] = digest
                 logger.info(f"  ✅ {name}: {len(data)} records")
         
+        MASTER_HASH_FILE.parent.mkdir(exist_ok=True)
+        save_hash_file(MASTER_HASH_FILE, hashes)
         return saved
     
     def fetch_branches_membership(self):
@@ -278,6 +251,32 @@ class VTTechCronCrawler:
             logger.info(f"  ✅ Membership: {len(result.get('Membership', []))}")
         
         return result
+    
+    def crawl_day(self, date_str, use_db=True, concurrency=1):
+        """
+        Lấy dữ liệu 1 ngày: doanh thu (ghi database nếu use_db) + khách hàng mới
+        Dùng cho main() và range_sync.py (nhiều ngày chạy song song)
+        """
+        results = {}
+        start_time = time.time()
+        if AsyncVTTechClient is not None and concurrency > 1:
+            results['revenue'] = asyncio.run(self.fetch_daily_revenue_async(date_str, concurrency))
+        else:
+            results['revenue'] = self.fetch_daily_revenue(date_str)
+        
+        # Ghi vào database nếu có
+        if use_db and results.get('revenue'):
+            try:
+                count = vttech_db.insert_daily_revenue_batch(date_str, results['revenue'])
+                vttech_db.log_crawl(date_str, 'revenue', 'success', count, None, time.time() - start_time)
+                logger.info(f"  💾 Saved to database: {count} records")
+            except Exception as e:
+                vttech_db.log_crawl(date_str, 'revenue', 'failed', 0, str(e))
+                logger.error(f"  ❌ Database error: {e}")
+                results['db_error'] = str(e)
+        
+        results['customers'] = self.fetch_new_customers(date_str)
+        return results
 
 
 # ============== MAIN ==============
@@ -287,6 +286,8 @@ def main():
     parser.add_argument('--full', action='store_true', help='Lấy tất cả bao gồm master data')
     parser.add_argument('--master-only', action='store_true', help='Chỉ lấy master data')
     parser.add_argument('--no-db', action='store_true', help='Không ghi vào database (chỉ JSON)')
+    parser.add_argument('--concurrency', type=int, default=vttech_config.async_concurrency,
+                        help='Số request LoadDataTotal đồng thời (1 = tuần tự)')
     args = parser.parse_args()
     
     # Check database availability
@@ -323,20 +324,7 @@ def main():
     
     # Lấy dữ liệu hàng ngày (nếu không phải --master-only)
     if not args.master_only:
-        start_time = time.time()
-        results['revenue'] = crawler.fetch_daily_revenue(target_date)
-        
-        # Ghi vào database nếu có
-        if use_db and results.get('revenue'):
-            try:
-                count = vttech_db.insert_daily_revenue_batch(target_date, results['revenue'])
-                vttech_db.log_crawl(target_date, 'revenue', 'success', count, None, time.time() - start_time)
-                logger.info(f"  💾 Saved to database: {count} records")
-            except Exception as e:
-                vttech_db.log_crawl(target_date, 'revenue', 'failed', 0, str(e))
-                logger.error(f"  ❌ Database error: {e}")
-        
-        results['customers'] = crawler.fetch_new_customers(target_date)
+        results.update(crawler.crawl_day(target_date, use_db, args.concurrency))
     
     # Summary
     logger.info("\n" + "=" * 60)
@@ -5,30 +5,194 @@ Serve dữ liệu cho frontend báo cáo
 Sử dụng SQLite database cho query nhanh
 """
 
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, jsonify, send_from_directory, request, g, stream_with_context
 from flask_cors import CORS
+from collections import OrderedDict
+from functools import wraps
 from pathlib import Path
-from datetime import datetime, timedelta
+import argparse
+import gzip
+import hashlib
 import json
 import os
 import sys
+import threading
+import time
 
-# Import database module
-sys.path.insert(0, str(Path(__file__).parent / 'database'))
+# Optional: serialize JSON nhanh hơn, nén brotli, WSGI server production
 try:
-    from db_repository import db as vttech_db
-    USE_DATABASE = True
+    import orjson
 except ImportError:
-    USE_DATABASE = False
-    vttech_db = None
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2
+    DefaultJSONProvider = None
+
+# Import database module
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_reader_pool, get_data_version
+from search_index import has_search_index, search_filter
+from table_stats import read_table_stats, database_stats
+
+if orjson is not None and DefaultJSONProvider is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """jsonify() dùng orjson, kiểu orjson không hỗ trợ -> json chuẩn"""
+
+        def dumps(self, obj, **kwargs):
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                return super().dumps(obj, **kwargs)
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+else:
+    OrjsonProvider = None
+
 
 app = Flask(__name__, static_folder='dashboard')
+if OrjsonProvider is not None:
+    app.json = OrjsonProvider(app)
 CORS(app)
 
 # Config
 BASE_DIR = Path(__file__).parent
 DATA_DAILY_DIR = BASE_DIR / "data_daily"
 DATA_OUTPUT_DIR = BASE_DIR / "data_output"
+VTTECH_DB_PATH = BASE_DIR / "database" / "vttech.db"
+CALLCENTER_DB_PATH = BASE_DIR / "database" / "callcenter.db"
+
+# Số connection read-only tối đa / database (nên >= số thread của WSGI server)
+DB_POOL_SIZE = int(os.getenv('DASHBOARD_DB_POOL_SIZE', '8'))
+
+# Serving
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'text/html', 'text/css',
+    'text/plain', 'application/javascript', 'text/javascript',
+}
+COMPRESSED_CACHE_MAX_ENTRIES = 128
+_compressed_cache = OrderedDict()
+_compressed_cache_lock = threading.Lock()
+
+
+def _choose_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Nén gzip/brotli response text/JSON >= COMPRESS_MIN_SIZE.
+    Response có ETag (cache/static) -> giữ bản nén theo (ETag, encoding) để không nén lại
+    """
+    if (response.status_code != 200 or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    response.direct_passthrough = False
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    etag, _ = response.get_etag()
+    key = (etag, encoding)
+    compressed = None
+    if etag:
+        with _compressed_cache_lock:
+            compressed = _compressed_cache.get(key)
+            if compressed is not None:
+                _compressed_cache.move_to_end(key)
+
+    if compressed is None:
+        compressed = _compress(body, encoding)
+        if etag:
+            with _compressed_cache_lock:
+                _compressed_cache[key] = compressed
+                while len(_compressed_cache) > COMPRESSED_CACHE_MAX_ENTRIES:
+                    _compressed_cache.popitem(last=False)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # Cùng nội dung nhưng khác bytes -> weak ETag (If-None-Match so sánh weak)
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def request_conn(db_path):
+    """
+    Connection read-only (query_only) của request hiện tại, lấy từ pool.
+    Cùng 1 request dùng lại 1 connection / database; release_request_conns trả về pool
+    kể cả khi handler lỗi hoặc return sớm
+    """
+    conns = g.setdefault('db_conns', {})
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = get_reader_pool(db_path, DB_POOL_SIZE).acquire()
+    return conn
+
+
+@app.teardown_appcontext
+def release_request_conns(exc):
+    """Trả connection của request về pool"""
+    for db_path, conn in g.pop('db_conns', {}).items():
+        get_reader_pool(db_path, DB_POOL_SIZE).release(conn)
+
+
+# Dashboard chỉ đọc: dùng connection read-only để không tranh lock với sync đang chạy
+try:
+    from db_repository import VTTechDB
+    vttech_db = VTTechDB(readonly=True, conn_provider=lambda: request_conn(VTTECH_DB_PATH))
+    USE_DATABASE = True
+except ImportError:
+    USE_DATABASE = False
+    vttech_db = None
+
+# COUNT(*) theo bộ lọc được cache (giây) thay vì đếm lại toàn bảng mỗi lần chuyển trang
+COUNT_CACHE_TTL = 60
+COUNT_CACHE_MAX_KEYS = 256
+_count_cache = {}
+
+# Cache response của các API tổng hợp: hết hạn sau RESPONSE_CACHE_TTL giây
+# hoặc ngay khi sync commit dữ liệu mới (data_version thay đổi)
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_MAX_ENTRIES = 256
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# /api/db/query: số dòng tối đa trả về, thời gian chạy tối đa (giây),
+# số VM instruction giữa 2 lần kiểm tra thời gian, số dòng / lần ghi khi stream
+DB_QUERY_MAX_ROWS = 1000
+DB_QUERY_TIME_LIMIT = float(os.getenv('DASHBOARD_QUERY_TIME_LIMIT', '5'))
+DB_QUERY_PROGRESS_STEPS = 10000
+DB_QUERY_STREAM_BATCH = 200
+
 
 def load_json(filepath):
     """Load JSON file"""
@@ -38,6 +202,95 @@ def load_json(filepath):
     except:
         return None
 
+def cached_count(conn, key, sql, params):
+    """
+    COUNT(*) có cache theo key (bảng + bộ lọc),
+    hết hạn sau COUNT_CACHE_TTL giây hoặc khi data_version thay đổi
+    """
+    now = time.monotonic()
+    version = get_data_version(conn)
+    hit = _count_cache.get(key)
+    if hit and now - hit[1] < COUNT_CACHE_TTL and hit[2] == version:
+        return hit[0]
+
+    total = conn.execute(sql, params).fetchone()[0]
+    if len(_count_cache) >= COUNT_CACHE_MAX_KEYS:
+        _count_cache.clear()
+    _count_cache[key] = (total, now, version)
+    return total
+
+def current_data_version():
+    """
+    Phiên bản dữ liệu hiện tại: data_version của vttech.db + callcenter.db,
+    chế độ JSON thì theo mtime của thư mục dữ liệu
+    """
+    if USE_DATABASE:
+        version = [get_data_version(vttech_db.get_conn())]
+    else:
+        version = [d.stat().st_mtime_ns for d in (DATA_DAILY_DIR / "revenue", DATA_OUTPUT_DIR) if d.exists()]
+
+    cc_conn = get_callcenter_conn()
+    version.append(get_data_version(cc_conn) if cc_conn else 0)
+    return tuple(version)
+
+def cached_response(view):
+    """
+    Cache response JSON theo route + query params (LRU, TTL, data_version).
+    Trả ETag, request có If-None-Match trùng -> 304
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        version = current_data_version()
+        now = time.monotonic()
+
+        with _response_cache_lock:
+            entry = _response_cache.get(key)
+            if entry and (entry['version'] != version or now - entry['cached_at'] >= RESPONSE_CACHE_TTL):
+                entry = None
+                del _response_cache[key]
+            if entry:
+                _response_cache.move_to_end(key)
+
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            # Chỉ cache response thành công: view trả lỗi bằng status 4xx/5xx (không phải 200)
+            # để lỗi tạm thời của DB không bị giữ lại suốt TTL
+            if response.status_code != 200 or response.mimetype != 'application/json':
+                return response
+
+            body = response.get_data()
+            entry = {
+                'version': version,
+                'cached_at': now,
+                'body': body,
+                'etag': hashlib.sha1(body).hexdigest(),
+            }
+            with _response_cache_lock:
+                _response_cache[key] = entry
+                while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+                    _response_cache.popitem(last=False)
+
+        response = app.response_class(entry['body'], mimetype='application/json')
+        response.set_etag(entry['etag'])
+        # Trình duyệt luôn hỏi lại server, dữ liệu chưa đổi -> 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    return wrapper
+
+def parse_cursor(value):
+    """
+    Cursor keyset = id của bản ghi cuối trang trước (rỗng -> trang đầu).
+    Raise ValueError nếu cursor không hợp lệ
+    """
+    if not value:
+        return None
+    cursor_id = int(value)
+    if cursor_id < 1:
+        raise ValueError(value)
+    return cursor_id
+
 def get_available_dates_from_files():
     """Lấy danh sách các ngày có dữ liệu từ files"""
     revenue_dir = DATA_DAILY_DIR / "revenue"
@@ -53,6 +306,13 @@ def get_available_dates_from_files():
 
 # ============== PAGE ROUTES ==============
 
+@app.after_request
+def page_cache_headers(response):
+    """Trang HTML: luôn hỏi lại server (ETag/Last-Modified -> 304)"""
+    if response.mimetype == 'text/html' and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/')
 def index():
     """Serve analytics dashboard as homepage"""
@@ -91,6 +351,7 @@ def main_dashboard():
 # ============== API ROUTES ==============
 
 @app.route('/api/summary')
+@cached_response
 def api_summary():
     """Tổng quan dữ liệu"""
     
@@ -148,6 +409,7 @@ def api_summary():
     })
 
 @app.route('/api/revenue/<date>')
+@cached_response
 def api_revenue_by_date(date):
     """Doanh thu theo ngày"""
     if USE_DATABASE:
@@ -178,6 +440,7 @@ def api_revenue_by_date(date):
     return jsonify(data)
 
 @app.route('/api/revenue/range')
+@cached_response
 def api_revenue_range():
     """Doanh thu nhiều ngày"""
     if USE_DATABASE:
@@ -218,6 +481,7 @@ def api_revenue_range():
     return jsonify(sorted(result, key=lambda x: x['date']))
 
 @app.route('/api/branches')
+@cached_response
 def api_branches():
     """Danh sách chi nhánh"""
     if USE_DATABASE:
@@ -226,6 +490,7 @@ def api_branches():
     return jsonify(data or [])
 
 @app.route('/api/services')
+@cached_response
 def api_services():
     """Danh sách dịch vụ"""
     if USE_DATABASE:
@@ -234,6 +499,7 @@ def api_services():
     return jsonify(data or [])
 
 @app.route('/api/employees')
+@cached_response
 def api_employees():
     """Danh sách nhân viên"""
     if USE_DATABASE:
@@ -255,6 +521,7 @@ def api_master(name):
 # ============== NEW ANALYSIS ENDPOINTS ==============
 
 @app.route('/api/analysis/monthly')
+@cached_response
 def api_monthly_summary():
     """Tổng hợp doanh thu theo tháng"""
     if USE_DATABASE:
@@ -263,6 +530,7 @@ def api_monthly_summary():
     return jsonify({'error': 'Database not available'}), 503
 
 @app.route('/api/analysis/branches')
+@cached_response
 def api_branch_performance():
     """Hiệu suất chi nhánh"""
     if USE_DATABASE:
@@ -273,6 +541,7 @@ def api_branch_performance():
     return jsonify({'error': 'Database not available'}), 503
 
 @app.route('/api/analysis/compare')
+@cached_response
 def api_compare_periods():
     """So sánh 2 giai đoạn"""
     if USE_DATABASE:
@@ -289,6 +558,7 @@ def api_compare_periods():
     return jsonify({'error': 'Database not available'}), 503
 
 @app.route('/api/analysis/trend')
+@cached_response
 def api_trend():
     """Xu hướng N ngày"""
     if USE_DATABASE:
@@ -309,51 +579,50 @@ def api_crawl_logs():
 # ============== CALL CENTER API ROUTES ==============
 
 def get_callcenter_conn():
-    """Get connection to callcenter database"""
-    import sqlite3
-    cc_db_path = BASE_DIR / "database" / "callcenter.db"
-    if not cc_db_path.exists():
+    """Get read-only connection to callcenter database (connection của request, từ pool)"""
+    if not CALLCENTER_DB_PATH.exists():
         return None
-    conn = sqlite3.connect(cc_db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return request_conn(CALLCENTER_DB_PATH)
 
 @app.route('/api/callcenter/stats')
+@cached_response
 def api_callcenter_stats():
     """Call Center statistics"""
     conn = get_callcenter_conn()
     if not conn:
-        return jsonify({'error': 'Call Center database not available', 'total_records': 0}), 200
+        return jsonify({'error': 'Call Center database not available', 'total_records': 0}), 503
     
     try:
         cursor = conn.cursor()
         
-        # Total records
-        cursor.execute("SELECT COUNT(*) as total FROM callcenter_records")
-        total = cursor.fetchone()['total']
-        
+        # Tất cả số liệu đọc từ bảng tổng hợp callcenter_daily_stats (không quét records)
         # By direction
         cursor.execute("""
-            SELECT direction, COUNT(*) as cnt 
-            FROM callcenter_records 
+            SELECT direction, SUM(call_count) as cnt 
+            FROM callcenter_daily_stats 
             GROUP BY direction
+            HAVING SUM(call_count) > 0
         """)
         by_direction = {row['direction'] or 'unknown': row['cnt'] for row in cursor.fetchall()}
         
-        # Today's calls
+        # Total records
+        total = sum(by_direction.values())
+        
+        # Today's calls (day của callcenter_daily_stats theo giờ địa phương, không phải UTC)
         cursor.execute("""
-            SELECT COUNT(*) as cnt FROM callcenter_records 
-            WHERE date(start_time) = date('now')
+            SELECT COALESCE(SUM(call_count), 0) as cnt FROM callcenter_daily_stats 
+            WHERE day = date('now', 'localtime')
         """)
         today_calls = cursor.fetchone()['cnt']
         
         # By date (last 30 days)
         cursor.execute("""
-            SELECT date(start_time) as date, COUNT(*) as count 
-            FROM callcenter_records 
-            WHERE start_time IS NOT NULL
-            GROUP BY date(start_time) 
-            ORDER BY date DESC 
+            SELECT day as date, SUM(call_count) as count 
+            FROM callcenter_daily_stats 
+            WHERE day <> ''
+            GROUP BY day 
+            HAVING SUM(call_count) > 0
+            ORDER BY day DESC 
             LIMIT 30
         """)
         by_date = [{'date': row['date'], 'count': row['count']} for row in cursor.fetchall()]
@@ -382,11 +651,14 @@ def api_callcenter_stats():
             'last_sync': last_sync
         })
     except Exception as e:
-        return jsonify({'error': str(e), 'total_records': 0}), 200
+        return jsonify({'error': str(e), 'total_records': 0}), 500
 
 @app.route('/api/callcenter/records')
 def api_callcenter_records():
-    """Get call records with pagination"""
+    """
+    Get call records with pagination
+    Truyền ?cursor=<next_cursor> để lấy trang kế (keyset theo id), ?page= vẫn hỗ trợ
+    """
     conn = get_callcenter_conn()
     if not conn:
         return jsonify({'error': 'Database not available', 'records': []}), 200
@@ -395,6 +667,10 @@ def api_callcenter_records():
     limit = request.args.get('limit', 20, type=int)
     search = request.args.get('search', '')
     date = request.args.get('date', '')
+    try:
+        cursor_id = parse_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor', 'records': []}), 400
     
     offset = (page - 1) * limit
     
@@ -404,23 +680,42 @@ def api_callcenter_records():
         sql = "SELECT * FROM callcenter_records WHERE 1=1"
         params = []
         
-        if search:
+        fts_sql, fts_params = None, []
+        if search and has_search_index(conn, 'callcenter_records_fts'):
+            fts_sql, fts_params = search_filter('callcenter_records_fts', search)
+        if fts_sql:
+            sql += f" AND id IN ({fts_sql})"
+            params.extend(fts_params)
+        elif search:
             sql += " AND (caller_id LIKE ? OR destination LIKE ?)"
             params.extend([f'%{search}%', f'%{search}%'])
         
         if date:
-            sql += " AND date(start_time) = ?"
-            params.append(date)
+            # Khoảng start_time thay vì date(start_time) để dùng được index
+            sql += " AND start_time >= ? AND start_time < date(?, '+1 day')"
+            params.extend([date, date])
         
-        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        if cursor_id is not None:
+            sql += " AND id < ? ORDER BY id DESC LIMIT ?"
+            params.extend([cursor_id, limit + 1])
+        else:
+            sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+            params.extend([limit + 1, offset])
         
         cursor.execute(sql, params)
         records = [dict(row) for row in cursor.fetchall()]
+        has_more = len(records) > limit
+        records = records[:limit]
         
         conn.close()
         
-        return jsonify({'records': records, 'page': page, 'limit': limit})
+        return jsonify({
+            'records': records,
+            'page': page,
+            'limit': limit,
+            'has_more': has_more,
+            'next_cursor': str(records[-1]['id']) if has_more else None
+        })
     except Exception as e:
         return jsonify({'error': str(e), 'records': []}), 200
 
@@ -451,72 +746,65 @@ def db_viewer():
     return send_from_directory('dashboard', 'db.html')
 
 @app.route('/api/db/tables')
+@cached_response
 def api_db_tables():
-    """List all tables with row counts"""
+    """
+    List all tables with row counts
+    Số dòng + dung lượng đọc từ table_stats (writer cập nhật), không COUNT(*) từng bảng.
+    approx=true: ước lượng từ sqlite_stat1
+    """
     if not USE_DATABASE:
         return jsonify({'error': 'Database not available'}), 503
     
     conn = vttech_db.get_conn()
-    cursor = conn.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name NOT LIKE 'sqlite_%'
-        ORDER BY name
-    """)
-    tables = []
-    for row in cursor.fetchall():
-        name = row['name']
-        count_cursor = conn.execute(f"SELECT COUNT(*) as count FROM {name}")
-        count = count_cursor.fetchone()['count']
-        tables.append({'name': name, 'count': count})
-    conn.close()
-    return jsonify(tables)
+    return jsonify(read_table_stats(conn))
 
 @app.route('/api/db/stats')
+@cached_response
 def api_db_stats():
-    """Database statistics"""
+    """Database statistics (số trang, freelist từ PRAGMA; số dòng từ table_stats)"""
     if not USE_DATABASE:
         return jsonify({'error': 'Database not available'}), 503
     
-    import os
-    db_path = BASE_DIR / "database" / "vttech.db"
-    db_size = os.path.getsize(db_path) if db_path.exists() else 0
-    
-    # Format size
-    if db_size > 1024 * 1024:
-        size_str = f"{db_size / 1024 / 1024:.2f} MB"
-    elif db_size > 1024:
-        size_str = f"{db_size / 1024:.2f} KB"
-    else:
-        size_str = f"{db_size} B"
-    
     conn = vttech_db.get_conn()
-    cursor = conn.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name NOT LIKE 'sqlite_%'
-    """)
-    tables = [row['name'] for row in cursor.fetchall()]
-    
-    total_records = 0
-    for table in tables:
-        count_cursor = conn.execute(f"SELECT COUNT(*) as count FROM {table}")
-        total_records += count_cursor.fetchone()['count']
-    
-    conn.close()
+    tables = read_table_stats(conn)
+    stats = database_stats(conn)
     
     return jsonify({
         'table_count': len(tables),
-        'total_records': total_records,
-        'db_size': size_str
+        'total_records': sum(t['count'] or 0 for t in tables),
+        'db_size': format_size(stats['size_bytes']),
+        'freelist_size': format_size(stats['freelist_bytes']),
+        'index_size': format_size(sum(t['index_bytes'] or 0 for t in tables)),
+        **stats,
     })
 
+
+def format_size(size: int) -> str:
+    """Format size"""
+    if size > 1024 * 1024:
+        return f"{size / 1024 / 1024:.2f} MB"
+    elif size > 1024:
+        return f"{size / 1024:.2f} KB"
+    return f"{size} B"
+
+
 @app.route('/api/db/query', methods=['POST'])
 def api_db_query():
-    """Execute SQL query (SELECT only)"""
+    """
+    Execute SQL query (SELECT only)
+    Body: {sql, explain?, format?}
+    - Chỉ đọc tối đa DB_QUERY_MAX_ROWS dòng (fetchmany, không fetchall cả bảng), truncated=true nếu còn
+    - Query chạy quá DB_QUERY_TIME_LIMIT giây bị SQLite ngắt (progress handler) -> 400
+    - explain=true -> trả EXPLAIN QUERY PLAN thay vì chạy query
+    - format='ndjson' (hoặc Accept: application/x-ndjson) -> stream từng dòng:
+      dòng đầu {"columns": [...]}, mỗi dòng sau là 1 row, dòng cuối {"truncated": ...} hoặc {"error": ...}
+    """
     if not USE_DATABASE:
         return jsonify({'error': 'Database not available'}), 503
     
-    data = request.get_json()
-    sql = data.get('sql', '').strip()
+    data = request.get_json(silent=True) or {}
+    sql = (data.get('sql') or '').strip().rstrip(';').strip()
     
     if not sql:
         return jsonify({'error': 'SQL query is required'}), 400
@@ -532,26 +820,121 @@ def api_db_query():
         if keyword in sql_upper:
             return jsonify({'error': f'Không cho phép sử dụng {keyword}'}), 400
     
-    try:
-        conn = vttech_db.get_conn()
-        cursor = conn.execute(sql)
-        columns = [desc[0] for desc in cursor.description] if cursor.description else []
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
+    conn = vttech_db.get_conn()
+    
+    if data.get('explain'):
+        try:
+            with QueryTimeLimit(conn):
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
         return jsonify({
-            'columns': columns,
-            'rows': rows[:1000]  # Limit 1000 rows
+            'columns': ['id', 'parent', 'detail'],
+            'rows': [{'id': r[0], 'parent': r[1], 'detail': r[3]} for r in plan],
+            'explain': True,
         })
+    
+    stream = (data.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    if stream:
+        return app.response_class(stream_with_context(stream_query_rows(conn, sql)),
+                                  mimetype='application/x-ndjson')
+    
+    try:
+        with QueryTimeLimit(conn):
+            cursor = conn.execute(sql)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            # Đọc thêm 1 dòng để biết còn dữ liệu (truncated) mà không đọc hết bảng
+            rows = cursor.fetchmany(DB_QUERY_MAX_ROWS + 1)
+            cursor.close()
     except Exception as e:
-        return jsonify({'error': str(e)}), 400
+        return jsonify({'error': query_error_message(e)}), 400
+    
+    truncated = len(rows) > DB_QUERY_MAX_ROWS
+    return jsonify({
+        'columns': columns,
+        'rows': [dict(row) for row in rows[:DB_QUERY_MAX_ROWS]],
+        'truncated': truncated,
+    })
+
+
+def stream_query_rows(conn, sql):
+    """Generator NDJSON cho /api/db/query: đọc theo từng batch, dừng ở DB_QUERY_MAX_ROWS"""
+    try:
+        with QueryTimeLimit(conn):
+            cursor = conn.execute(sql)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            yield ndjson_dumps({'columns': columns}) + b'\n'
+    
+            sent = 0
+            while sent < DB_QUERY_MAX_ROWS:
+                batch = cursor.fetchmany(min(DB_QUERY_STREAM_BATCH, DB_QUERY_MAX_ROWS - sent))
+                if not batch:
+                    break
+                sent += len(batch)
+                yield b''.join(ndjson_dumps(dict(row)) + b'\n' for row in batch)
+    
+            truncated = sent >= DB_QUERY_MAX_ROWS and cursor.fetchone() is not None
+            cursor.close()
+        yield ndjson_dumps({'truncated': truncated, 'row_count': sent}) + b'\n'
+    except Exception as e:
+        # Header 200 đã gửi -> báo lỗi bằng dòng cuối
+        yield ndjson_dumps({'error': query_error_message(e)}) + b'\n'
+
+
+def ndjson_dumps(obj) -> bytes:
+    """1 dòng NDJSON (giá trị không serialize được, vd. BLOB -> str)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+
+class QueryTimeLimit:
+    """
+    Giới hạn thời gian chạy query bằng progress handler của SQLite:
+    quá DB_QUERY_TIME_LIMIT giây -> SQLite ngắt query (OperationalError: interrupted).
+    Luôn gỡ handler khi xong vì connection được trả về pool dùng lại
+    """
+
+    def __init__(self, conn, seconds: float = None):
+        self.conn = conn
+        self.seconds = DB_QUERY_TIME_LIMIT if seconds is None else seconds
+        self.timed_out = False
+
+    def _check(self):
+        if time.monotonic() > self.deadline:
+            self.timed_out = True
+            return 1
+        return 0
+
+    def __enter__(self):
+        self.deadline = time.monotonic() + self.seconds
+        self.conn.set_progress_handler(self._check, DB_QUERY_PROGRESS_STEPS)
+        g.query_limit = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.set_progress_handler(None, 0)
+        return False
+
+
+def query_error_message(exc):
+    """Thông báo lỗi cho /api/db/query (query bị ngắt vì quá thời gian thì nói rõ)"""
+    limit = g.get('query_limit')
+    if limit is not None and limit.timed_out:
+        return f'Query chạy quá {limit.seconds:g}s, đã bị dừng (thêm điều kiện WHERE / LIMIT)'
+    return str(exc)
 
 
 # ============== CUSTOMER SYNC API ROUTES ==============
 
 @app.route('/api/customers')
 def api_customers():
-    """Get customers with pagination"""
+    """
+    Get customers with pagination
+    Truyền ?cursor=<next_cursor> để lấy trang kế (keyset theo id, không chậm dần khi
+    xuống sâu), ?page= (OFFSET) vẫn hỗ trợ để nhảy trang. total được cache theo bộ lọc
+    """
     if not USE_DATABASE:
         return jsonify({'error': 'Database not available', 'records': []}), 503
     
@@ -559,33 +942,52 @@ def api_customers():
     limit = request.args.get('limit', 50, type=int)
     search = request.args.get('search', '')
     branch_id = request.args.get('branch_id', type=int)
+    try:
+        cursor_id = parse_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor', 'records': [], 'total': 0}), 400
     
     offset = (page - 1) * limit
     
     try:
         conn = vttech_db.get_conn()
         
-        sql = "SELECT c.*, b.name as branch_name FROM customers c LEFT JOIN branches b ON c.branch_id = b.id WHERE 1=1"
+        where = ""
         params = []
         
-        if search:
-            sql += " AND (c.name LIKE ? OR c.phone LIKE ? OR c.code LIKE ?)"
+        # Tìm qua customers_fts (không dấu), database chưa có index -> LIKE
+        fts_sql, fts_params = None, []
+        if search and has_search_index(conn, 'customers_fts'):
+            fts_sql, fts_params = search_filter('customers_fts', search)
+        if fts_sql:
+            where += f" AND c.id IN ({fts_sql})"
+            params.extend(fts_params)
+        elif search:
+            where += " AND (c.name LIKE ? OR c.phone LIKE ? OR c.code LIKE ?)"
             params.extend([f'%{search}%', f'%{search}%', f'%{search}%'])
         
         if branch_id:
-            sql += " AND c.branch_id = ?"
+            where += " AND c.branch_id = ?"
             params.append(branch_id)
         
-        # Count total
-        count_sql = sql.replace("SELECT c.*, b.name as branch_name", "SELECT COUNT(*) as total")
-        cursor = conn.execute(count_sql, params)
-        total = cursor.fetchone()['total']
+        # Count total (cache theo bộ lọc)
+        total = cached_count(
+            conn, ('customers', search, branch_id),
+            f"SELECT COUNT(*) FROM customers c WHERE 1=1{where}", params
+        )
         
-        sql += " ORDER BY c.id DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        sql = f"SELECT c.*, b.name as branch_name FROM customers c LEFT JOIN branches b ON c.branch_id = b.id WHERE 1=1{where}"
+        if cursor_id is not None:
+            sql += " AND c.id < ? ORDER BY c.id DESC LIMIT ?"
+            params = params + [cursor_id, limit + 1]
+        else:
+            sql += " ORDER BY c.id DESC LIMIT ? OFFSET ?"
+            params = params + [limit + 1, offset]
         
         cursor = conn.execute(sql, params)
         records = [dict(row) for row in cursor.fetchall()]
+        has_more = len(records) > limit
+        records = records[:limit]
         
         conn.close()
         
@@ -594,70 +996,132 @@ def api_customers():
             'total': total,
             'page': page,
             'limit': limit,
-            'total_pages': (total + limit - 1) // limit
+            'total_pages': (total + limit - 1) // limit,
+            'has_more': has_more,
+            'next_cursor': str(records[-1]['id']) if has_more else None
         })
     except Exception as e:
         return jsonify({'error': str(e), 'records': [], 'total': 0}), 200
 
 
+# Các phần của /api/customers/<id>: tên trong response -> bảng chi tiết
+CUSTOMER_DETAIL_SECTIONS = {
+    'services': 'customer_services',
+    'treatments': 'customer_treatments',
+    'payments': 'customer_payments',
+    'appointments': 'customer_appointments',
+    'history': 'customer_history',
+}
+# Cột nội bộ của sync (tìm kiếm, incremental detail): chỉ trả khi ?fields= ghi rõ tên cột
+INTERNAL_COLUMNS = {'search_name', 'list_fingerprint'}
+_table_columns_cache = {}
+
+def table_columns(conn, table):
+    """Danh sách cột của bảng (cache theo schema_version, bảng không tồn tại -> [])"""
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    key = (table, schema_version)
+    columns = _table_columns_cache.get(key)
+    if columns is None:
+        columns = _table_columns_cache[key] = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    return columns
+
+def parse_fields(value):
+    """
+    ?fields=customer,services.service_name,payments -> {phần: set(cột) hoặc None = tất cả cột}.
+    Không truyền -> None (tất cả các phần)
+    """
+    if not value:
+        return None
+    fields = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        section, _, column = item.partition('.')
+        if column:
+            if fields.get(section, set()) is not None:
+                fields.setdefault(section, set()).add(column)
+        else:
+            fields[section] = None
+    return fields
+
+def json_pairs_sql(columns, alias):
+    """'col', alias."col", ... cho json_object() (tên cột lấy từ PRAGMA table_info)"""
+    return ', '.join(
+        "'{0}', {1}.\"{2}\"".format(col.replace("'", "''"), alias, col.replace('"', '""')) for col in columns
+    )
+
+def select_columns(all_columns, wanted, include_raw):
+    """
+    Lọc cột theo ?fields= (wanted=None -> tất cả), bỏ raw_data trừ khi ?raw_data=1,
+    bỏ INTERNAL_COLUMNS trừ khi có trong ?fields=
+    """
+    columns = [col for col in all_columns if include_raw or col != 'raw_data']
+    if wanted is None:
+        return [col for col in columns if col not in INTERNAL_COLUMNS]
+    return [col for col in columns if col in wanted]
+
 @app.route('/api/customers/<int:customer_id>')
 def api_customer_detail(customer_id):
-    """Get customer detail with services, treatments, payments, etc."""
+    """
+    Get customer detail with services, treatments, payments, etc.
+    Toàn bộ response được dựng trong 1 câu SQL (json_object/json_group_array).
+    ?fields=customer,services.service_name,... chỉ lấy các phần/cột cần, ?raw_data=1 để kèm raw_data
+    """
     if not USE_DATABASE:
         return jsonify({'error': 'Database not available'}), 503
     
+    fields = parse_fields(request.args.get('fields'))
+    include_raw = request.args.get('raw_data', '').lower() in ('1', 'true', 'yes')
+    
     try:
         conn = vttech_db.get_conn()
         
-        # Customer info
-        cursor = conn.execute("""
-            SELECT c.*, b.name as branch_name 
-            FROM customers c 
-            LEFT JOIN branches b ON c.branch_id = b.id 
-            WHERE c.id = ?
-        """, (customer_id,))
-        customer = cursor.fetchone()
+        parts = []
+        if fields is None or 'customer' in fields:
+            wanted = None if fields is None else fields['customer']
+            columns = select_columns(table_columns(conn, 'customers'), wanted, include_raw)
+            pairs = [json_pairs_sql(columns, 'c')]
+            if wanted is None or 'branch_name' in wanted:
+                pairs.append("'branch_name', b.name")
+            pairs = ', '.join(filter(None, pairs))
+            parts.append(f"'customer', json_object({pairs})")
         
-        if not customer:
-            return jsonify({'error': 'Customer not found'}), 404
-        
-        customer_data = dict(customer)
-        
-        # Services
-        cursor = conn.execute("SELECT * FROM customer_services WHERE customer_id = ?", (customer_id,))
-        services = [dict(row) for row in cursor.fetchall()]
-        
-        # Treatments
-        cursor = conn.execute("SELECT * FROM customer_treatments WHERE customer_id = ?", (customer_id,))
-        treatments = [dict(row) for row in cursor.fetchall()]
-        
-        # Payments
-        cursor = conn.execute("SELECT * FROM customer_payments WHERE customer_id = ?", (customer_id,))
-        payments = [dict(row) for row in cursor.fetchall()]
+        for section, table in CUSTOMER_DETAIL_SECTIONS.items():
+            if fields is not None and section not in fields:
+                continue
+            columns = select_columns(
+                table_columns(conn, table), None if fields is None else fields[section], include_raw
+            )
+            if not columns:
+                parts.append(f"'{section}', json('[]')")
+                continue
+            # json(): giữ kiểu JSON khi đi qua subquery (không bị thành chuỗi)
+            parts.append(f"""
+                '{section}', json((
+                    SELECT json_group_array(json_object({json_pairs_sql(columns, 't')}))
+                    FROM (SELECT * FROM {table} WHERE customer_id = c.id ORDER BY id) t
+                ))
+            """)
         
-        # Appointments
-        cursor = conn.execute("SELECT * FROM customer_appointments WHERE customer_id = ?", (customer_id,))
-        appointments = [dict(row) for row in cursor.fetchall()]
-        
-        # History
-        cursor = conn.execute("SELECT * FROM customer_history WHERE customer_id = ?", (customer_id,))
-        history = [dict(row) for row in cursor.fetchall()]
+        row = conn.execute(f"""
+            SELECT json_object({', '.join(parts)})
+            FROM customers c
+            LEFT JOIN branches b ON c.branch_id = b.id
+            WHERE c.id = ?
+        """, (customer_id,)).fetchone()
         
-        conn.close()
+        if not row:
+            return jsonify({'error': 'Customer not found'}), 404
         
-        return jsonify({
-            'customer': customer_data,
-            'services': services,
-            'treatments': treatments,
-            'payments': payments,
-            'appointments': appointments,
-            'history': history
-        })
+        # JSON dựng sẵn từ SQLite, trả thẳng không parse/serialize lại
+        return app.response_class(row[0], mimetype='application/json')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/customers/stats')
+@cached_response
 def api_customers_stats():
     """Customer statistics"""
     if not USE_DATABASE:
@@ -765,8 +1229,9 @@ def api_sync_logs():
 # Import callcenter repository
 try:
     sys.path.insert(0, str(BASE_DIR / 'callcenter'))
-    from callcenter.repository import repo as callcenter_repo
+    from callcenter.repository import CallCenterRepository
     from callcenter.init_callcenter_db import init_callcenter_database, migrate_database
+    callcenter_repo = CallCenterRepository(readonly=True, conn_provider=lambda: request_conn(CALLCENTER_DB_PATH))
     CALLCENTER_ENABLED = True
     # Init database on startup
     init_callcenter_database()
@@ -884,7 +1349,38 @@ def api_callcenter_call_detail(uuid):
 
 # ============== MAIN ==============
 
+def serve(host='0.0.0.0', port=5000, threads=8, dev=False):
+    """
+    Chạy server: mặc định waitress (WSGI production, nhiều thread),
+    --dev -> Flask development server (debug, auto-reload).
+    Chưa cài waitress -> Flask server nhưng tắt debug (debugger Werkzeug cho chạy code từ xa)
+    """
+    if dev:
+        app.run(host=host, port=port, debug=True, threaded=True)
+        return
+
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        print("⚠️ Chưa cài waitress (pip install waitress), dùng Flask server (không debug)")
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+
+    # Mỗi thread giữ tối đa 1 connection / database trong lúc xử lý request
+    global DB_POOL_SIZE
+    DB_POOL_SIZE = max(DB_POOL_SIZE, threads)
+    waitress_serve(app, host=host, port=port, threads=threads)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VTTech Dashboard Server')
+    parser.add_argument('--host', default=os.getenv('DASHBOARD_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('DASHBOARD_PORT', '5000')))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('DASHBOARD_THREADS', '8')),
+                        help='Số thread xử lý request (waitress)')
+    parser.add_argument('--dev', action='store_true', help='Flask development server (debug, auto-reload)')
+    args = parser.parse_args()
+    
     # Tạo thư mục dashboard nếu chưa có
     dashboard_dir = BASE_DIR / "dashboard"
     dashboard_dir.mkdir(exist_ok=True)
@@ -895,8 +1391,10 @@ if __name__ == '__main__':
     print(f"📁 Data directory: {DATA_DAILY_DIR}")
     print(f"💾 Database mode: {'ENABLED' if USE_DATABASE else 'DISABLED'}")
     print(f"📞 Call Center: {'ENABLED' if CALLCENTER_ENABLED else 'DISABLED'}")
-    print(f"🌐 Dashboard: http://localhost:5000")
-    print(f"🗄️  DB Viewer: http://localhost:5000/db")
+    print(f"⚙️  Mode: {'development' if args.dev else f'production ({args.threads} threads)'}")
+    print(f"🗜️  JSON: {'orjson' if OrjsonProvider else 'json'}, nén: {'br + gzip' if brotli else 'gzip'}")
+    print(f"🌐 Dashboard: http://localhost:{args.port}")
+    print(f"🗄️  DB Viewer: http://localhost:{args.port}/db")
     print("=" * 50)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    serve(args.host, args.port, args.threads, args.dev)
@@ -11,17 +11,22 @@ from typing import List, Dict, Optional, Any
 import sys
 
 sys.path.insert(0, str(Path(__file__).parent))
-from init_db import get_connection, DB_PATH
+from init_db import get_connection, refresh_revenue_summaries, DB_PATH
 
 
 class VTTechDB:
     """Database repository class"""
     
-    def __init__(self):
+    def __init__(self, readonly: bool = False, conn_provider=None):
+        """conn_provider: hàm trả về connection (vd. connection theo request của dashboard)"""
         self.db_path = DB_PATH
+        self.readonly = readonly
+        self.conn_provider = conn_provider
     
     def get_conn(self):
-        return get_connection()
+        if self.conn_provider:
+            return self.conn_provider()
+        return get_connection(readonly=self.readonly)
     
     # ============== WRITE METHODS ==============
     
@@ -71,6 +76,7 @@ class VTTechDB:
                 data.get('AppChecked', 0),
                 datetime.now().isoformat()
             ))
+            refresh_revenue_summaries(conn, [date])
             conn.commit()
             return True
         except Exception as e:
@@ -102,6 +108,7 @@ class VTTechDB:
                     data.get('AppChecked', 0)
                 ))
                 count += 1
+            refresh_revenue_summaries(conn, [date])
             conn.commit()
         except Exception as e:
             print(f"Error batch insert: {e}")
@@ -149,31 +156,39 @@ class VTTechDB:
         conn.close()
         return result
     
+    def _query_summary(self, sql: str, params: tuple, fallback_sql: str) -> List[Dict]:
+        """
+        Đọc bảng tổng hợp (revenue_*_summary).
+        Database cũ chưa có bảng (chưa sync lại) -> đọc view/daily_revenue như trước
+        """
+        conn = self.get_conn()
+        try:
+            try:
+                cursor = conn.execute(sql, params)
+            except sqlite3.OperationalError:
+                cursor = conn.execute(fallback_sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+    
     def get_daily_summary(self, limit: int = 30) -> List[Dict]:
         """Lấy tổng hợp doanh thu theo ngày"""
-        conn = self.get_conn()
-        cursor = conn.execute("""
-            SELECT * FROM v_daily_summary LIMIT ?
-        """, (limit,))
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return result
+        return self._query_summary(
+            "SELECT * FROM revenue_daily_summary ORDER BY date DESC LIMIT ?", (limit,),
+            "SELECT * FROM v_daily_summary LIMIT ?"
+        )
     
     def get_monthly_summary(self, limit: int = 12) -> List[Dict]:
         """Lấy tổng hợp doanh thu theo tháng"""
-        conn = self.get_conn()
-        cursor = conn.execute("""
-            SELECT * FROM v_monthly_summary LIMIT ?
-        """, (limit,))
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return result
+        return self._query_summary(
+            "SELECT * FROM revenue_monthly_summary ORDER BY month DESC LIMIT ?", (limit,),
+            "SELECT * FROM v_monthly_summary LIMIT ?"
+        )
     
     def get_branch_performance(self, start_date: str = None, end_date: str = None) -> List[Dict]:
         """Lấy hiệu suất chi nhánh"""
-        conn = self.get_conn()
-        
         if start_date and end_date:
+            conn = self.get_conn()
             cursor = conn.execute("""
                 SELECT 
                     branch_id,
@@ -187,22 +202,31 @@ class VTTechDB:
                 GROUP BY branch_id, branch_name
                 ORDER BY total_paid DESC
             """, (start_date, end_date))
-        else:
-            cursor = conn.execute("SELECT * FROM v_branch_performance")
+            result = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            return result
         
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return result
+        # Toàn bộ lịch sử: cộng các dòng theo tháng thay vì quét daily_revenue
+        return self._query_summary("""
+            SELECT 
+                branch_id,
+                MAX(branch_name) as branch_name,
+                SUM(days_active) as days_active,
+                SUM(total_paid) as total_paid,
+                SUM(total_paid) / NULLIF(SUM(paid_count), 0) as avg_daily_paid,
+                SUM(total_customers) as total_customers
+            FROM revenue_branch_monthly_summary
+            GROUP BY branch_id
+            ORDER BY total_paid DESC
+        """, (), "SELECT * FROM v_branch_performance")
     
     def get_available_dates(self) -> List[str]:
         """Lấy danh sách các ngày có dữ liệu"""
-        conn = self.get_conn()
-        cursor = conn.execute("""
-            SELECT DISTINCT date FROM daily_revenue ORDER BY date DESC
-        """)
-        result = [row['date'] for row in cursor.fetchall()]
-        conn.close()
-        return result
+        rows = self._query_summary(
+            "SELECT date FROM revenue_daily_summary ORDER BY date DESC", (),
+            "SELECT DISTINCT date FROM daily_revenue ORDER BY date DESC"
+        )
+        return [row['date'] for row in rows]
     
     def get_latest_date(self) -> Optional[str]:
         """Lấy ngày mới nhất có dữ liệu"""
@@ -302,8 +326,12 @@ class VTTechDB:
     
     def get_trend(self, days: int = 30) -> List[Dict]:
         """Lấy xu hướng N ngày gần nhất"""
-        conn = self.get_conn()
-        cursor = conn.execute("""
+        result = self._query_summary("""
+            SELECT date, total_paid, total_paid_new, total_customers
+            FROM revenue_daily_summary
+            ORDER BY date DESC
+            LIMIT ?
+        """, (days,), """
             SELECT 
                 date,
                 SUM(paid) as total_paid,
@@ -313,9 +341,7 @@ class VTTechDB:
             GROUP BY date
             ORDER BY date DESC
             LIMIT ?
-        """, (days,))
-        result = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        """)
         return list(reversed(result))
 
 
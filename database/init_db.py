@@ -4,19 +4,141 @@ VTTech Database Schema
 Khởi tạo SQLite database với schema tối ưu cho phân tích
 """
 
-import sqlite3
+import sys
 from pathlib import Path
-from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).parent))
+from sqlite_conn import get_writer, get_reader
+from table_stats import ensure_table_stats, read_table_stats
 
 # Database path
 DB_PATH = Path(__file__).parent / "vttech.db"
 
-def get_connection():
-    """Lấy connection đến database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Trả về dict-like rows
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+# Bảng tổng hợp doanh thu (materialized từ daily_revenue), dashboard đọc các bảng này
+# thay vì view v_*_summary quét lại toàn bộ daily_revenue
+REVENUE_SUMMARY_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS revenue_daily_summary (
+        date DATE PRIMARY KEY,
+        branch_count INTEGER DEFAULT 0,
+        total_paid REAL,
+        total_paid_new REAL,
+        total_raise REAL,
+        total_customers INTEGER,
+        total_appointments INTEGER,
+        total_checked_in INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS revenue_monthly_summary (
+        month TEXT PRIMARY KEY,            -- YYYY-MM
+        days_count INTEGER DEFAULT 0,
+        branch_count INTEGER DEFAULT 0,
+        total_paid REAL,
+        total_paid_new REAL,
+        total_customers INTEGER,
+        avg_daily_revenue REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS revenue_branch_monthly_summary (
+        month TEXT NOT NULL,               -- YYYY-MM
+        branch_id INTEGER NOT NULL,
+        branch_name TEXT,
+        days_active INTEGER DEFAULT 0,
+        paid_count INTEGER DEFAULT 0,      -- Số ngày có paid (để tính AVG)
+        total_paid REAL,
+        total_customers INTEGER,
+        PRIMARY KEY (month, branch_id)
+    ) WITHOUT ROWID
+    """,
+]
+
+REVENUE_DAILY_REFRESH_SQL = """
+    INSERT INTO revenue_daily_summary
+        (date, branch_count, total_paid, total_paid_new, total_raise,
+         total_customers, total_appointments, total_checked_in)
+    SELECT date, COUNT(DISTINCT branch_id), SUM(paid), SUM(paid_new), SUM(raise_amount),
+           SUM(num_customers), SUM(num_appointments), SUM(num_checked_in)
+    FROM daily_revenue
+    WHERE date = ?
+    GROUP BY date
+"""
+
+# ?1 = YYYY-MM
+REVENUE_MONTHLY_REFRESH_SQL = """
+    INSERT INTO revenue_monthly_summary
+        (month, days_count, branch_count, total_paid, total_paid_new, total_customers, avg_daily_revenue)
+    SELECT ?1, COUNT(DISTINCT date), COUNT(DISTINCT branch_id), SUM(paid), SUM(paid_new),
+           SUM(num_customers), AVG(paid)
+    FROM daily_revenue
+    WHERE date >= ?1 || '-01' AND date < date(?1 || '-01', '+1 month')
+    GROUP BY substr(date, 1, 7)
+"""
+
+REVENUE_BRANCH_MONTHLY_REFRESH_SQL = """
+    INSERT INTO revenue_branch_monthly_summary
+        (month, branch_id, branch_name, days_active, paid_count, total_paid, total_customers)
+    SELECT ?1, branch_id, MAX(branch_name), COUNT(DISTINCT date), COUNT(paid), SUM(paid), SUM(num_customers)
+    FROM daily_revenue
+    WHERE date >= ?1 || '-01' AND date < date(?1 || '-01', '+1 month')
+    GROUP BY branch_id
+"""
+
+
+def get_connection(readonly: bool = False):
+    """Lấy connection đến database (writer dùng chung của process, hoặc reader read-only)"""
+    return get_reader(DB_PATH) if readonly else get_writer(DB_PATH)
+
+
+def ensure_revenue_summaries(conn):
+    """Tạo các bảng tổng hợp doanh thu nếu chưa có (lần đầu: tính từ daily_revenue đã có)"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'revenue_branch_monthly_summary'"
+    ).fetchone()
+    if exists:
+        return
+
+    for sql in REVENUE_SUMMARY_SCHEMA:
+        conn.execute(sql)
+    dates = [row[0] for row in conn.execute("SELECT DISTINCT date FROM daily_revenue")]
+    refresh_revenue_summaries(conn, dates)
+
+
+def refresh_revenue_summaries(conn, dates):
+    """
+    Tính lại bảng tổng hợp cho các ngày vừa ghi daily_revenue (và các tháng chứa chúng).
+    Chạy trong transaction của caller, caller tự commit
+    """
+    ensure_revenue_summaries(conn)
+    dates = sorted({str(d)[:10] for d in dates if d})
+    if not dates:
+        return
+    months = sorted({d[:7] for d in dates})
+
+    conn.executemany("DELETE FROM revenue_daily_summary WHERE date = ?", [(d,) for d in dates])
+    conn.executemany(REVENUE_DAILY_REFRESH_SQL, [(d,) for d in dates])
+
+    conn.executemany("DELETE FROM revenue_monthly_summary WHERE month = ?", [(m,) for m in months])
+    conn.executemany(REVENUE_MONTHLY_REFRESH_SQL, [(m,) for m in months])
+    conn.executemany("DELETE FROM revenue_branch_monthly_summary WHERE month = ?", [(m,) for m in months])
+    conn.executemany(REVENUE_BRANCH_MONTHLY_REFRESH_SQL, [(m,) for m in months])
+
+
+def rebuild_revenue_summaries():
+    """Tính lại toàn bộ bảng tổng hợp doanh thu từ daily_revenue"""
+    conn = get_connection()
+    try:
+        ensure_revenue_summaries(conn)
+        conn.execute("DELETE FROM revenue_daily_summary")
+        conn.execute("DELETE FROM revenue_monthly_summary")
+        conn.execute("DELETE FROM revenue_branch_monthly_summary")
+        dates = [row[0] for row in conn.execute("SELECT DISTINCT date FROM daily_revenue")]
+        refresh_revenue_summaries(conn, dates)
+        conn.commit()
+    finally:
+        conn.close()
+    print("✅ Revenue summaries rebuilt")
 
 def init_database():
     """Khởi tạo database schema"""
@@ -278,6 +400,13 @@ def init_database():
         ORDER BY total_paid DESC
     """)
     
+    # ============== SUMMARY TABLES ==============
+    
+    ensure_revenue_summaries(conn)
+    
+    # Số dòng / bảng cho trang DB của dashboard
+    ensure_table_stats(conn)
+    
     conn.commit()
     conn.close()
     
@@ -288,20 +417,11 @@ def init_database():
 def get_table_info():
     """Lấy thông tin các bảng"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-    tables = cursor.fetchall()
-    
-    info = {}
-    for table in tables:
-        table_name = table['name']
-        cursor.execute(f"SELECT COUNT(*) as count FROM {table_name}")
-        count = cursor.fetchone()['count']
-        info[table_name] = count
-    
-    conn.close()
-    return info
+    try:
+        # Đọc từ table_stats, không COUNT(*) từng bảng
+        return {item['name']: item['count'] for item in read_table_stats(conn)}
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Master Data Sync
+/api/Home/SessionData trả về toàn bộ master data (chi nhánh, dịch vụ, nhân viên, địa giới...)
+mỗi lần gọi nhưng gần như không đổi, nên sync không ghi lại những gì đã có:
+
+- content_hash(): hash nội dung từng bảng API (JSON chuẩn hoá, không phụ thuộc thứ tự key)
+- Hash trùng lần sync trước -> bỏ qua cả bảng (không ghi file JSON, không ghi DB)
+- Hash khác -> sync_rows() so với DB theo khoá chính, chỉ INSERT / UPDATE các dòng thay đổi
+  (không xoá dòng không còn trên API: các script map key SessionData khác nhau vào cùng bảng)
+- Hash lưu trong bảng master_data_hashes (writer có DB) hoặc file JSON (crawler chỉ ghi file)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+MASTER_HASH_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS master_data_hashes (
+        scope TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        row_count INTEGER,
+        updated_at DATETIME
+    ) WITHOUT ROWID
+"""
+
+
+def content_hash(records) -> str:
+    """SHA-256 của dữ liệu API (key được sắp xếp -> cùng nội dung thì cùng hash)"""
+    payload = json.dumps(records, sort_keys=True, ensure_ascii=False,
+                         separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# ============== HASH STORE ==============
+
+def get_master_hash(conn: sqlite3.Connection, scope: str):
+    """Hash lần sync trước của scope (vd. 'sync_to_db:branches'), None nếu chưa có"""
+    try:
+        row = conn.execute(
+            "SELECT content_hash FROM master_data_hashes WHERE scope = ?", (scope,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def set_master_hash(conn: sqlite3.Connection, scope: str, digest: str, row_count: int):
+    """Lưu hash sau khi đã ghi xong bảng. Caller tự commit"""
+    conn.execute(MASTER_HASH_SCHEMA)
+    conn.execute("""
+        INSERT INTO master_data_hashes (scope, content_hash, row_count, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(scope) DO UPDATE SET
+            content_hash = excluded.content_hash,
+            row_count = excluded.row_count,
+            updated_at = excluded.updated_at
+    """, (scope, digest, row_count, datetime.now().isoformat()))
+
+
+def load_hash_file(path) -> dict:
+    """Hash store dạng file cho crawler không ghi DB ({scope: hash})"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hash_file(path, hashes: dict):
+    """Ghi file hash (ghi file tạm rồi rename -> không hỏng file khi bị ngắt giữa chừng)"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(hashes, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# ============== DIFF ==============
+
+def sync_rows(conn: sqlite3.Connection, table: str, columns, rows, key: str = 'id',
+              touch_column: str = None, missing: str = 'keep') -> dict:
+    """
+    Đồng bộ bảng master với rows (list tuple theo columns, columns[0] là khoá chính) theo diff:
+    - khoá mới -> INSERT, khoá đã có nhưng khác giá trị -> UPDATE, giống hệt -> không ghi
+    - rows được ghi vào bảng tạm cùng kiểu cột với table, nên khoá và giá trị được so sánh
+      sau type affinity (1 / 1.0 / '1' của cột INTEGER là như nhau); trùng khoá -> giữ dòng sau
+    - khoá không còn trong rows: missing='keep' (mặc định) -> giữ nguyên,
+      'deactivate' -> is_active = 0. Không bao giờ xoá dòng; rows rỗng -> không deactivate gì
+      (SessionData lỗi / thiếu bảng không được làm mất master data)
+    - touch_column (vd. updated_at) chỉ được set cho dòng INSERT / UPDATE
+    Trả về {'inserted', 'updated', 'deactivated', 'unchanged'}. Caller tự commit
+    """
+    columns = list(columns)
+    assert columns[0] == key, f"columns[0] phải là khoá chính {key}"
+    assert missing in ('keep', 'deactivate'), f"missing không hợp lệ: {missing}"
+
+    col_list = ', '.join(columns)
+    stage = f"_stage_{table}"
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} AS SELECT {col_list} FROM {table} WHERE 0")
+    conn.execute(f"DELETE FROM {stage}")
+    conn.executemany(
+        f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(row) for row in rows if row[0] is not None]
+    )
+    conn.execute(f"DELETE FROM {stage} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {stage} GROUP BY {key})")
+    staged = conn.execute(f"SELECT COUNT(*) FROM {stage}").fetchone()[0]
+
+    now = datetime.now().isoformat()
+    inserted = conn.execute(f"""
+        SELECT COUNT(*) FROM {stage} s
+        WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key})
+    """).fetchone()[0]
+
+    insert_columns = columns + ([touch_column] if touch_column else [])
+    data_columns = columns[1:]
+    if data_columns:
+        assignments = ', '.join(f"{c} = excluded.{c}" for c in insert_columns[1:])
+        changed = ' OR '.join(f"{c} IS NOT excluded.{c}" for c in data_columns)
+        conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        conflict = "DO NOTHING"
+
+    written = 0
+    if staged:
+        # WHERE true: tránh nhầm ON CONFLICT với cú pháp JOIN khi parse INSERT ... SELECT
+        touch = ', ?' if touch_column else ''
+        cursor = conn.execute(f"""
+            INSERT INTO {table} ({', '.join(insert_columns)})
+            SELECT {col_list}{touch} FROM {stage} WHERE true ORDER BY rowid
+            ON CONFLICT({key}) {conflict}
+        """, (now,) if touch_column else ())
+        written = cursor.rowcount
+
+    deactivated = 0
+    if staged and missing == 'deactivate':
+        touch = f", {touch_column} = ?" if touch_column else ''
+        cursor = conn.execute(f"""
+            UPDATE {table} SET is_active = 0{touch}
+            WHERE is_active IS NOT 0 AND {key} NOT IN (SELECT {key} FROM {stage})
+        """, (now,) if touch_column else ())
+        deactivated = cursor.rowcount
+
+    return {'inserted': inserted, 'updated': written - inserted,
+            'deactivated': deactivated, 'unchanged': staged - written}
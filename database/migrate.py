@@ -12,7 +12,7 @@ import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
-from init_db import get_connection, init_database, DB_PATH
+from init_db import get_connection, init_database, refresh_revenue_summaries, DB_PATH
 
 # Paths
 BASE_DIR = Path(__file__).parent.parent
@@ -340,6 +340,7 @@ def migrate_daily_revenue():
         return 0
     
     total_count = 0
+    migrated_dates = []
     
     for filepath in sorted(revenue_dir.glob("revenue_*.json")):
         # Extract date from filename: revenue_20251223.json -> 2025-12-23
@@ -374,8 +375,10 @@ def migrate_daily_revenue():
                 print(f"  Error: {e}")
         
         total_count += count
+        migrated_dates.append(date_formatted)
         print(f"  📅 {date_formatted}: {count} records")
     
+    refresh_revenue_summaries(conn, migrated_dates)
     conn.commit()
     conn.close()
     print(f"  ✅ Migrated {total_count} revenue records")
@@ -3,14 +3,17 @@
 Migration: Thêm các bảng customer detail
 """
 
-import sqlite3
 from pathlib import Path
 
+from search_index import ensure_search_index
+from sqlite_conn import get_writer
+from table_stats import ensure_table_stats
+
 DB_PATH = Path(__file__).parent / "vttech.db"
 
 def migrate():
     """Thêm các bảng customer detail"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_writer(DB_PATH)
     cursor = conn.cursor()
     
     # Bảng khách hàng chính
@@ -129,6 +132,12 @@ def migrate():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_branch ON customers(branch_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone)")
     
+    # Full-text search (tên/SĐT/mã, không dấu)
+    ensure_search_index(conn, 'customers_fts')
+    
+    # Số dòng / bảng cho trang DB của dashboard (trigger table_stats)
+    ensure_table_stats(conn)
+    
     conn.commit()
     conn.close()
     
@@ -139,6 +148,7 @@ def migrate():
     print("   - customer_payments")
     print("   - customer_appointments")
     print("   - customer_history")
+    print("   - customers_fts (search index)")
 
 if __name__ == "__main__":
     migrate()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Search Index
+FTS5 (trigram) cho tìm kiếm khách hàng / cuộc gọi thay vì LIKE '%...%' quét cả bảng
+
+- customers_fts: name, phone, code của customers (rowid = customers.id)
+- callcenter_records_fts: các số điện thoại của callcenter_records (rowid = id)
+- Tên được bỏ dấu tiếng Việt + chữ thường (fold_text) trước khi index, nên "nguyen" tìm được
+  "Nguyễn", "dao" tìm được "Đào". Trigram tự không phân biệt hoa / thường
+- Đồng bộ bằng trigger chỉ dùng hàm có sẵn của SQLite -> mọi writer (kể cả sqlite3 CLI,
+  DB browser, script restore) đều ghi được. Tên bỏ dấu do writer Python tính sẵn vào cột
+  customers.search_name; dòng chưa có search_name được index theo tên gốc và được
+  fill_search_columns() điền lại ở lần ensure_search_index() sau
+"""
+
+import sqlite3
+import unicodedata
+
+# Trigram chỉ index được chuỗi >= 3 ký tự, từ ngắn hơn lọc thêm bằng LIKE
+MIN_MATCH_LENGTH = 3
+
+# Bảng FTS -> (bảng gốc, các cột được index, biểu thức lấy giá trị từ NEW/OLD,
+#              khoá tự nhiên khi INSERT OR REPLACE sinh id mới,
+#              cột bỏ dấu tính sẵn -> cột gốc)
+SEARCH_INDEXES = {
+    'customers_fts': (
+        'customers',
+        ('name', 'phone', 'code'),
+        ('COALESCE({row}.search_name, {row}.name)', '{row}.phone', '{row}.code'),
+        None,
+        {'search_name': 'name'},
+    ),
+    'callcenter_records_fts': (
+        'callcenter_records',
+        ('caller', 'destination'),
+        ("COALESCE({row}.caller_id, '') || ' ' || COALESCE({row}.caller_id_number, '') || ' ' || "
+         "COALESCE({row}.outbound_caller_id_number, '')",
+         "COALESCE({row}.destination, '') || ' ' || COALESCE({row}.destination_number, '')"),
+        'uuid',
+        {},
+    ),
+}
+
+
+def fold_text(value):
+    """Bỏ dấu tiếng Việt + chữ thường ('Nguyễn Thị Đào' -> 'nguyen thi dao')"""
+    if value is None:
+        return None
+    text = unicodedata.normalize('NFD', str(value).replace('Đ', 'D').replace('đ', 'd'))
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+
+def has_search_index(conn: sqlite3.Connection, fts_table: str) -> bool:
+    """Database đã có bảng FTS chưa"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+    ).fetchone()
+    return row is not None
+
+
+def _drop_udf_triggers(conn: sqlite3.Connection, fts_table: str) -> bool:
+    """Xoá trigger đời cũ gọi fold_vn() (hàm Python, writer ngoài app không có). True nếu đã xoá"""
+    rows = conn.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type = 'trigger' AND name LIKE ? AND sql LIKE '%fold_vn(%'
+    """, (f"{fts_table}_%",)).fetchall()
+    for row in rows:
+        conn.execute(f'DROP TRIGGER IF EXISTS "{row[0]}"')
+    return bool(rows)
+
+
+def ensure_search_index(conn: sqlite3.Connection, fts_table: str):
+    """
+    Tạo bảng FTS + cột bỏ dấu + trigger đồng bộ cho fts_table (idempotent).
+    Lần đầu tạo (hoặc trigger đời cũ) -> index lại toàn bộ, sau đó điền search_name còn thiếu.
+    Caller tự commit
+    """
+    source, columns, values, natural_key, fold_columns = SEARCH_INDEXES[fts_table]
+
+    existing = {r[1] for r in conn.execute(f"PRAGMA table_info({source})")}
+    for fold_column in fold_columns:
+        if fold_column not in existing:
+            conn.execute(f"ALTER TABLE {source} ADD COLUMN {fold_column} TEXT")
+
+    rebuild = _drop_udf_triggers(conn, fts_table) or not has_search_index(conn, fts_table)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
+        USING fts5({', '.join(columns)}, tokenize = 'trigram')
+    """)
+
+    column_list = ', '.join(columns)
+    new_values = ', '.join(v.format(row='new') for v in values)
+
+    # INSERT OR REPLACE chỉ chạy trigger DELETE của dòng bị thay khi recursive_triggers bật
+    # (writer của sqlite_conn). Writer khác (sqlite3 CLI...) mặc định tắt: cùng id thì
+    # INSERT OR REPLACE vào index là đủ, id mới (AUTOINCREMENT) thì xoá dòng cũ theo khoá tự nhiên
+    if natural_key:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_bi BEFORE INSERT ON {source} BEGIN
+                DELETE FROM {fts_table}
+                WHERE rowid IN (SELECT id FROM {source} WHERE {natural_key} = new.{natural_key});
+            END
+        """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source} BEGIN
+            INSERT OR REPLACE INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE ON {source} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+            INSERT OR REPLACE INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    """)
+    # UPDATE đổi cột gốc mà không đổi cột bỏ dấu (writer ngoài app) -> bỏ giá trị cũ,
+    # index theo tên gốc cho tới khi fill_search_columns() điền lại
+    for fold_column, column in fold_columns.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_{fold_column}_au AFTER UPDATE OF {column} ON {source}
+            WHEN new.{column} IS NOT old.{column} AND new.{fold_column} IS old.{fold_column}
+            BEGIN
+                UPDATE {source} SET {fold_column} = NULL WHERE id = new.id;
+            END
+        """)
+
+    if rebuild:
+        rebuild_search_index(conn, fts_table)
+    fill_search_columns(conn, fts_table)
+
+
+def fill_search_columns(conn: sqlite3.Connection, fts_table: str) -> int:
+    """
+    Điền cột bỏ dấu còn NULL (dòng do writer không tính search_name ghi vào).
+    Trigger UPDATE index lại các dòng này. Trả về số dòng. Caller tự commit
+    """
+    source, _, _, _, fold_columns = SEARCH_INDEXES[fts_table]
+    count = 0
+    for fold_column, column in fold_columns.items():
+        rows = conn.execute(f"""
+            SELECT id, {column} FROM {source}
+            WHERE {fold_column} IS NULL AND {column} IS NOT NULL
+        """).fetchall()
+        conn.executemany(
+            f"UPDATE {source} SET {fold_column} = ? WHERE id = ?",
+            [(fold_text(row[1]), row[0]) for row in rows]
+        )
+        count += len(rows)
+    return count
+
+
+def rebuild_search_index(conn: sqlite3.Connection, fts_table: str) -> int:
+    """Index lại toàn bộ bảng gốc, trả về số dòng. Caller tự commit"""
+    source, columns, values, _, _ = SEARCH_INDEXES[fts_table]
+
+    row_values = ', '.join(v.format(row=source) for v in values)
+    conn.execute(f"DELETE FROM {fts_table}")
+    cursor = conn.execute(f"""
+        INSERT INTO {fts_table} (rowid, {', '.join(columns)})
+        SELECT id, {row_values} FROM {source}
+    """)
+    return cursor.rowcount
+
+
+def search_filter(fts_table: str, term: str):
+    """
+    Subquery trả về rowid khớp term (dùng: "id IN (<sql>)"), hoặc (None, []) nếu term rỗng.
+    Từ >= 3 ký tự -> MATCH trigram (AND), từ ngắn hơn -> LIKE trên nội dung đã bỏ dấu
+    """
+    _, columns, _, _, _ = SEARCH_INDEXES[fts_table]
+    tokens = (fold_text(term) or '').split()
+    if not tokens:
+        return None, []
+
+    long_tokens = [t for t in tokens if len(t) >= MIN_MATCH_LENGTH]
+    short_tokens = [t for t in tokens if len(t) < MIN_MATCH_LENGTH]
+
+    conditions = []
+    params = []
+    if long_tokens:
+        conditions.append(f"{fts_table} MATCH ?")
+        params.append(' AND '.join('"{}"'.format(t.replace('"', '""')) for t in long_tokens))
+
+    for token in short_tokens:
+        pattern = '%' + token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append('(' + ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ')')
+        params.extend([pattern] * len(columns))
+
+    return f"SELECT rowid FROM {fts_table} WHERE {' AND '.join(conditions)}", params
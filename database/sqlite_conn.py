@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+SQLite Connection Layer
+Connection dùng chung cho vttech.db và callcenter.db
+
+- WAL + synchronous=NORMAL, cache_size/mmap_size lớn, temp_store=MEMORY
+- 1 writer connection / process / database: close() chỉ trả connection về
+  (rollback nếu còn transaction dở), không đóng thật -> không tốn chi phí mở lại
+- Reader read-only (mode=ro + query_only), 1 connection / thread, không bao giờ
+  chặn writer (WAL) -> dùng cho dashboard, báo cáo
+- ReaderPool: pool connection read-only dùng chung giữa các thread của WSGI server
+  (dashboard lấy 1 connection / request, trả lại khi request kết thúc)
+- Writer commit có thay đổi dữ liệu -> tăng bảng data_version, reader (dashboard)
+  đọc get_data_version() để biết cache đã cũ chưa
+- Writer gắn trigger đếm dòng (table_stats) cho các bảng đã có khi mở lần đầu
+"""
+
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+
+from table_stats import ensure_table_stats
+
+logger = logging.getLogger('sqlite_conn')
+
+# Chờ tối đa khi database đang bị khóa (giây)
+BUSY_TIMEOUT = 30
+
+# Pragmas áp dụng cho mọi connection
+CACHE_SIZE_KB = 64 * 1024           # 64MB page cache / connection
+MMAP_SIZE = 256 * 1024 * 1024       # 256MB memory-mapped I/O
+
+# Số prepared statement giữ lại / connection (mặc định của sqlite3 là 128)
+CACHED_STATEMENTS = 512
+READER_POOL_SIZE = 8
+
+_writers = {}
+_writers_lock = threading.Lock()
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def _apply_pragmas(conn: sqlite3.Connection, readonly: bool = False):
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        # INSERT OR REPLACE chạy trigger DELETE cho dòng bị thay -> table_stats đếm đúng
+        conn.execute("PRAGMA recursive_triggers = ON")
+
+
+def _ensure_data_version(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    conn.commit()
+
+
+def get_data_version(conn: sqlite3.Connection) -> int:
+    """Số lần writer đã commit thay đổi dữ liệu (0 nếu database chưa có bảng data_version)"""
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+class WriterConnection(sqlite3.Connection):
+    """Writer connection: commit có thay đổi dữ liệu thì tăng data_version trong cùng transaction"""
+
+    _committed_changes = 0
+
+    def _bump_data_version(self):
+        if not self.in_transaction or self.total_changes == self._committed_changes:
+            return
+        try:
+            self.execute(
+                "UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1"
+            )
+        except sqlite3.OperationalError:
+            pass
+
+    def commit(self):
+        self._bump_data_version()
+        super().commit()
+        self._committed_changes = self.total_changes
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # "with conn:" commit trực tiếp ở tầng C, không qua commit() ở trên
+        if exc_type is None:
+            self._bump_data_version()
+        result = super().__exit__(exc_type, exc_value, traceback)
+        self._committed_changes = self.total_changes
+        return result
+
+
+class SharedWriterConnection(WriterConnection):
+    """
+    Writer connection dùng chung trong process.
+    get_writer() checkout, close() trả về; close() phải gọi từ thread đã checkout.
+    Không cho checkout lồng nhau trong cùng thread: connection lồng sẽ dùng chung
+    transaction với caller ngoài, commit/rollback bên trong làm hỏng việc của caller ngoài
+    -> truyền connection đang có xuống thay vì gọi get_writer() lần nữa
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkout_lock = threading.Lock()
+        self._owner = None
+
+    def checkout(self, timeout: float) -> bool:
+        if self._owner == threading.get_ident():
+            raise RuntimeError("Writer đã được checkout trong thread này, không get_writer() lồng nhau")
+        if not self._checkout_lock.acquire(timeout=timeout):
+            return False
+        self._owner = threading.get_ident()
+        return True
+
+    def close(self):
+        """Trả connection về pool (không đóng thật)"""
+        if self._owner is None:
+            return
+        if self._owner != threading.get_ident():
+            raise RuntimeError(
+                f"Writer được checkout ở thread {self._owner}, không close() từ thread khác"
+            )
+        if self.in_transaction:
+            # Caller không commit -> bỏ transaction dở như khi đóng connection
+            self.rollback()
+        self._owner = None
+        self._checkout_lock.release()
+
+    def close_shared(self):
+        """Đóng thật (khi process kết thúc)"""
+        if self.in_transaction:
+            self.rollback()
+        super().close()
+
+
+class ReaderConnection(sqlite3.Connection):
+    """Read-only connection của 1 thread, close() không đóng thật"""
+
+    def close(self):
+        pass
+
+    def close_shared(self):
+        super().close()
+
+
+class PooledReaderConnection(ReaderConnection):
+    """Read-only connection của ReaderPool, close() không đóng thật (pool thu hồi khi release)"""
+
+
+class ReaderPool:
+    """
+    Pool connection read-only cho 1 database, an toàn giữa nhiều thread.
+    Mỗi connection chỉ được 1 thread dùng tại 1 thời điểm (acquire -> release),
+    nên có thể chuyển qua lại giữa các worker thread của gunicorn/waitress
+    """
+
+    def __init__(self, db_path, size: int = READER_POOL_SIZE):
+        self.db_path = Path(db_path).resolve()
+        self.size = size
+        # LIFO: ưu tiên connection vừa dùng (page cache + statement cache còn nóng)
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"{self.db_path.as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT,
+                               check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+                               factory=PooledReaderConnection)
+        _apply_pragmas(conn, readonly=True)
+        return conn
+
+    def acquire(self, timeout: float = BUSY_TIMEOUT) -> sqlite3.Connection:
+        """Lấy 1 connection (mở thêm nếu pool chưa đủ size, hết thì chờ tối đa timeout giây)"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Reader pool {self.db_path.name} đã dùng hết {self.size} connection"
+            )
+
+    def release(self, conn: sqlite3.Connection):
+        """Trả connection về pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close_shared()
+                except Exception:
+                    pass
+            self._connections.clear()
+        self._idle = queue.LifoQueue()
+
+
+def get_reader_pool(db_path, size: int = READER_POOL_SIZE) -> ReaderPool:
+    """ReaderPool dùng chung của process cho db_path"""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReaderPool(key, size)
+        return pool
+
+
+def get_writer(db_path) -> sqlite3.Connection:
+    """
+    Writer connection dùng chung của process cho db_path.
+    Nếu thread khác giữ writer quá BUSY_TIMEOUT giây -> trả về connection riêng (đóng bình thường)
+    """
+    key = str(Path(db_path).resolve())
+    with _writers_lock:
+        conn = _writers.get(key)
+        if conn is None:
+            conn = sqlite3.connect(key, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                   factory=SharedWriterConnection)
+            _apply_pragmas(conn)
+            _ensure_data_version(conn)
+            ensure_table_stats(conn)
+            conn.commit()
+            _writers[key] = conn
+
+    if conn.checkout(BUSY_TIMEOUT):
+        return conn
+
+    logger.warning(f"⚠️ Writer {Path(key).name} đang bận, mở connection riêng")
+    conn = sqlite3.connect(key, timeout=BUSY_TIMEOUT, factory=WriterConnection)
+    _apply_pragmas(conn)
+    return conn
+
+
+def get_reader(db_path) -> sqlite3.Connection:
+    """Read-only connection (1 / thread / database)"""
+    path = Path(db_path).resolve()
+    readers = getattr(_local, 'readers', None)
+    if readers is None:
+        readers = _local.readers = {}
+
+    conn = readers.get(str(path))
+    if conn is None:
+        conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT,
+                               factory=ReaderConnection)
+        _apply_pragmas(conn, readonly=True)
+        readers[str(path)] = conn
+    return conn
+
+
+def close_all():
+    """Đóng writer connections và reader pools của process (tự gọi khi thoát)"""
+    with _writers_lock:
+        for conn in _writers.values():
+            try:
+                conn.close_shared()
+            except Exception:
+                pass
+        _writers.clear()
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+atexit.register(close_all)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Table Stats
+Số dòng + dung lượng từng bảng giữ sẵn trong bảng table_stats, để trang DB của dashboard
+không phải COUNT(*) toàn bộ các bảng (data_change_logs, bảng detail có raw_data...) mỗi lần mở
+
+- row_count bảng nhỏ: trigger AFTER INSERT / AFTER DELETE cộng / trừ khi writer ghi.
+  INSERT OR REPLACE xoá dòng cũ không qua trigger DELETE nếu recursive_triggers tắt,
+  nên trigger chỉ đúng với writer của sqlite_conn (bật recursive_triggers). Mọi script ghi
+  database đều qua sqlite_conn.get_writer (sync_customer_detail.py, sync_treatment_data.py,
+  crawl_vttech.py chỉ ghi file JSON); tool ngoài ghi -> chạy CLI bên dưới để đếm lại
+- row_count bảng ghi nhiều (SYNC_COUNTED_TABLES): không gắn trigger (không thêm 1 lệnh UPDATE
+  cho mỗi dòng ghi), sync ghi bảng nào thì COUNT(*) lại bảng đó khi kết thúc
+- pages / size_bytes / index_bytes: đo bằng dbstat khi refresh (đọc toàn bộ file -> không làm theo request)
+- sqlite_stat1 (ANALYZE): ước lượng số dòng cho bảng chưa có trong table_stats
+
+Usage:
+    python3 database/table_stats.py             # Đếm lại số dòng + đo dung lượng
+    python3 database/table_stats.py --sizes     # Chỉ đo dung lượng
+"""
+
+import argparse
+import sqlite3
+from datetime import datetime
+
+TABLE_STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS table_stats (
+        name TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        pages INTEGER,
+        size_bytes INTEGER,
+        index_pages INTEGER,
+        index_bytes INTEGER,
+        counted_at DATETIME,
+        sized_at DATETIME
+    ) WITHOUT ROWID
+"""
+
+# Bảng nội bộ không cần thống kê
+INTERNAL_TABLES = {'table_stats', 'data_version'}
+
+# Bảng ghi nhiều: không gắn trigger đếm dòng, đếm lại bằng recount_table_stats(conn, tables)
+# khi sync ghi bảng đó kết thúc
+DETAIL_COUNTED_TABLES = ('customer_services', 'customer_treatments', 'customer_payments',
+                         'customer_appointments', 'customer_history', 'data_change_logs')
+CALLCENTER_COUNTED_TABLES = ('callcenter_records',)
+SYNC_COUNTED_TABLES = frozenset(DETAIL_COUNTED_TABLES + CALLCENTER_COUNTED_TABLES)
+
+# ANALYZE chỉ lấy mẫu ~ANALYSIS_LIMIT dòng / index (sqlite_stat1 là ước lượng, không cần chính xác)
+ANALYSIS_LIMIT = 1000
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def list_tables(conn: sqlite3.Connection):
+    """
+    (bảng thường, bảng ảo + shadow table của FTS) trong database.
+    Chỉ bảng thường được gắn trigger đếm dòng
+    """
+    rows = conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+        ORDER BY name
+    """).fetchall()
+
+    virtual = [r[0] for r in rows if (r[1] or '').upper().startswith('CREATE VIRTUAL TABLE')]
+    tracked, others = [], []
+    for name, _ in rows:
+        if name in virtual or any(name.startswith(v + '_') for v in virtual):
+            others.append(name)
+        elif name not in INTERNAL_TABLES:
+            tracked.append(name)
+    return tracked, others
+
+
+def has_table_stats(conn: sqlite3.Connection) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_stats'"
+    ).fetchone()
+    return row is not None
+
+
+def ensure_table_stats(conn: sqlite3.Connection):
+    """
+    Tạo table_stats + trigger đếm dòng cho mọi bảng trừ SYNC_COUNTED_TABLES (idempotent),
+    bảng mới -> COUNT(*) 1 lần. Gọi lại sau khi tạo bảng mới.
+    conn phải bật recursive_triggers (writer của sqlite_conn). Caller tự commit
+    """
+    if not conn.execute("PRAGMA recursive_triggers").fetchone()[0]:
+        raise RuntimeError("table_stats cần connection bật recursive_triggers (dùng sqlite_conn.get_writer)")
+    conn.execute(TABLE_STATS_SCHEMA)
+
+    tracked, _ = list_tables(conn)
+    counted = {r[0] for r in conn.execute("SELECT name FROM table_stats")}
+    for table in tracked:
+        if table in SYNC_COUNTED_TABLES:
+            # Trigger đời trước (khi mọi bảng đều đếm bằng trigger)
+            conn.execute(f'DROP TRIGGER IF EXISTS "{table}_stats_ai"')
+            conn.execute(f'DROP TRIGGER IF EXISTS "{table}_stats_ad"')
+        else:
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS "{table}_stats_ai" AFTER INSERT ON "{table}" BEGIN
+                    UPDATE table_stats SET row_count = row_count + 1 WHERE name = '{table}';
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS "{table}_stats_ad" AFTER DELETE ON "{table}" BEGIN
+                    UPDATE table_stats SET row_count = row_count - 1 WHERE name = '{table}';
+                END
+            """)
+        if table in counted:
+            continue
+        # Trigger có trước dòng thống kê: COUNT(*) trong cùng 1 lệnh nên không lệch với writer khác
+        conn.execute(f"""
+            INSERT OR IGNORE INTO table_stats (name, row_count, counted_at)
+            SELECT ?, COUNT(*), ? FROM "{table}"
+        """, (table, _now()))
+
+    # Bảng đã bị DROP (trigger tự mất theo bảng)
+    placeholders = ', '.join('?' * len(tracked)) or "''"
+    conn.execute(f"DELETE FROM table_stats WHERE name NOT IN ({placeholders})", tracked)
+
+
+def recount_table_stats(conn: sqlite3.Connection, tables=None) -> int:
+    """
+    Đếm lại chính xác số dòng của tables (mặc định: mọi bảng, sửa cả lệch do tool ngoài ghi).
+    Bảng chưa có trong database được bỏ qua. Trả về số bảng. Caller tự commit
+    """
+    ensure_table_stats(conn)
+    tracked, _ = list_tables(conn)
+    if tables is not None:
+        wanted = set(tables)
+        tracked = [t for t in tracked if t in wanted]
+    now = _now()
+    for table in tracked:
+        conn.execute(f"""
+            UPDATE table_stats SET row_count = (SELECT COUNT(*) FROM "{table}"), counted_at = ?
+            WHERE name = ?
+        """, (now, table))
+    return len(tracked)
+
+
+def refresh_table_sizes(conn: sqlite3.Connection) -> bool:
+    """
+    Cập nhật sqlite_stat1 (ANALYZE có giới hạn) và dung lượng bảng / index từ dbstat.
+    Đọc toàn bộ file database -> chỉ chạy sau sync / từ CLI. Trả về False nếu SQLite
+    không có dbstat. Caller tự commit
+    """
+    ensure_table_stats(conn)
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+
+    try:
+        sizes = conn.execute("""
+            SELECT COALESCE(m.tbl_name, s.name) AS tbl,
+                   SUM(CASE WHEN m.type = 'index' THEN 0 ELSE s.pages END) AS pages,
+                   SUM(CASE WHEN m.type = 'index' THEN 0 ELSE s.bytes END) AS size_bytes,
+                   SUM(CASE WHEN m.type = 'index' THEN s.pages ELSE 0 END) AS index_pages,
+                   SUM(CASE WHEN m.type = 'index' THEN s.bytes ELSE 0 END) AS index_bytes
+            FROM (SELECT name, COUNT(*) AS pages, SUM(pgsize) AS bytes
+                  FROM dbstat GROUP BY name) s
+            LEFT JOIN sqlite_master m ON m.name = s.name
+            GROUP BY tbl
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return False
+
+    now = _now()
+    conn.executemany("""
+        UPDATE table_stats
+        SET pages = ?, size_bytes = ?, index_pages = ?, index_bytes = ?, sized_at = ?
+        WHERE name = ?
+    """, [(r[1], r[2], r[3], r[4], now, r[0]) for r in sizes])
+    return True
+
+
+def estimated_row_counts(conn: sqlite3.Connection) -> dict:
+    """Số dòng ước lượng từ sqlite_stat1 (số đầu tiên của stat), {} nếu chưa ANALYZE"""
+    try:
+        rows = conn.execute("SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {r[0]: r[1] for r in rows}
+
+
+def read_table_stats(conn: sqlite3.Connection):
+    """
+    Thống kê từng bảng, không quét bảng nào:
+    [{name, count, approx, pages, size_bytes, index_pages, index_bytes}].
+    approx=True: số dòng lấy từ sqlite_stat1; count=None: chưa có thông tin
+    """
+    tracked, others = list_tables(conn)
+    stats = {}
+    if has_table_stats(conn):
+        stats = {r[0]: r for r in conn.execute("""
+            SELECT name, row_count, pages, size_bytes, index_pages, index_bytes FROM table_stats
+        """)}
+    estimates = estimated_row_counts(conn)
+
+    result = []
+    for name in sorted(tracked + others):
+        row = stats.get(name)
+        item = {'name': name, 'count': None, 'approx': False,
+                'pages': None, 'size_bytes': None, 'index_pages': None, 'index_bytes': None}
+        if row is not None:
+            item.update(count=row[1], pages=row[2], size_bytes=row[3],
+                        index_pages=row[4], index_bytes=row[5])
+        elif name in estimates:
+            item.update(count=estimates[name], approx=True)
+        result.append(item)
+    return result
+
+
+def database_stats(conn: sqlite3.Connection) -> dict:
+    """Số trang / trang trống (freelist) của database, đọc từ header nên gần như miễn phí"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'size_bytes': page_size * page_count,
+        'freelist_bytes': page_size * freelist_count,
+    }
+
+
+def main():
+    from init_db import DB_PATH
+    from sqlite_conn import get_writer
+
+    parser = argparse.ArgumentParser(description='Cập nhật table_stats cho dashboard')
+    parser.add_argument('--sizes', action='store_true', help='Chỉ đo dung lượng, không đếm lại số dòng')
+    args = parser.parse_args()
+
+    conn = get_writer(DB_PATH)
+    try:
+        if not args.sizes:
+            print(f"🔢 Đã đếm lại {recount_table_stats(conn)} bảng")
+        if not refresh_table_sizes(conn):
+            print("⚠️ SQLite không hỗ trợ dbstat, bỏ qua dung lượng")
+        conn.commit()
+
+        for item in read_table_stats(conn):
+            size = item['size_bytes'] or 0
+            index_size = item['index_bytes'] or 0
+            print(f"  {item['name']:40s} {item['count'] or 0:>12,} rows "
+                  f"{size / 1024 / 1024:>9.2f} MB  index {index_size / 1024 / 1024:>8.2f} MB")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,22 +9,26 @@ Date: 2025-12-24
 Features:
 - Export tất cả master data (services, employees, branches, users, etc.)
 - Export dữ liệu theo ngày (revenue, appointments, etc.)
-- Export ra CSV và JSON
+- Export ra CSV, JSON, NDJSON (tùy chọn nén gzip)
+- Ghi dạng stream: records được ghi ngay khi về từ mỗi chi nhánh, bộ nhớ cố định
+- Export lịch sử trực tiếp từ database/vttech.db (--from-db)
 - Hỗ trợ export từng phần hoặc toàn bộ
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
-import os
 import sys
 import csv
+import gzip
 import argparse
+import asyncio
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from vttech import get_client, AsyncVTTechClient, config as vttech_config
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_reader
+
 # ============== CONFIG ==============
 BASE_URL = "https://tmtaza.vttechsolution.com"
 USERNAME = "ittest123"
@@ -33,156 +37,268 @@ PASSWORD = "ittest123"
 BASE_DIR = Path(__file__).parent
 EXPORT_DIR = BASE_DIR / "data_export"
 EXPORT_DIR.mkdir(exist_ok=True)
+DB_PATH = BASE_DIR / "database" / "vttech.db"
 
-# ============== HELPER FUNCTIONS ==============
+EXPORT_FORMATS = ('json', 'ndjson', 'csv')
+DEFAULT_FORMATS = ('json', 'csv')
 
-def decompress(data):
-    """Giải nén response base64+gzip"""
-    try:
-        decoded = base64.b64decode(data)
-        decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-        return json.loads(decompressed.decode('utf-8'))
-    except:
-        try:
-            return json.loads(data)
-        except:
-            return data
+# Số dòng đọc mỗi lần khi stream từ database
+DB_FETCH_SIZE = 1000
 
-def save_json(data, filename, directory=None):
-    """Lưu dữ liệu ra JSON"""
+# Cột CSV của revenue (LoadDataTotal + thông tin chi nhánh / khoảng ngày được thêm vào)
+REVENUE_FIELDS = (
+    'Paid', 'PaidNew', 'PaidNumCust', 'PaidNumCust_New',
+    'Raise', 'RaiseNew', 'RaiseNumCust', 'RaiseNumCust_New',
+    'Profile', 'AppChecked', 'App',
+    'BranchID', 'BranchName', 'DateFrom', 'DateTo',
+)
+
+# ============== STREAMING WRITERS ==============
+
+def _output_dir(directory=None):
     if directory:
         output_dir = EXPORT_DIR / directory
         output_dir.mkdir(exist_ok=True)
-    else:
-        output_dir = EXPORT_DIR
+        return output_dir
+    return EXPORT_DIR
+
+
+class ExportStream:
+    """
+    Ghi records ra 1 file theo dạng stream (bộ nhớ cố định, không giữ records)
     
-    filepath = output_dir / f"{filename}.json"
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"💾 Saved: {filepath}")
-    return str(filepath)
+    - ndjson: 1 record / dòng
+    - json: JSON array, ghi từng phần tử
+    - csv: schema cố định từ đầu (fields), nếu không truyền thì lấy theo record đầu tiên;
+      record có key ngoài schema -> ValueError (không âm thầm bỏ cột)
+    - compress=True: ghi file .gz
+    """
+    
+    def __init__(self, filename, directory=None, fmt='ndjson', fields=None, compress=False):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        self.fmt = fmt
+        self.fields = list(fields) if fields else None
+        self.count = 0
+        self.filepath = _output_dir(directory) / (f"{filename}.{fmt}" + (".gz" if compress else ""))
+        
+        if compress:
+            self._file = gzip.open(self.filepath, 'wt', encoding='utf-8', newline='')
+        else:
+            self._file = open(self.filepath, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        
+        if fmt == 'json':
+            self._file.write('[')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def write(self, record):
+        if self.fmt == 'csv':
+            if not isinstance(record, dict):
+                return
+            if self._csv is None:
+                self.fields = self.fields or list(record.keys())
+                self._csv = csv.DictWriter(self._file, fieldnames=self.fields)
+                self._csv.writeheader()
+            extra = record.keys() - set(self.fields)
+            if extra:
+                raise ValueError(f"{self.filepath.name}: cột ngoài schema CSV {sorted(extra)}")
+            self._csv.writerow(record)
+        else:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            if self.fmt == 'json':
+                self._file.write(('\n' if self.count == 0 else ',\n') + line)
+            else:
+                self._file.write(line + '\n')
+        self.count += 1
+    
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+    
+    def close(self):
+        if self._file.closed:
+            return
+        if self.fmt == 'csv' and self._csv is None and self.fields:
+            csv.DictWriter(self._file, fieldnames=self.fields).writeheader()
+        if self.fmt == 'json':
+            self._file.write('\n]\n' if self.count else ']\n')
+        self._file.close()
+        print(f"💾 Saved: {self.filepath} ({self.count} records)")
 
-def save_csv(data, filename, directory=None):
-    """Lưu dữ liệu ra CSV"""
-    if not data or not isinstance(data, list) or len(data) == 0:
-        return None
+
+class MultiExportStream:
+    """Ghi cùng 1 luồng records ra nhiều định dạng"""
     
-    if directory:
-        output_dir = EXPORT_DIR / directory
-        output_dir.mkdir(exist_ok=True)
-    else:
-        output_dir = EXPORT_DIR
+    def __init__(self, filename, directory=None, formats=DEFAULT_FORMATS, fields=None, compress=False):
+        self.streams = [ExportStream(filename, directory, fmt, fields, compress) for fmt in formats]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    @property
+    def count(self):
+        return self.streams[0].count if self.streams else 0
+    
+    def write(self, record):
+        for stream in self.streams:
+            stream.write(record)
     
-    filepath = output_dir / f"{filename}.csv"
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+    
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+
+
+# ============== HELPER FUNCTIONS ==============
+
+def save_json(data, filename, directory=None, compress=False):
+    """Lưu dữ liệu ra JSON"""
+    with ExportStream(filename, directory, 'json', compress=compress) as stream:
+        stream.write_many(data if isinstance(data, list) else [data])
+    return str(stream.filepath)
+
+def save_csv(data, filename, directory=None, compress=False):
+    """Lưu dữ liệu ra CSV (data đã có sẵn trong bộ nhớ -> schema = hợp tất cả keys)"""
+    if not data or not isinstance(data, list) or len(data) == 0:
+        return None
     
-    # Lấy tất cả keys từ tất cả items
     all_keys = set()
     for item in data:
         if isinstance(item, dict):
             all_keys.update(item.keys())
     
-    with open(filepath, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=sorted(all_keys))
-        writer.writeheader()
-        for item in data:
-            if isinstance(item, dict):
-                writer.writerow(item)
+    with ExportStream(filename, directory, 'csv', sorted(all_keys), compress) as stream:
+        stream.write_many(data)
+    return str(stream.filepath)
+
+
+def export_table_from_db(table, formats=DEFAULT_FORMATS, compress=False,
+                         date_from=None, date_to=None, directory="db"):
+    """
+    Export 1 bảng của vttech.db theo dạng stream (fetchmany, schema lấy từ cursor.description)
+    Lọc theo ngày nếu bảng có cột sync_date / date / appointment_date
+    """
+    conn = get_reader(DB_PATH)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,)
+        ).fetchone()
+        if not exists:
+            print(f"❌ Không có bảng {table} trong {DB_PATH.name}")
+            return 0
+        
+        sql, params = f'SELECT * FROM "{table}"', ()
+        if date_from or date_to:
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+            date_col = next((c for c in ('sync_date', 'date', 'appointment_date') if c in columns), None)
+            if date_col:
+                sql += f" WHERE date({date_col}) BETWEEN ? AND ?"
+                params = (date_from or '0000-01-01', date_to or '9999-12-31')
+        
+        cursor = conn.execute(sql, params)
+        fields = [d[0] for d in cursor.description]
+        suffix = datetime.now().strftime("%Y%m%d")
+        
+        print(f"\n🗄️ Export {table} từ database...")
+        with MultiExportStream(f"{table}_{suffix}", directory, formats, fields, compress) as out:
+            while True:
+                rows = cursor.fetchmany(DB_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    out.write(dict(zip(fields, row)))
+        print(f"  ✅ {table}: {out.count} records")
+        return out.count
+    finally:
+        conn.close()
+
+class RevenueWriter:
+    """Ghi kết quả LoadDataTotal của từng chi nhánh ngay khi nhận được"""
+    
+    def __init__(self, exporter, date_from, date_to):
+        self.exporter = exporter
+        self.date_from = date_from
+        self.date_to = date_to
+        self.stream = None
+        self.count = 0
+        self.total_paid = 0
+    
+    def write_branch(self, branch, result):
+        if not result or not isinstance(result, list):
+            return
+        if self.stream is None:
+            today = datetime.now().strftime("%Y%m%d")
+            self.stream = self.exporter.open_stream(f"revenue_{today}", "revenue", REVENUE_FIELDS)
+        
+        for item in result:
+            item['BranchID'] = branch['ID']
+            item['BranchName'] = branch['Name']
+            item['DateFrom'] = self.date_from
+            item['DateTo'] = self.date_to
+            self.stream.write(item)
+            self.total_paid += item.get('Paid', 0) or 0
+        self.count += len(result)
+        
+        paid = result[0].get('Paid', 0)
+        print(f"  ✅ {branch['Name']}: {paid:,.0f} VND")
     
-    print(f"📄 Saved: {filepath}")
-    return str(filepath)
+    def close(self):
+        if self.stream is None:
+            return
+        self.stream.close()
+        print(f"\n  💰 Total Revenue: {self.total_paid:,.0f} VND")
 
 # ============== API CLIENT ==============
 
 class VTTechExporter:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.token = None
-        self.xsrf_tokens = {}
+    def __init__(self, concurrency=1, formats=DEFAULT_FORMATS, compress=False):
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
         self.branches = []
+        self.concurrency = concurrency
+        self.formats = formats
+        self.compress = compress
+    
+    def open_stream(self, filename, directory=None, fields=None):
+        """Mở stream ghi ra các định dạng đã chọn"""
+        return MultiExportStream(filename, directory, self.formats, fields, self.compress)
+    
+    def save(self, data, filename, directory=None):
+        """Lưu 1 danh sách đã có sẵn ra các định dạng đã chọn"""
+        for fmt in self.formats:
+            if fmt == 'csv':
+                save_csv(data, filename, directory, self.compress)
+            else:
+                with ExportStream(filename, directory, fmt, compress=self.compress) as stream:
+                    stream.write_many(data)
         
     def login(self):
-        """Đăng nhập"""
+        """Đăng nhập (dùng chung phiên của process)"""
         print("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "", "from": "", "sso": "", "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            
-            if data.get("Session"):
-                self.token = data["Session"]
-                self.session.cookies.set("WebToken", self.token)
-                print(f"✅ Đăng nhập thành công: {data.get('FullName')}")
-                return True
-        except Exception as e:
-            print(f"❌ Lỗi đăng nhập: {e}")
-        return False
+        return self.client.login()
     
     def init_page(self, page_url):
         """Lấy XSRF token"""
-        if page_url in self.xsrf_tokens:
-            return True
-        try:
-            resp = self.session.get(f"{BASE_URL}{page_url}", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_tokens[page_url] = match.group(1)
-                    return True
-        except:
-            pass
-        return False
+        return self.client.init_page(page_url)
     
     def call_handler(self, page_url, handler, data=None):
         """Gọi handler"""
-        try:
-            if not self.init_page(page_url):
-                return None
-            
-            resp = self.session.post(
-                f"{BASE_URL}{page_url}?handler={handler}",
-                data=data or {},
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'XSRF-TOKEN': self.xsrf_tokens.get(page_url, ''),
-                },
-                timeout=120
-            )
-            
-            if resp.status_code == 200 and resp.content:
-                return decompress(resp.text)
-        except Exception as e:
-            print(f"❌ Error {page_url}?handler={handler}: {e}")
-        return None
+        return self.client.call_handler(page_url, handler, data or {})
     
     def call_api(self, endpoint, data=None):
         """Gọi API"""
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}{endpoint}",
-                json=data or {},
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.token}"
-                },
-                timeout=120
-            )
-            
-            if resp.status_code == 200 and resp.content:
-                return decompress(resp.text)
-        except Exception as e:
-            print(f"❌ Error {endpoint}: {e}")
-        return None
+        return self.client.call_api(endpoint, data)
 
     # ==========================================
     # EXPORT FUNCTIONS
@@ -222,8 +338,7 @@ class VTTechExporter:
                 data = result[key]
                 count = len(data)
                 
-                save_json(data, f"{name}_{today}", "master")
-                save_csv(data, f"{name}_{today}", "master")
+                self.save(data, f"{name}_{today}", "master")
                 
                 exported[name] = count
                 print(f"  ✅ {name}: {count} records")
@@ -245,10 +360,8 @@ class VTTechExporter:
             branches = result.get('Branch', [])
             memberships = result.get('Membership', [])
             
-            save_json(branches, f"branches_full_{today}", "master")
-            save_csv(branches, f"branches_full_{today}", "master")
-            save_json(memberships, f"memberships_{today}", "master")
-            save_csv(memberships, f"memberships_{today}", "master")
+            self.save(branches, f"branches_full_{today}", "master")
+            self.save(memberships, f"memberships_{today}", "master")
             
             print(f"  ✅ Branches: {len(branches)}")
             print(f"  ✅ Memberships: {len(memberships)}")
@@ -275,8 +388,7 @@ class VTTechExporter:
         result = self.call_handler("/Service/ServiceList/", "LoadataServiceType", {})
         if result and isinstance(result, list):
             all_data['service_types'] = result
-            save_json(result, f"service_types_{today}", "services")
-            save_csv(result, f"service_types_{today}", "services")
+            self.save(result, f"service_types_{today}", "services")
             print(f"  ✅ Service types: {len(result)}")
         
         return all_data
@@ -292,16 +404,14 @@ class VTTechExporter:
         result = self.call_handler("/Employee/EmployeeList/", "LoadataEmployeeGroup", {})
         if result and isinstance(result, list):
             all_data['employee_groups'] = result
-            save_json(result, f"employee_groups_{today}", "employees")
-            save_csv(result, f"employee_groups_{today}", "employees")
+            self.save(result, f"employee_groups_{today}", "employees")
             print(f"  ✅ Employee groups: {len(result)}")
         
         # Employees
         result = self.call_handler("/Employee/EmployeeList/", "LoadataEmployee", {})
         if result and isinstance(result, list):
             all_data['employees'] = result
-            save_json(result, f"employees_full_{today}", "employees")
-            save_csv(result, f"employees_full_{today}", "employees")
+            self.save(result, f"employees_full_{today}", "employees")
             print(f"  ✅ Employees: {len(result)}")
         
         return all_data
@@ -313,11 +423,34 @@ class VTTechExporter:
         if not self.branches:
             self.export_branches_full()
         
-        today = datetime.now().strftime("%Y%m%d")
-        all_revenue = []
+        writer = RevenueWriter(self, date_from, date_to)
+        try:
+            for branch in self.branches:
+                result = self.call_handler(
+                    "/Customer/ListCustomer/",
+                    "LoadDataTotal",
+                    {
+                        'dateFrom': f"{date_from} 00:00:00",
+                        'dateTo': f"{date_to} 23:59:59",
+                        'branchID': branch['ID']
+                    }
+                )
+                writer.write_branch(branch, result)
+        finally:
+            writer.close()
+        
+        return writer.count
+    
+    async def export_revenue_by_date_async(self, date_from, date_to, concurrency=None):
+        """Export revenue theo khoảng ngày - gọi LoadDataTotal cho tất cả chi nhánh đồng thời"""
+        print(f"\n💰 Export Revenue (async): {date_from} -> {date_to}")
+        
+        if not self.branches:
+            # Client sync chặn -> chạy ở thread riêng để không làm đứng event loop
+            await asyncio.to_thread(self.export_branches_full)
         
-        for branch in self.branches:
-            result = self.call_handler(
+        async def fetch_branch(aclient, branch):
+            result = await aclient.call_handler(
                 "/Customer/ListCustomer/",
                 "LoadDataTotal",
                 {
@@ -326,30 +459,29 @@ class VTTechExporter:
                     'branchID': branch['ID']
                 }
             )
-            
-            if result and isinstance(result, list):
-                for item in result:
-                    item['BranchID'] = branch['ID']
-                    item['BranchName'] = branch['Name']
-                    item['DateFrom'] = date_from
-                    item['DateTo'] = date_to
-                all_revenue.extend(result)
-                
-                paid = result[0].get('Paid', 0) if result else 0
-                print(f"  ✅ {branch['Name']}: {paid:,.0f} VND")
+            return branch, result
         
-        if all_revenue:
-            save_json(all_revenue, f"revenue_{today}", "revenue")
-            save_csv(all_revenue, f"revenue_{today}", "revenue")
-            
-            total = sum(r.get('Paid', 0) for r in all_revenue)
-            print(f"\n  💰 Total Revenue: {total:,.0f} VND")
+        # Ghi kết quả của chi nhánh nào xong trước
+        writer = RevenueWriter(self, date_from, date_to)
+        try:
+            async with AsyncVTTechClient.from_client(self.client, concurrency) as aclient:
+                for done in asyncio.as_completed([fetch_branch(aclient, b) for b in self.branches]):
+                    branch, result = await done
+                    writer.write_branch(branch, result)
+        finally:
+            writer.close()
         
-        return all_revenue
+        return writer.count
+    
+    def export_revenue(self, date_from, date_to):
+        """Export revenue: dùng bản async nếu có httpx và concurrency > 1"""
+        if AsyncVTTechClient is not None and self.concurrency > 1:
+            return asyncio.run(self.export_revenue_by_date_async(date_from, date_to, self.concurrency))
+        return self.export_revenue_by_date(date_from, date_to)
     
     def export_daily_revenue(self, date_str):
         """Export revenue cho ngày cụ thể"""
-        return self.export_revenue_by_date(date_str, date_str)
+        return self.export_revenue(date_str, date_str)
     
     def export_all(self, date_from=None, date_to=None):
         """Export tất cả dữ liệu"""
@@ -374,7 +506,7 @@ class VTTechExporter:
         if not date_to:
             date_to = datetime.now().strftime("%Y-%m-%d")
         
-        results['revenue'] = self.export_revenue_by_date(date_from, date_to)
+        results['revenue'] = self.export_revenue(date_from, date_to)
         
         # Summary
         print("\n" + "=" * 60)
@@ -387,6 +519,8 @@ class VTTechExporter:
                 count = sum(v if isinstance(v, int) else len(v) for v in value.values() if isinstance(v, (int, list)))
             elif isinstance(value, list):
                 count = len(value)
+            elif isinstance(value, int):
+                count = value
             else:
                 count = 0
             total_records += count
@@ -409,9 +543,22 @@ def main():
     parser.add_argument('--date', type=str, help='Date for revenue (YYYY-MM-DD)')
     parser.add_argument('--date-from', type=str, help='Start date (YYYY-MM-DD)')
     parser.add_argument('--date-to', type=str, help='End date (YYYY-MM-DD)')
+    parser.add_argument('--concurrency', type=int, default=vttech_config.async_concurrency,
+                        help='Concurrent LoadDataTotal calls (1 = sequential)')
+    parser.add_argument('--format', nargs='+', choices=EXPORT_FORMATS, default=list(DEFAULT_FORMATS),
+                        help='Output formats (default: json csv)')
+    parser.add_argument('--gzip', action='store_true', help='Gzip-compress output files')
+    parser.add_argument('--from-db', nargs='+', metavar='TABLE',
+                        help='Stream tables from database/vttech.db instead of calling the API')
     args = parser.parse_args()
     
-    exporter = VTTechExporter()
+    if args.from_db:
+        for table in args.from_db:
+            export_table_from_db(table, args.format, args.gzip,
+                                 args.date_from or args.date, args.date_to or args.date)
+        return
+    
+    exporter = VTTechExporter(concurrency=args.concurrency, formats=args.format, compress=args.gzip)
     
     if not exporter.login():
         print("❌ Cannot login!")
@@ -426,7 +573,7 @@ def main():
         date_from = args.date_from or args.date or (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
         date_to = args.date_to or args.date or datetime.now().strftime("%Y-%m-%d")
         exporter.export_branches_full()
-        exporter.export_revenue_by_date(date_from, date_to)
+        exporter.export_revenue(date_from, date_to)
     else:
         exporter.export_all(args.date_from, args.date_to)
 
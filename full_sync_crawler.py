@@ -24,11 +24,7 @@ Usage:
     python3 full_sync_crawler.py --date-range 2025-12-01 2025-12-24  # Khoảng ngày
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
 import os
 import sys
 import argparse
@@ -39,6 +35,11 @@ from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, List, Any
 
+from vttech import get_client
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from master_sync import content_hash, load_hash_file, save_hash_file
+
 # ============== CONFIG ==============
 BASE_URL = "https://tmtaza.vttechsolution.com"
 USERNAME = "ittest123"
@@ -61,6 +62,9 @@ LOG_DIR.mkdir(exist_ok=True)
 (SYNC_DIR / "services").mkdir(exist_ok=True)
 (SYNC_DIR / "employees").mkdir(exist_ok=True)
 
+# Hash nội dung từng bảng master lần sync trước (bảng không đổi -> không ghi file mới)
+MASTER_HASH_FILE = SYNC_DIR / "master" / "_content_hashes.json"
+
 # ============== LOGGING ==============
 logging.basicConfig(
     level=logging.INFO,
@@ -80,12 +84,7 @@ class VTTechFullSyncCrawler:
     """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.token = None
-        self.xsrf_tokens = {}  # Cache XSRF tokens cho từng page
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
         self.branches = []
         self.stats = {
             'total_records': 0,
@@ -94,124 +93,30 @@ class VTTechFullSyncCrawler:
             'start_time': None
         }
     
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
-        """Đăng nhập và lấy token"""
+        """Đăng nhập và lấy token (dùng chung phiên của process)"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "",
-                    "from": "",
-                    "sso": "",
-                    "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            
-            if data.get("Session"):
-                self.token = data["Session"]
-                self.session.cookies.set("WebToken", self.token)
-                logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')} (ID: {data.get('ID')})")
-                return True
-            else:
-                logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
-                return False
-        except Exception as e:
-            logger.error(f"❌ Lỗi đăng nhập: {e}")
-            return False
+        return self.client.login()
     
     def init_page(self, page_url: str) -> bool:
         """Lấy XSRF token từ trang"""
-        if page_url in self.xsrf_tokens:
-            return True
-            
-        try:
-            resp = self.session.get(f"{BASE_URL}{page_url}", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_tokens[page_url] = match.group(1)
-                    return True
-        except Exception as e:
-            logger.error(f"❌ Lỗi init_page {page_url}: {e}")
-        return False
+        return self.client.init_page(page_url)
     
     def call_handler(self, page_url: str, handler: str, data: Dict, retry: int = 3) -> Any:
         """Gọi handler với XSRF token"""
-        for attempt in range(retry):
-            try:
-                if not self.init_page(page_url):
-                    continue
-                    
-                resp = self.session.post(
-                    f"{BASE_URL}{page_url}?handler={handler}",
-                    data=data,
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'X-Requested-With': 'XMLHttpRequest',
-                        'XSRF-TOKEN': self.xsrf_tokens.get(page_url, ''),
-                        'Accept': '*/*',
-                        'Origin': BASE_URL,
-                        'Referer': f'{BASE_URL}{page_url}'
-                    },
-                    timeout=120
-                )
-                
-                self.stats['endpoints_called'] += 1
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
-                self.stats['errors'] += 1
-        return None
+        result = self.client.call_handler(page_url, handler, data, retry=retry)
+        self.stats['endpoints_called'] += 1
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def call_api(self, endpoint: str, data: Dict = None, retry: int = 3) -> Any:
         """Gọi API trực tiếp"""
-        for attempt in range(retry):
-            try:
-                resp = self.session.post(
-                    f"{BASE_URL}{endpoint}",
-                    json=data or {},
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.token}"
-                    },
-                    timeout=120
-                )
-                
-                self.stats['endpoints_called'] += 1
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_api {endpoint}: {e}")
-                self.stats['errors'] += 1
-        return None
+        result = self.client.call_api(endpoint, data, retry=retry)
+        self.stats['endpoints_called'] += 1
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def save_json(self, data: Any, filename: str, subdir: str = None) -> str:
         """Lưu dữ liệu ra file JSON"""
@@ -302,28 +207,39 @@ class VTTechFullSyncCrawler:
         
         today = datetime.now().strftime("%Y%m%d")
         saved_data = {}
+        hashes = load_hash_file(MASTER_HASH_FILE)
         
         for table_key, info in table_mapping.items():
             if table_key in result:
                 data = result[table_key]
                 count = len(data)
+                digest = content_hash(data)
+                changed = hashes.get(info['name']) != digest
                 
-                # Lưu file
-                self.save_json(data, f"{info['name']}_{today}", "master")
+                # Lưu file (nội dung trùng lần trước -> giữ file cũ)
+                if changed:
+                    self.save_json(data, f"{info['name']}_{today}", "master")
+                    hashes[info['name']] = digest
                 
                 saved_data[info['name']] = {
                     "count": count,
                     "description": info['description'],
-                    "fields": info['fields']
+                    "fields": info['fields'],
+                    "changed": changed
                 }
                 
                 self.stats['total_records'] += count
-                logger.info(f"  ✅ {info['name']}: {count} records - {info['description']}")
+                if changed:
+                    logger.info(f"  ✅ {info['name']}: {count} records - {info['description']}")
+                else:
+                    logger.info(f"  ⏭️  {info['name']}: {count} records - không đổi")
                 
                 # Cache branches cho sau
                 if info['name'] == 'branches':
                     self.branches = data
         
+        save_hash_file(MASTER_HASH_FILE, hashes)
+        
         # Lưu summary
         self.save_json({
             "sync_date": today,
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+VTTech Range Sync Orchestrator
+Sync 1 khoảng ngày trong cùng 1 process (thay cho vòng lặp subprocess từng ngày của run.py)
+
+- Chia khoảng ngày thành các task theo ngày, chạy tối đa --concurrency ngày cùng lúc
+- Dùng chung 1 phiên đăng nhập (vttech.get_client) và 1 AdaptiveRateLimiter:
+  server trả 429/503 -> tất cả các ngày cùng giảm tốc, 2xx -> tăng dần lại
+- Trạng thái từng (ngày, bước) được lưu vào bảng sync_range_state,
+  chạy lại cùng job sẽ bỏ qua các bước đã xong (resume khi bị ngắt giữa chừng)
+
+Jobs:
+    customers: sync_customer_by_branch -> sync_customer_detail_full --incremental
+    cron:      cron_crawler (doanh thu + khách mới theo ngày)
+
+Usage:
+    python3 range_sync.py --date-from 2025-12-01 --date-to 2025-12-25
+    python3 range_sync.py --job cron --date-from 2025-12-01 --date-to 2025-12-25 --concurrency 3
+    python3 range_sync.py --date-from 2025-12-01 --date-to 2025-12-25 --force
+"""
+
+import sys
+import queue
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from vttech import get_client, VTTechClient, AdaptiveRateLimiter
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from table_stats import ensure_table_stats
+
+# ============== CONFIG ==============
+BASE_URL = "https://tmtaza.vttechsolution.com"
+USERNAME = "ittest123"
+PASSWORD = "ittest123"
+
+BASE_DIR = Path(__file__).parent
+LOG_DIR = BASE_DIR / "logs"
+DB_PATH = BASE_DIR / "database" / "vttech.db"
+
+# Mặc định: 2 ngày song song, tổng tối đa 4 request/giây cho cả process
+DEFAULT_CONCURRENCY = 2
+DEFAULT_RPS = 4.0
+
+# Các bước của từng job, chạy tuần tự trong 1 ngày
+JOB_STEPS = {
+    'customers': ('customers', 'details'),
+    'cron': ('revenue',),
+}
+
+LOG_DIR.mkdir(exist_ok=True)
+
+# ============== LOGGING ==============
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_DIR / f"range_sync_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def date_range(date_from: str, date_to: str) -> List[str]:
+    """Danh sách ngày YYYY-MM-DD từ date_from đến date_to (bao gồm 2 đầu)"""
+    start = datetime.strptime(date_from, "%Y-%m-%d")
+    end = datetime.strptime(date_to, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+class RangeSyncOrchestrator:
+    """
+    Chạy các bước sync của job cho từng ngày trong khoảng, nhiều ngày song song
+
+    Bước 'details' cần session riêng (server giữ customer context theo session),
+    nên mỗi slot song song mượn 1 VTTechClient riêng từ pool; các bước khác dùng
+    client chung của process. Tất cả dùng chung 1 AdaptiveRateLimiter
+    """
+
+    def __init__(self, job: str = 'customers', concurrency: int = DEFAULT_CONCURRENCY,
+                 rps: float = DEFAULT_RPS, force: bool = False):
+        if job not in JOB_STEPS:
+            raise ValueError(f"Job không hợp lệ: {job} (chọn: {', '.join(JOB_STEPS)})")
+        self.job = job
+        self.steps = JOB_STEPS[job]
+        self.concurrency = max(1, concurrency)
+        self.force = force
+        self.limiter = AdaptiveRateLimiter(rps)
+
+        # Client chung của process: 1 lần đăng nhập cho mọi ngày
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
+        self.client.rate_limiter = self.limiter
+
+        self._detail_clients = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'total_days': 0,
+            'days_success': 0,
+            'days_failed': 0,
+            'steps_done': 0,
+            'steps_skipped': 0,
+            'steps_failed': 0,
+            'start_time': None
+        }
+
+    # ============== STATE ==============
+
+    def get_conn(self):
+        return get_writer(DB_PATH)
+
+    def ensure_state_table(self):
+        """Bảng lưu trạng thái từng (job, ngày, bước)"""
+        conn = self.get_conn()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_range_state (
+                    job TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    step TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    started_at TEXT,
+                    updated_at TEXT,
+                    PRIMARY KEY (job, day, step)
+                )
+            """)
+            ensure_table_stats(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_done_steps(self, days: List[str]) -> Dict[str, set]:
+        """ngày -> tập các bước đã 'done' của job"""
+        done = {}
+        conn = self.get_conn()
+        try:
+            rows = conn.execute("""
+                SELECT day, step FROM sync_range_state
+                WHERE job = ? AND status = 'done' AND day BETWEEN ? AND ?
+            """, (self.job, days[0], days[-1])).fetchall()
+            for row in rows:
+                done.setdefault(row['day'], set()).add(row['step'])
+        finally:
+            conn.close()
+        return done
+
+    def set_state(self, day: str, step: str, status: str, error: str = None):
+        now = datetime.now().isoformat(timespec='seconds')
+        conn = self.get_conn()
+        try:
+            conn.execute("""
+                INSERT INTO sync_range_state (job, day, step, status, error, started_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job, day, step) DO UPDATE SET
+                    status = excluded.status,
+                    error = excluded.error,
+                    started_at = CASE WHEN excluded.status = 'running'
+                                      THEN excluded.started_at ELSE started_at END,
+                    updated_at = excluded.updated_at
+            """, (self.job, day, step, status, error, now, now))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ============== STEPS ==============
+
+    def _step_customers(self, day: str):
+        from sync_customer_by_branch import VTTechCustomerSync
+
+        syncer = VTTechCustomerSync()
+        syncer.client = self.client
+        syncer.sync_all_customers(f"{day} 00:00:00", f"{day} 23:59:59")
+        if not syncer.stats['total_branches']:
+            raise RuntimeError("Không lấy được danh sách branch")
+        if syncer.stats['errors']:
+            raise RuntimeError(f"{syncer.stats['errors']} branch lỗi")
+
+    def _step_details(self, day: str):
+        from sync_customer_detail_full import CustomerDetailSync
+
+        try:
+            client = self._detail_clients.get_nowait()
+        except queue.Empty:
+            client = VTTechClient(BASE_URL, USERNAME, PASSWORD,
+                                  rate_limiter=self.limiter, use_session_cache=False)
+        try:
+            syncer = CustomerDetailSync(client=client)
+            syncer.sync_all_customer_details(sync_date=day, incremental=True)
+            if syncer.stats['start_time'] is None or not client.token:
+                raise RuntimeError("Không thể đăng nhập session detail")
+            if syncer.stats['errors']:
+                raise RuntimeError(f"{syncer.stats['errors']} customer lỗi")
+        finally:
+            self._detail_clients.put(client)
+
+    def _step_revenue(self, day: str):
+        from cron_crawler import VTTechCronCrawler, USE_DATABASE
+
+        crawler = VTTechCronCrawler()
+        crawler.client = self.client
+        results = crawler.crawl_day(day, use_db=USE_DATABASE)
+        if results.get('revenue') is None:
+            raise RuntimeError("Không lấy được doanh thu")
+        if results.get('db_error'):
+            raise RuntimeError(results['db_error'])
+
+    # ============== RUN ==============
+
+    def run_day(self, day: str, done_steps: set) -> bool:
+        """Chạy các bước chưa xong của 1 ngày; dừng ở bước lỗi đầu tiên"""
+        for step in self.steps:
+            if step in done_steps and not self.force:
+                logger.info(f"⏭️ {day} [{step}] đã xong, bỏ qua")
+                with self._stats_lock:
+                    self.stats['steps_skipped'] += 1
+                continue
+
+            logger.info(f"▶️ {day} [{step}] bắt đầu")
+            self.set_state(day, step, 'running')
+            try:
+                getattr(self, f'_step_{step}')(day)
+            except Exception as e:
+                logger.error(f"❌ {day} [{step}] lỗi: {e}")
+                self.set_state(day, step, 'failed', str(e))
+                with self._stats_lock:
+                    self.stats['steps_failed'] += 1
+                return False
+
+            self.set_state(day, step, 'done')
+            logger.info(f"✅ {day} [{step}] hoàn thành")
+            with self._stats_lock:
+                self.stats['steps_done'] += 1
+        return True
+
+    def run(self, date_from: str, date_to: str) -> Dict:
+        """Sync toàn bộ khoảng ngày, trả về stats"""
+        days = date_range(date_from, date_to)
+        if not days:
+            logger.error("❌ Khoảng ngày không hợp lệ")
+            return self.stats
+
+        self.stats['start_time'] = datetime.now()
+        self.stats['total_days'] = len(days)
+
+        logger.info("=" * 70)
+        logger.info(f"🚀 RANGE SYNC [{self.job}]: {date_from} → {date_to} ({len(days)} ngày)")
+        logger.info(f"⚡ {self.concurrency} ngày song song, tối đa {self.limiter.max_rate} request/giây")
+        logger.info("=" * 70)
+
+        self.ensure_state_table()
+        if not self.client.login():
+            logger.error("❌ Không thể đăng nhập. Dừng sync.")
+            return self.stats
+
+        done = {} if self.force else self.get_done_steps(days)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='day') as executor:
+                futures = {executor.submit(self.run_day, day, done.get(day, set())): day for day in days}
+                try:
+                    for future in as_completed(futures):
+                        day = futures[future]
+                        try:
+                            ok = future.result()
+                        except Exception as e:
+                            logger.error(f"❌ {day}: {e}")
+                            ok = False
+                        self.stats['days_success' if ok else 'days_failed'] += 1
+                except KeyboardInterrupt:
+                    # Huỷ các ngày chưa bắt đầu, chờ các ngày đang chạy xong -> lần sau resume
+                    logger.warning("⏹️ Đang dừng: chờ các ngày đang chạy hoàn tất...")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        finally:
+            while not self._detail_clients.empty():
+                self._detail_clients.get_nowait().close()
+
+        self.print_summary(date_from, date_to)
+        return self.stats
+
+    def print_summary(self, date_from: str, date_to: str):
+        duration = datetime.now() - self.stats['start_time']
+
+        logger.info("\n" + "=" * 70)
+        logger.info(f"📊 TỔNG KẾT RANGE SYNC [{self.job}]")
+        logger.info("=" * 70)
+        logger.info(f"   📅 Khoảng thời gian: {date_from} → {date_to}")
+        logger.info(f"   ✅ Ngày thành công: {self.stats['days_success']}/{self.stats['total_days']}")
+        logger.info(f"   ❌ Ngày có lỗi: {self.stats['days_failed']}")
+        logger.info(f"   ⏭️ Bước bỏ qua (đã xong): {self.stats['steps_skipped']}")
+        logger.info(f"   🚦 HTTP 429/503: {self.limiter.stats['throttled']} "
+                    f"(rate hiện tại {self.limiter.rate:.2f}/s)")
+        logger.info(f"   ⏱️ Thời gian: {duration}")
+        logger.info("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync khoảng ngày trong 1 process (song song + resume)')
+    parser.add_argument('--date-from', type=str, required=True, help='Ngày bắt đầu (YYYY-MM-DD)')
+    parser.add_argument('--date-to', type=str, required=True, help='Ngày kết thúc (YYYY-MM-DD)')
+    parser.add_argument('--job', choices=sorted(JOB_STEPS), default='customers',
+                        help='customers: branch + detail, cron: doanh thu + khách mới')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Số ngày chạy song song')
+    parser.add_argument('--rps', type=float, default=DEFAULT_RPS,
+                        help='Số request/giây tối đa (tự giảm khi server trả 429/503)')
+    parser.add_argument('--force', action='store_true', help='Chạy lại cả các bước đã xong')
+    args = parser.parse_args()
+
+    orchestrator = RangeSyncOrchestrator(args.job, args.concurrency, args.rps, args.force)
+    stats = orchestrator.run(args.date_from, args.date_to)
+    sys.exit(0 if stats['total_days'] and not stats['days_failed']
+             and stats['days_success'] == stats['total_days'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ Chạy dự án với 1 lệnh duy nhất
 import os
 import sys
 import subprocess
-import time
 from pathlib import Path
 from datetime import datetime, timedelta
 
@@ -278,8 +277,9 @@ def show_callcenter_stats_detail():
             input("\nNhấn Enter để tiếp tục...")
             return
         
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        sys.path.insert(0, str(BASE_DIR / 'database'))
+        from sqlite_conn import get_reader
+        conn = get_reader(db_path)
         
         # Tổng quan
         print("\033[96m📞 Tổng quan Cuộc gọi:\033[0m")
@@ -441,8 +441,9 @@ def run_full_customer_sync(date_str=None, date_from=None, date_to=None):
         start_dt = dt.strptime(date_from, "%Y-%m-%d")
         end_dt = dt.strptime(date_to, "%Y-%m-%d")
         total_days = (end_dt - start_dt).days + 1
-        print(f"\033[90m   Tổng: {total_days} ngày (sẽ sync từng ngày một)\033[0m")
-        print(f"\033[90m   ⚡ Sync từng ngày để tránh quá tải và đảm bảo toàn vẹn dữ liệu\033[0m")
+        print(f"\033[90m   Tổng: {total_days} ngày (chạy song song trong 1 process, tự resume ngày đã xong)\033[0m")
+        
+        concurrency = ask_concurrency()
         
         # Confirm
         confirm = input("\033[93m⚠️  Tiếp tục? (y/n): \033[0m").strip().lower()
@@ -452,86 +453,7 @@ def run_full_customer_sync(date_str=None, date_from=None, date_to=None):
             return
         
         print("\n" + "=" * 70)
-        
-        # Thống kê tổng
-        total_stats = {
-            'days_success': 0,
-            'days_failed': 0,
-            'total_customers_synced': 0
-        }
-        
-        # Lặp qua từng ngày
-        current_dt = start_dt
-        day_num = 0
-        
-        while current_dt <= end_dt:
-            day_num += 1
-            current_date = current_dt.strftime("%Y-%m-%d")
-            
-            print(f"\n\033[95m{'='*70}\033[0m")
-            print(f"\033[95m📅 NGÀY {day_num}/{total_days}: {current_date}\033[0m")
-            print(f"\033[95m{'='*70}\033[0m")
-            
-            day_success = True
-            
-            # Step 1: Sync customers by branch cho ngày này
-            print(f"\n\033[96m📍 BƯỚC 1: Sync Customers by Branch ({current_date})\033[0m")
-            print("-" * 40)
-            
-            try:
-                cmd1 = [sys.executable, str(BASE_DIR / "sync_customer_by_branch.py"), "--date", current_date]
-                result1 = subprocess.run(cmd1, capture_output=False)
-                
-                if result1.returncode == 0:
-                    print("\033[92m✅ Bước 1 hoàn thành!\033[0m")
-                else:
-                    print("\033[91m❌ Bước 1 có lỗi!\033[0m")
-                    day_success = False
-            except Exception as e:
-                print(f"\033[91m❌ Lỗi bước 1: {e}\033[0m")
-                day_success = False
-            
-            # Step 2: Sync customer details cho ngày này
-            print(f"\n\033[96m📋 BƯỚC 2: Sync Customer Detail ({current_date})\033[0m")
-            print("-" * 40)
-            
-            try:
-                cmd2 = [sys.executable, str(BASE_DIR / "sync_customer_detail_full.py"), "--date", current_date]
-                result2 = subprocess.run(cmd2, capture_output=False)
-                
-                if result2.returncode == 0:
-                    print("\033[92m✅ Bước 2 hoàn thành!\033[0m")
-                else:
-                    print("\033[91m❌ Bước 2 có lỗi!\033[0m")
-                    day_success = False
-            except Exception as e:
-                print(f"\033[91m❌ Lỗi bước 2: {e}\033[0m")
-                day_success = False
-            
-            # Cập nhật thống kê
-            if day_success:
-                total_stats['days_success'] += 1
-                print(f"\n\033[92m✅ Ngày {current_date} hoàn thành!\033[0m")
-            else:
-                total_stats['days_failed'] += 1
-                print(f"\n\033[91m⚠️ Ngày {current_date} có lỗi!\033[0m")
-            
-            # Delay giữa các ngày để tránh quá tải
-            if current_dt < end_dt:
-                print(f"\033[90m⏳ Đợi 3 giây trước ngày tiếp theo...\033[0m")
-                time.sleep(3)
-            
-            current_dt += timedelta(days=1)
-        
-        # Tổng kết cuối cùng
-        print("\n" + "=" * 70)
-        print("\033[92m📊 TỔNG KẾT FULL SYNC KHOẢNG THỜI GIAN\033[0m")
-        print("=" * 70)
-        print(f"   📅 Khoảng thời gian: {date_from} → {date_to}")
-        print(f"   ✅ Ngày thành công: {total_stats['days_success']}/{total_days}")
-        if total_stats['days_failed'] > 0:
-            print(f"   ❌ Ngày có lỗi: {total_stats['days_failed']}")
-        print("=" * 70)
+        run_range_sync('customers', date_from, date_to, concurrency)
         
     else:
         # Sync theo ngày đơn lẻ
@@ -573,7 +495,8 @@ def run_full_customer_sync(date_str=None, date_from=None, date_to=None):
         print("-" * 40)
         
         try:
-            cmd2 = [sys.executable, str(BASE_DIR / "sync_customer_detail_full.py"), "--date", date_str]
+            cmd2 = [sys.executable, str(BASE_DIR / "sync_customer_detail_full.py"), "--date", date_str,
+                    "--incremental"]
             result2 = subprocess.run(cmd2, capture_output=False)
             
             if result2.returncode == 0:
@@ -604,8 +527,9 @@ def show_customer_sync_stats():
             input("\nNhấn Enter để tiếp tục...")
             return
         
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        sys.path.insert(0, str(BASE_DIR / 'database'))
+        from sqlite_conn import get_reader
+        conn = get_reader(db_path)
         
         # Thống kê branches
         cursor = conn.execute("SELECT COUNT(*) as count FROM branches")
@@ -707,8 +631,9 @@ def show_data_change_logs():
             input("\nNhấn Enter để tiếp tục...")
             return
         
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        sys.path.insert(0, str(BASE_DIR / 'database'))
+        from sqlite_conn import get_reader
+        conn = get_reader(db_path)
         
         # Thống kê tổng quan
         print("\033[96m📊 Tổng quan:\033[0m")
@@ -801,21 +726,49 @@ def get_date_range():
     
     return start_date, end_date
 
-def run_cron_range(start_date, end_date, delay_seconds=5):
+def ask_concurrency(default=2):
+    """Hỏi số ngày chạy song song cho range sync"""
+    print("\n\033[96m⚡ Số ngày chạy song song?\033[0m")
+    print("\033[90m   Tốc độ request tự giảm khi server trả 429/503\033[0m")
+    value = input(f"   Số ngày (mặc định {default}): ").strip()
+    concurrency = int(value) if value.isdigit() else default
+    return max(1, min(8, concurrency))
+
+def run_range_sync(job, date_from, date_to, concurrency=2):
+    """Chạy RangeSyncOrchestrator (range_sync.py) ngay trong process, trả về stats"""
+    from range_sync import RangeSyncOrchestrator
+    
+    try:
+        stats = RangeSyncOrchestrator(job, concurrency).run(date_from, date_to)
+    except KeyboardInterrupt:
+        print("\n\033[93m⏹️  Đã dừng. Chạy lại cùng khoảng ngày để tiếp tục từ ngày chưa xong.\033[0m")
+        return None
+    
+    print("\n" + "=" * 50)
+    print(f"\033[96m📊 KẾT QUẢ:\033[0m")
+    print(f"   ✅ Thành công: {stats['days_success']}/{stats['total_days']} ngày")
+    if stats['days_failed'] > 0:
+        print(f"   ❌ Thất bại: {stats['days_failed']} ngày (chạy lại để thử các ngày lỗi)")
+    if stats['steps_skipped'] > 0:
+        print(f"   ⏭️  Bỏ qua {stats['steps_skipped']} bước đã xong từ lần chạy trước")
+    print("=" * 50)
+    return stats
+
+def run_cron_range(start_date, end_date, concurrency=2):
     """
-    Chạy Cron Crawler cho khoảng thời gian với rate limiting
+    Chạy Cron Crawler cho khoảng thời gian (song song theo ngày, rate limit thích ứng)
     
     Args:
         start_date: datetime - ngày bắt đầu
         end_date: datetime - ngày kết thúc  
-        delay_seconds: int - delay giữa các request (tránh rate limit)
+        concurrency: int - số ngày chạy cùng lúc
     """
     # Tính số ngày
     total_days = (end_date - start_date).days + 1
     
     print(f"\n\033[96m📅 Crawl từ {start_date.strftime('%Y-%m-%d')} đến {end_date.strftime('%Y-%m-%d')}\033[0m")
     print(f"\033[90m   Tổng: {total_days} ngày\033[0m")
-    print(f"\033[90m   Delay: {delay_seconds}s giữa mỗi ngày (tránh rate limit)\033[0m")
+    print(f"\033[90m   Song song: {concurrency} ngày (tự resume ngày đã xong)\033[0m")
     print()
     
     # Confirm
@@ -825,80 +778,7 @@ def run_cron_range(start_date, end_date, delay_seconds=5):
         return
     
     print("\n" + "=" * 50)
-    
-    success_count = 0
-    fail_count = 0
-    current_date = start_date
-    
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        day_num = (current_date - start_date).days + 1
-        
-        print(f"\n\033[96m[{day_num}/{total_days}] 📅 {date_str}\033[0m")
-        
-        # Chạy cron với retry
-        max_retries = 3
-        retry_delay = 30  # delay khi bị rate limit
-        
-        for attempt in range(max_retries):
-            try:
-                cmd = [sys.executable, str(BASE_DIR / "cron_crawler.py"), "--date", date_str]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-                
-                # Check for rate limit / 409 errors
-                if "429" in result.stdout or "429" in result.stderr:
-                    print(f"\033[93m   ⚠️  Rate limited! Đợi {retry_delay}s...\033[0m")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # exponential backoff
-                    continue
-                
-                if "409" in result.stdout or "409" in result.stderr:
-                    print(f"\033[93m   ⚠️  Conflict (409)! Đợi {retry_delay}s...\033[0m")
-                    time.sleep(retry_delay)
-                    continue
-                
-                if result.returncode == 0:
-                    # Tìm tổng doanh thu trong output
-                    if "Tổng doanh thu" in result.stdout:
-                        for line in result.stdout.split('\n'):
-                            if "Tổng doanh thu" in line:
-                                print(f"\033[92m   ✅ {line.strip()}\033[0m")
-                                break
-                    else:
-                        print(f"\033[92m   ✅ Thành công\033[0m")
-                    success_count += 1
-                    break
-                else:
-                    if attempt < max_retries - 1:
-                        print(f"\033[93m   ⚠️  Lỗi, thử lại ({attempt + 2}/{max_retries})...\033[0m")
-                        time.sleep(10)
-                    else:
-                        print(f"\033[91m   ❌ Thất bại sau {max_retries} lần thử\033[0m")
-                        fail_count += 1
-                        
-            except subprocess.TimeoutExpired:
-                print(f"\033[91m   ❌ Timeout!\033[0m")
-                fail_count += 1
-                break
-            except Exception as e:
-                print(f"\033[91m   ❌ Lỗi: {e}\033[0m")
-                fail_count += 1
-                break
-        
-        # Delay giữa các ngày để tránh quá tải
-        if current_date < end_date:
-            print(f"\033[90m   ⏳ Đợi {delay_seconds}s...\033[0m")
-            time.sleep(delay_seconds)
-        
-        current_date += timedelta(days=1)
-    
-    # Summary
-    print("\n" + "=" * 50)
-    print(f"\033[96m📊 KẾT QUẢ:\033[0m")
-    print(f"   ✅ Thành công: {success_count}/{total_days} ngày")
-    if fail_count > 0:
-        print(f"   ❌ Thất bại: {fail_count} ngày")
-    print("=" * 50)
+    run_range_sync('cron', start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), concurrency)
     
     input("\nNhấn Enter để tiếp tục...")
 
@@ -930,14 +810,7 @@ def main():
             # Khoảng thời gian với rate limiting
             start_date, end_date = get_date_range()
             if start_date and end_date:
-                # Hỏi delay
-                print("\n\033[96m⏱️  Delay giữa mỗi ngày (giây)?\033[0m")
-                print("\033[90m   Khuyến nghị: 5-10s để tránh rate limit\033[0m")
-                delay_input = input("   Delay (mặc định 5): ").strip()
-                delay = int(delay_input) if delay_input.isdigit() else 5
-                delay = max(3, min(60, delay))  # Min 3s, max 60s
-                
-                run_cron_range(start_date, end_date, delay)
+                run_cron_range(start_date, end_date, ask_concurrency())
         
         elif choice == "6":
             yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
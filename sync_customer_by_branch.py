@@ -11,20 +11,26 @@ Author: Auto-generated
 Date: 2025-12-25
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
 import os
+import hashlib
 import sys
 import argparse
 import logging
-import time
+import asyncio
+import queue
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, Dict, List, Any
+
+from vttech import get_client, AsyncVTTechClient, RateLimiter
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from search_index import ensure_search_index, fold_text
+from table_stats import ensure_table_stats, recount_table_stats
 from urllib.parse import quote
 
 # ============== CONFIG ==============
@@ -38,6 +44,20 @@ SYNC_DIR = BASE_DIR / "data_sync"
 LOG_DIR = BASE_DIR / "logs"
 DB_PATH = BASE_DIR / "database" / "vttech.db"
 
+# Pipeline lấy / ghi khách hàng: số khách / trang LoadData, số trang tối đa chờ ghi DB
+# (giới hạn bộ nhớ), tổng số trang / giây cho mọi branch đang lấy đồng thời
+CUSTOMER_PAGE_LIMIT = 500
+PAGE_QUEUE_SIZE = 4
+PAGE_RPS = 2.0
+
+# Cột của customers lấy từ LoadData (ghi qua bảng tạm) và các cột được log khi thay đổi
+CUSTOMER_STAGE_COLUMNS = (
+    'id', 'code', 'name', 'phone', 'email', 'gender', 'birthday', 'address',
+    'city_id', 'district_id', 'ward_id', 'branch_id', 'source_id',
+    'membership_id', 'total_spent', 'total_debt', 'point', 'list_fingerprint', 'search_name',
+)
+CUSTOMER_TRACKED_FIELDS = ('name', 'phone', 'email', 'address', 'total_spent', 'total_debt', 'point', 'branch_id')
+
 # Tạo thư mục
 SYNC_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
@@ -54,6 +74,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def row_fingerprint(row: Dict) -> str:
+    """Fingerprint của 1 dòng LoadData (ListCustomer): hash toàn bộ row, gồm cả
+    TotalSpent/TotalDebt/Point. sync_customer_detail_full.py --incremental chỉ
+    lấy lại chi tiết khi fingerprint này thay đổi"""
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
 class VTTechCustomerSync:
     """
     Sync khách hàng từ VTTech theo quy trình:
@@ -63,13 +91,9 @@ class VTTechCustomerSync:
     """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.token = None
-        self.xsrf_tokens = {}
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD, use_session_cache=True)
         self.branches = []
+        self._stats_lock = threading.Lock()
         self.stats = {
             'total_branches': 0,
             'total_customers': 0,
@@ -78,102 +102,26 @@ class VTTechCustomerSync:
             'start_time': None
         }
     
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
-        """Đăng nhập và lấy token"""
+        """Đăng nhập và lấy token (dùng chung phiên của process)"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "",
-                    "from": "",
-                    "sso": "",
-                    "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            
-            if data.get("Session"):
-                self.token = data["Session"]
-                self.session.cookies.set("WebToken", self.token)
-                logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')} (ID: {data.get('ID')})")
-                return True
-            else:
-                logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
-                return False
-        except Exception as e:
-            logger.error(f"❌ Lỗi đăng nhập: {e}")
-            return False
+        return self.client.login()
     
     def init_page(self, page_url: str) -> bool:
         """Lấy XSRF token từ trang"""
-        if page_url in self.xsrf_tokens:
-            return True
-            
-        try:
-            resp = self.session.get(f"{BASE_URL}{page_url}", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_tokens[page_url] = match.group(1)
-                    return True
-        except Exception as e:
-            logger.error(f"❌ Lỗi init_page {page_url}: {e}")
-        return False
+        return self.client.init_page(page_url)
     
     def call_handler(self, page_url: str, handler: str, data: Dict = None, retry: int = 3) -> Any:
         """Gọi handler với XSRF token"""
-        for attempt in range(retry):
-            try:
-                if not self.init_page(page_url):
-                    continue
-                    
-                resp = self.session.post(
-                    f"{BASE_URL}{page_url}?handler={handler}",
-                    data=data or {},
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'X-Requested-With': 'XMLHttpRequest',
-                        'XSRF-TOKEN': self.xsrf_tokens.get(page_url, ''),
-                        'Accept': '*/*',
-                        'Origin': BASE_URL,
-                        'Referer': f'{BASE_URL}{page_url}'
-                    },
-                    timeout=120
-                )
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
+        result = self.client.call_handler(page_url, handler, data, retry=retry)
+        if result is None:
+            with self._stats_lock:
                 self.stats['errors'] += 1
-        return None
+        return result
     
     def get_conn(self) -> sqlite3.Connection:
         """Get database connection"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        return get_writer(DB_PATH)
     
     def ensure_customers_table(self):
         """Đảm bảo bảng customers tồn tại"""
@@ -213,6 +161,12 @@ class VTTechCustomerSync:
         except:
             pass  # Cột đã tồn tại
         
+        # Fingerprint dòng LoadData (dùng cho sync customer detail incremental)
+        try:
+            cursor.execute("ALTER TABLE customers ADD COLUMN list_fingerprint TEXT")
+        except:
+            pass  # Cột đã tồn tại
+        
         # Tạo index cho sync_date
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_sync_date ON customers(sync_date)")
         
@@ -271,34 +225,22 @@ class VTTechCustomerSync:
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_branch ON customers(branch_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_customers_code ON customers(code)")
         
+        # Full-text search (tên/SĐT/mã, không dấu) cho dashboard
+        ensure_search_index(conn, 'customers_fts')
+        
+        # Số dòng / bảng cho trang DB của dashboard (trigger table_stats)
+        ensure_table_stats(conn)
+        
         conn.commit()
         conn.close()
         logger.info("✅ Database tables ensured")
     
     def call_api(self, endpoint: str, data: Dict = None, retry: int = 3) -> Any:
         """Gọi API trực tiếp với JSON body"""
-        for attempt in range(retry):
-            try:
-                resp = self.session.post(
-                    f"{BASE_URL}{endpoint}",
-                    json=data or {},
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.token}"
-                    },
-                    timeout=120
-                )
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_api {endpoint}: {e}")
-                self.stats['errors'] += 1
-        return None
+        result = self.client.call_api(endpoint, data, retry=retry)
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def get_all_branches(self) -> List[Dict]:
         """
@@ -361,10 +303,29 @@ class VTTechCustomerSync:
             conn.close()
         return count
     
-    def get_customers_by_branch(self, branch_id: int, date_from: str, date_to: str, 
-                                 limit: int = 500) -> List[Dict]:
+    @staticmethod
+    def _page_form(branch_id: int, date_from: str, date_to: str, begin_id: int, limit: int) -> Dict:
+        """Form data của LoadData"""
+        # dateFrom=2025-12-25+00%3A00%3A00&dateTo=2025-12-25+00%3A00%3A00&branchID=26&type=5&BeginID=0&Limit=500
+        return {
+            'dateFrom': date_from,
+            'dateTo': date_to,
+            'branchID': branch_id,
+            'type': 5,
+            'BeginID': begin_id,
+            'Limit': limit
+        }
+    
+    @staticmethod
+    def _next_begin_id(page: List[Dict]) -> int:
+        """CustID cuối cùng của trang làm BeginID cho trang tiếp"""
+        last_customer = page[-1]
+        return last_customer.get('CustID', last_customer.get('ID', 0))
+    
+    def iter_customer_pages(self, branch_id: int, date_from: str, date_to: str,
+                            limit: int = CUSTOMER_PAGE_LIMIT, limiter: RateLimiter = None):
         """
-        Bước 2: Lấy List Khách Hàng theo Branch
+        Bước 2: Lấy List Khách Hàng theo Branch, trả về từng trang (generator)
         Endpoint: /Customer/ListCustomer/?handler=LoadData
         
         Parameters:
@@ -372,155 +333,167 @@ class VTTechCustomerSync:
             date_from: Ngày bắt đầu (format: YYYY-MM-DD HH:MM:SS)
             date_to: Ngày kết thúc (format: YYYY-MM-DD HH:MM:SS)
             limit: Số lượng records mỗi lần request
+            limiter: RateLimiter dùng chung giữa các branch (thay cho delay giữa các trang)
         """
-        all_customers = []
         begin_id = 0
         page = 1
         
         while True:
-            # Format data theo yêu cầu
-            # dateFrom=2025-12-25+00%3A00%3A00&dateTo=2025-12-25+00%3A00%3A00&branchID=26&type=5&BeginID=0&Limit=500
-            form_data = {
-                'dateFrom': date_from,
-                'dateTo': date_to,
-                'branchID': branch_id,
-                'type': 5,
-                'BeginID': begin_id,
-                'Limit': limit
-            }
+            if limiter is not None:
+                limiter.acquire()
             
-            logger.info(f"   📄 Trang {page}: BeginID={begin_id}, Limit={limit}")
+            logger.info(f"   📄 Branch {branch_id} - Trang {page}: BeginID={begin_id}, Limit={limit}")
+            result = self.call_handler("/Customer/ListCustomer/", "LoadData",
+                                       self._page_form(branch_id, date_from, date_to, begin_id, limit))
             
-            result = self.call_handler("/Customer/ListCustomer/", "LoadData", form_data)
+            if not (result and isinstance(result, list) and len(result) > 0):
+                return
+            logger.info(f"      ➜ Nhận được {len(result)} khách hàng")
+            yield result
             
-            if result and isinstance(result, list) and len(result) > 0:
-                all_customers.extend(result)
-                logger.info(f"      ➜ Nhận được {len(result)} khách hàng")
-                
-                # Nếu số lượng trả về < limit, đã hết data
-                if len(result) < limit:
-                    break
-                
-                # Lấy CustID cuối cùng làm BeginID cho page tiếp
-                last_customer = result[-1]
-                begin_id = last_customer.get('CustID', last_customer.get('ID', 0))
-                page += 1
-                
-                # Delay giữa các request để tránh rate limit
-                time.sleep(0.5)
-            else:
-                break
-        
+            # Nếu số lượng trả về < limit, đã hết data
+            if len(result) < limit:
+                return
+            begin_id = self._next_begin_id(result)
+            page += 1
+    
+    def get_customers_by_branch(self, branch_id: int, date_from: str, date_to: str, 
+                                 limit: int = CUSTOMER_PAGE_LIMIT) -> List[Dict]:
+        """Lấy toàn bộ khách hàng của 1 branch vào 1 list (tối đa PAGE_RPS trang / giây)"""
+        all_customers = []
+        for page in self.iter_customer_pages(branch_id, date_from, date_to, limit,
+                                             limiter=RateLimiter(PAGE_RPS, burst=1)):
+            all_customers.extend(page)
         return all_customers
     
+    async def iter_customer_pages_async(self, aclient, branch_id: int, date_from: str, date_to: str,
+                                        limit: int = CUSTOMER_PAGE_LIMIT, limiter: RateLimiter = None):
+        """Bản async của iter_customer_pages (các trang trong 1 branch vẫn tuần tự theo BeginID)"""
+        begin_id = 0
+        page = 1
+        
+        while True:
+            if limiter is not None:
+                await asyncio.to_thread(limiter.acquire)
+            
+            logger.info(f"   📄 Branch {branch_id} - Trang {page}: BeginID={begin_id}, Limit={limit}")
+            result = await aclient.call_handler("/Customer/ListCustomer/", "LoadData",
+                                                self._page_form(branch_id, date_from, date_to, begin_id, limit))
+            
+            if not (result and isinstance(result, list) and len(result) > 0):
+                return
+            yield result
+            
+            if len(result) < limit:
+                return
+            begin_id = self._next_begin_id(result)
+            page += 1
+    
+    @staticmethod
+    def _customer_row(data: Dict, branch_id: int = None) -> Dict:
+        """Map 1 dòng LoadData (ListCustomer) sang các cột của bảng customers"""
+        row = {
+            'id': data.get('CustID', data.get('ID')),
+            'code': data.get('Code', data.get('CustCode', '')),
+            'name': data.get('Name', data.get('CustName', data.get('CustomerName', ''))),
+            'phone': data.get('Phone', data.get('Mobile', data.get('CustPhone', ''))),
+            'email': data.get('Email', ''),
+            'gender': data.get('Gender', data.get('Sex', 0)),
+            'birthday': data.get('Birthday', data.get('BirthDay')),
+            'address': data.get('Address', ''),
+            'city_id': data.get('CityID'),
+            'district_id': data.get('DistrictID'),
+            'ward_id': data.get('WardID'),
+            'branch_id': branch_id or data.get('BranchID'),
+            'source_id': data.get('SourceID', data.get('CustomerSourceID')),
+            'membership_id': data.get('MembershipID'),
+            'total_spent': data.get('TotalSpent', data.get('TotalPaid', data.get('Paid', 0))),
+            'total_debt': data.get('TotalDebt', data.get('Debt', 0)),
+            'point': data.get('Point', 0),
+            'list_fingerprint': row_fingerprint(data),
+        }
+        row['search_name'] = fold_text(row['name'])
+        return row
+    
     def save_customers_to_db(self, customers: List[Dict], branch_id: int = None, sync_date: str = None) -> int:
         """Lưu customers vào database - Kiểm tra thay đổi và lưu logs
         
+        Cả trang được ghi theo batch (giống _bulk_upsert của sync_customer_detail_full.py):
+        executemany vào bảng tạm _stage_customers, 1 lệnh LEFT JOIN với customers sinh
+        data_change_logs (INSERT + UPDATE theo CUSTOMER_TRACKED_FIELDS), 1 lệnh INSERT OR REPLACE
+        
         Args:
             customers: Danh sách customers từ API
             branch_id: ID của branch
             sync_date: Ngày sync data (format: YYYY-MM-DD), dùng để tracking
         """
-        conn = self.get_conn()
-        count = 0
-        new_count = 0
-        updated_count = 0
-        
         # Nếu không có sync_date, dùng ngày hiện tại
         if not sync_date:
             sync_date = datetime.now().strftime('%Y-%m-%d')
         
-        # Các fields cần track thay đổi
-        tracked_fields = ['name', 'phone', 'email', 'address', 'total_spent', 'total_debt', 'point', 'branch_id']
+        # Trùng id trong 1 trang -> giữ dòng sau cùng (như khi ghi lần lượt)
+        rows = {}
+        for data in customers:
+            row = self._customer_row(data, branch_id)
+            if row['id'] is None:
+                logger.warning(f"  ⚠️ Bỏ qua customer không có ID: {row['name']}")
+                continue
+            rows[row['id']] = row
+        if not rows:
+            return 0
         
+        columns = list(CUSTOMER_STAGE_COLUMNS)
+        col_list = ', '.join(columns)
+        stage_rows = [tuple(row[c] for c in columns) for row in rows.values()]
+        
+        conn = self.get_conn()
+        count = 0
         try:
             conn.execute("BEGIN TRANSACTION")
             
-            for data in customers:
-                # Map fields từ API response sang database schema
-                customer_id = data.get('CustID', data.get('ID'))
-                
-                # Chuẩn bị dữ liệu mới
-                new_data = {
-                    'code': data.get('Code', data.get('CustCode', '')),
-                    'name': data.get('Name', data.get('CustName', data.get('CustomerName', ''))),
-                    'phone': data.get('Phone', data.get('Mobile', data.get('CustPhone', ''))),
-                    'email': data.get('Email', ''),
-                    'gender': data.get('Gender', data.get('Sex', 0)),
-                    'birthday': data.get('Birthday', data.get('BirthDay')),
-                    'address': data.get('Address', ''),
-                    'city_id': data.get('CityID'),
-                    'district_id': data.get('DistrictID'),
-                    'ward_id': data.get('WardID'),
-                    'branch_id': branch_id or data.get('BranchID'),
-                    'source_id': data.get('SourceID', data.get('CustomerSourceID')),
-                    'membership_id': data.get('MembershipID'),
-                    'total_spent': data.get('TotalSpent', data.get('TotalPaid', data.get('Paid', 0))),
-                    'total_debt': data.get('TotalDebt', data.get('Debt', 0)),
-                    'point': data.get('Point', 0),
-                }
-                
-                # Kiểm tra xem customer đã tồn tại chưa
-                cursor = conn.execute("SELECT * FROM customers WHERE id = ?", (customer_id,))
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # So sánh và log thay đổi
-                    for field in tracked_fields:
-                        old_val = existing[field]
-                        new_val = new_data.get(field)
-                        
-                        # Convert để so sánh
-                        old_str = str(old_val) if old_val is not None else ''
-                        new_str = str(new_val) if new_val is not None else ''
-                        
-                        if old_str != new_str:
-                            conn.execute("""
-                                INSERT INTO data_change_logs 
-                                (table_name, record_id, change_type, field_name, old_value, new_value, sync_date)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                            """, ('customers', customer_id, 'UPDATE', field, old_str, new_str, sync_date))
-                    
-                    updated_count += 1
-                else:
-                    # Customer mới - log INSERT
-                    conn.execute("""
-                        INSERT INTO data_change_logs 
-                        (table_name, record_id, change_type, field_name, old_value, new_value, sync_date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, ('customers', customer_id, 'INSERT', None, None, new_data.get('name'), sync_date))
-                    new_count += 1
-                
-                # Insert/Update customer
-                conn.execute("""
-                    INSERT OR REPLACE INTO customers 
-                    (id, code, name, phone, email, gender, birthday, address, 
-                     city_id, district_id, ward_id, branch_id, source_id, 
-                     membership_id, total_spent, total_debt, point, is_active, sync_date, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    new_data['code'],
-                    new_data['name'],
-                    new_data['phone'],
-                    new_data['email'],
-                    new_data['gender'],
-                    new_data['birthday'],
-                    new_data['address'],
-                    new_data['city_id'],
-                    new_data['district_id'],
-                    new_data['ward_id'],
-                    new_data['branch_id'],
-                    new_data['source_id'],
-                    new_data['membership_id'],
-                    new_data['total_spent'],
-                    new_data['total_debt'],
-                    new_data['point'],
-                    1,
-                    sync_date,
-                    datetime.now().isoformat()
-                ))
-                count += 1
+            # Bảng tạm cùng kiểu cột với customers -> giá trị mới được đổi kiểu (affinity) như khi lưu
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS _stage_customers AS SELECT {col_list} FROM customers WHERE 0")
+            conn.execute("DELETE FROM _stage_customers")
+            conn.executemany(
+                f"INSERT INTO _stage_customers ({col_list}) VALUES ({', '.join('?' * len(columns))})",
+                stage_rows
+            )
+            
+            # Log thay đổi: so sánh dạng text, NULL coi như ''
+            selects = ["""
+                SELECT 'customers', id, 'INSERT', NULL, NULL, name, :sync_date
+                FROM j WHERE old_id IS NULL"""]
+            for field in CUSTOMER_TRACKED_FIELDS:
+                old_val = f"COALESCE(CAST(old_{field} AS TEXT), '')"
+                new_val = f"COALESCE(CAST({field} AS TEXT), '')"
+                selects.append(f"""
+                SELECT 'customers', id, 'UPDATE', '{field}', {old_val}, {new_val}, :sync_date
+                FROM j WHERE old_id IS NOT NULL AND {old_val} != {new_val}""")
+            
+            conn.execute(f"""
+                WITH j AS (
+                    SELECT s.*, c.id AS old_id, {', '.join(f'c.{f} AS old_{f}' for f in CUSTOMER_TRACKED_FIELDS)}
+                    FROM _stage_customers s
+                    LEFT JOIN customers c ON c.id = s.id
+                )
+                INSERT INTO data_change_logs
+                (table_name, record_id, change_type, field_name, old_value, new_value, sync_date)
+                {' UNION ALL '.join(selects)}
+            """, {'sync_date': sync_date})
+            
+            new_count = conn.execute("""
+                SELECT COUNT(*) FROM _stage_customers s
+                WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.id = s.id)
+            """).fetchone()[0]
+            updated_count = len(stage_rows) - new_count
+            
+            # Insert/Update customer
+            cursor = conn.execute(f"""
+                INSERT OR REPLACE INTO customers
+                ({col_list}, is_active, sync_date, updated_at)
+                SELECT {col_list}, 1, ?, ? FROM _stage_customers ORDER BY rowid
+            """, (sync_date, datetime.now().isoformat()))
+            count = cursor.rowcount
             
             conn.commit()
             
@@ -530,11 +503,24 @@ class VTTechCustomerSync:
         except Exception as e:
             conn.rollback()
             logger.error(f"  ❌ Error saving customers: {e}")
-            self.stats['errors'] += 1
+            with self._stats_lock:
+                self.stats['errors'] += 1
+            count = 0
         finally:
             conn.close()
         return count
     
+    def refresh_table_stats(self):
+        """Đếm lại data_change_logs (bảng ghi nhiều, không có trigger đếm) cho trang DB của dashboard"""
+        conn = self.get_conn()
+        try:
+            recount_table_stats(conn, ('data_change_logs',))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error counting table_stats: {e}")
+        finally:
+            conn.close()
+    
     def log_sync(self, sync_date: str, sync_type: str, branch_id: int, 
                  branch_name: str, records_count: int, status: str, error_message: str = None):
         """Ghi log sync"""
@@ -550,15 +536,8 @@ class VTTechCustomerSync:
         finally:
             conn.close()
     
-    def sync_all_customers(self, date_from: str, date_to: str):
-        """
-        Sync toàn bộ khách hàng từ tất cả branches
-        
-        Quy trình:
-        1. Lấy tất cả Branch
-        2. Với mỗi Branch, lấy danh sách khách hàng
-        3. Lưu vào database
-        """
+    def _prepare_sync(self, date_from: str, date_to: str) -> Optional[List[Dict]]:
+        """Tạo bảng, đăng nhập và lấy danh sách branch. None nếu không thể sync"""
         self.stats['start_time'] = datetime.now()
         
         logger.info("\n" + "=" * 70)
@@ -572,62 +551,192 @@ class VTTechCustomerSync:
         # Đăng nhập
         if not self.login():
             logger.error("❌ Không thể đăng nhập. Dừng sync.")
-            return
+            return None
         
         # Bước 1: Lấy tất cả Branch
         branches = self.get_all_branches()
         if not branches:
             logger.error("❌ Không có branch nào. Dừng sync.")
-            return
+            return None
         
         # Bước 2: Với mỗi Branch, lấy danh sách khách hàng
         logger.info("\n" + "=" * 60)
         logger.info("👥 BƯỚC 2: LẤY KHÁCH HÀNG THEO TỪNG BRANCH")
         logger.info("=" * 60)
+        return branches
+    
+    def _finish_branch(self, branch_id: int, branch_name: str, fetched: int, saved: int,
+                       sync_date_str: str, error: str = None):
+        """Branch đã lấy + lưu xong: log + ghi sync_logs"""
+        if error:
+            logger.error(f"   ❌ Lỗi khi lấy khách hàng branch {branch_id}: {error}")
+            self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
+                          fetched, 'error', error)
+            with self._stats_lock:
+                self.stats['errors'] += 1
+        elif fetched:
+            logger.info(f"   ✅ [{branch_name}] Tìm thấy {fetched} khách hàng")
+            logger.info(f"   💾 [{branch_name}] Đã lưu {saved} khách hàng vào DB (sync_date: {sync_date_str})")
+            self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
+                          fetched, 'success')
+        else:
+            logger.info(f"   ℹ️ [{branch_name}] Không có khách hàng trong khoảng thời gian này")
+            self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
+                          0, 'no_data')
         
-        total_customers_saved = 0
+        self.stats['total_customers'] += fetched
+        self.stats['db_saved'] += saved
+    
+    def _write_item(self, progress: Dict, item: tuple, sync_date_str: str):
+        """
+        Writer: ('page', branch_id, branch_name, customers) -> lưu trang (1 transaction),
+        ('done', branch_id, branch_name, error) -> branch đã lấy hết
+        """
+        kind, branch_id, branch_name, payload = item
+        counts = progress.setdefault(branch_id, [0, 0])  # [đã lấy, đã lưu]
+        try:
+            if kind == 'page':
+                counts[0] += len(payload)
+                counts[1] += self.save_customers_to_db(payload, branch_id, sync_date=sync_date_str)
+            else:
+                fetched, saved = progress.pop(branch_id)
+                self._finish_branch(branch_id, branch_name, fetched, saved, sync_date_str, error=payload)
+        except Exception as e:
+            # Writer không được dừng giữa chừng (fetcher sẽ bị chặn vì hàng đợi đầy)
+            logger.error(f"   ❌ [{branch_name}] Lỗi ghi DB: {e}")
+            with self._stats_lock:
+                self.stats['errors'] += 1
+    
+    def sync_all_customers(self, date_from: str, date_to: str, concurrency: int = 1,
+                           rps: float = PAGE_RPS, limiter: RateLimiter = None):
+        """
+        Sync toàn bộ khách hàng từ tất cả branches
+        
+        Quy trình:
+        1. Lấy tất cả Branch
+        2. Với mỗi Branch, lấy danh sách khách hàng
+        3. Lưu vào database
+        
+        Pipeline: `concurrency` thread lấy trang của các branch (dùng chung limiter, mặc định
+        rps trang / giây) đẩy vào hàng đợi tối đa PAGE_QUEUE_SIZE trang; 1 writer thread ghi
+        trang trước vào DB trong khi trang sau đang tải. Bộ nhớ giới hạn theo hàng đợi, không theo branch
+        """
+        branches = self._prepare_sync(date_from, date_to)
+        if not branches:
+            return
         
         # Lấy sync_date từ date_from (format: YYYY-MM-DD HH:MM:SS -> YYYY-MM-DD)
         sync_date_str = date_from.split()[0] if ' ' in date_from else date_from
         
+        concurrency = max(1, min(concurrency, len(branches)))
+        limiter = limiter or RateLimiter(rps, burst=concurrency)
+        logger.info(f"⚡ Pipeline: {concurrency} branch đồng thời, tối đa {limiter.rate:g} trang/giây")
+        
+        tasks = queue.Queue()
         for i, branch in enumerate(branches, 1):
+            tasks.put((i, branch))
+        pages = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+        
+        writer = threading.Thread(
+            target=self._writer_loop, args=(pages, sync_date_str),
+            name='customer-writer', daemon=True
+        )
+        writer.start()
+        
+        fetchers = [
+            threading.Thread(target=self._fetch_loop,
+                             args=(tasks, pages, limiter, date_from, date_to, len(branches)),
+                             name=f'customer-fetcher-{n}', daemon=True)
+            for n in range(1, concurrency + 1)
+        ]
+        for t in fetchers:
+            t.start()
+        for t in fetchers:
+            t.join()
+        
+        pages.put(None)  # Báo writer dừng
+        writer.join()
+        self.refresh_table_stats()
+        
+        # In báo cáo
+        self.print_summary()
+    
+    def _fetch_loop(self, tasks: queue.Queue, pages: queue.Queue, limiter: RateLimiter,
+                    date_from: str, date_to: str, total: int):
+        """Fetcher: lấy lần lượt các branch còn lại, đẩy từng trang sang writer"""
+        while True:
+            try:
+                i, branch = tasks.get_nowait()
+            except queue.Empty:
+                return
+            
             branch_id = branch.get('ID')
             branch_name = branch.get('Name', f'Branch {branch_id}')
+            logger.info(f"\n📍 [{i}/{total}] Branch: {branch_name} (ID: {branch_id})")
             
-            logger.info(f"\n📍 [{i}/{len(branches)}] Branch: {branch_name} (ID: {branch_id})")
-            
+            error = None
             try:
-                # Lấy khách hàng của branch
-                customers = self.get_customers_by_branch(branch_id, date_from, date_to)
-                
-                if customers:
-                    logger.info(f"   ✅ Tìm thấy {len(customers)} khách hàng")
-                    
-                    # Lưu vào database với sync_date
-                    saved = self.save_customers_to_db(customers, branch_id, sync_date=sync_date_str)
-                    total_customers_saved += saved
-                    logger.info(f"   💾 Đã lưu {saved} khách hàng vào DB (sync_date: {sync_date_str})")
-                    
-                    # Log sync
-                    self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
-                                  len(customers), 'success')
-                else:
-                    logger.info(f"   ℹ️ Không có khách hàng trong khoảng thời gian này")
-                    self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
-                                  0, 'no_data')
-                
-                self.stats['total_customers'] += len(customers) if customers else 0
-                
+                for page in self.iter_customer_pages(branch_id, date_from, date_to, limiter=limiter):
+                    pages.put(('page', branch_id, branch_name, page))
             except Exception as e:
-                logger.error(f"   ❌ Lỗi khi lấy khách hàng branch {branch_id}: {e}")
-                self.log_sync(sync_date_str, 'customer_list', branch_id, branch_name, 
-                              0, 'error', str(e))
-                self.stats['errors'] += 1
-            
-            # Delay giữa các branch
-            time.sleep(1)
+                error = str(e)
+            pages.put(('done', branch_id, branch_name, error))
+    
+    def _writer_loop(self, pages: queue.Queue, sync_date_str: str):
+        """Writer thread duy nhất ghi vào SQLite"""
+        progress = {}
+        while True:
+            item = pages.get()
+            if item is None:
+                return
+            self._write_item(progress, item, sync_date_str)
+    
+    async def sync_all_customers_async(self, date_from: str, date_to: str, concurrency: int = 3,
+                                       rps: float = PAGE_RPS):
+        """
+        Bản async của sync_all_customers: nhiều branch được lấy đồng thời
+        (giới hạn bởi semaphore của AsyncVTTechClient + RateLimiter rps trang / giây).
+        Trang được đẩy vào asyncio.Queue tối đa PAGE_QUEUE_SIZE trang, ghi DB chạy ở thread
+        riêng (asyncio.to_thread) nên không chặn event loop và vẫn chỉ có 1 writer
+        """
+        branches = self._prepare_sync(date_from, date_to)
+        if not branches:
+            return
         
-        self.stats['db_saved'] = total_customers_saved
+        sync_date_str = date_from.split()[0] if ' ' in date_from else date_from
+        limiter = RateLimiter(rps, burst=concurrency)
+        logger.info(f"⚡ Async: {len(branches)} branches, {concurrency} request đồng thời, "
+                    f"tối đa {rps:g} trang/giây")
+        
+        pages = asyncio.Queue(maxsize=PAGE_QUEUE_SIZE)
+        
+        async def fetch_branch(aclient, branch):
+            branch_id = branch.get('ID')
+            branch_name = branch.get('Name', f'Branch {branch_id}')
+            error = None
+            try:
+                async for page in self.iter_customer_pages_async(aclient, branch_id, date_from, date_to,
+                                                                 limiter=limiter):
+                    await pages.put(('page', branch_id, branch_name, page))
+            except Exception as e:
+                error = str(e)
+            await pages.put(('done', branch_id, branch_name, error))
+        
+        async def write_pages():
+            progress = {}
+            while True:
+                item = await pages.get()
+                if item is None:
+                    return
+                await asyncio.to_thread(self._write_item, progress, item, sync_date_str)
+        
+        async with AsyncVTTechClient.from_client(self.client, concurrency) as aclient:
+            writer = asyncio.create_task(write_pages())
+            await asyncio.gather(*[fetch_branch(aclient, branch) for branch in branches])
+            await pages.put(None)
+            await writer
+            self.stats['errors'] += aclient.stats['errors']
+        self.refresh_table_stats()
         
         # In báo cáo
         self.print_summary()
@@ -691,6 +800,10 @@ def main():
     parser.add_argument('--date', type=str, help='Ngày sync (YYYY-MM-DD), mặc định hôm nay')
     parser.add_argument('--date-from', type=str, help='Ngày bắt đầu (YYYY-MM-DD)')
     parser.add_argument('--date-to', type=str, help='Ngày kết thúc (YYYY-MM-DD)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Số branch lấy đồng thời (dùng httpx async nếu có cài)')
+    parser.add_argument('--rps', type=float, default=PAGE_RPS,
+                        help=f'Tổng số trang LoadData / giây cho mọi branch (mặc định {PAGE_RPS:g})')
     
     args = parser.parse_args()
     
@@ -709,7 +822,10 @@ def main():
     
     # Tạo syncer và chạy
     syncer = VTTechCustomerSync()
-    syncer.sync_all_customers(date_from, date_to)
+    if AsyncVTTechClient is not None and args.concurrency > 1:
+        asyncio.run(syncer.sync_all_customers_async(date_from, date_to, args.concurrency, args.rps))
+    else:
+        syncer.sync_all_customers(date_from, date_to, args.concurrency, args.rps)
 
 
 if __name__ == "__main__":
@@ -12,21 +12,25 @@ Author: Auto-generated
 Date: 2025-12-25
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
 import os
 import sys
 import argparse
 import logging
 import time
+import queue
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 
+from vttech import get_client, VTTechClient, RateLimiter
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from table_stats import DETAIL_COUNTED_TABLES, ensure_table_stats, recount_table_stats
+
 # ============== CONFIG ==============
 BASE_URL = "https://tmtaza.vttechsolution.com"
 USERNAME = "ittest123"
@@ -43,6 +47,56 @@ SYNC_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 (SYNC_DIR / "customer_detail").mkdir(exist_ok=True)
 
+# Số customers ghi chung 1 transaction (writer thread của worker pool)
+DETAIL_WRITE_BATCH = 50
+
+# Cấu hình bulk upsert cho 5 bảng detail:
+#   key: cột UNIQUE (ON CONFLICT target, join với dữ liệu cũ)
+#   tracked: cột so sánh để ghi data_change_logs (UPDATE)
+#   insert_log: (cột record_id, cột giá trị) khi ghi log INSERT
+DETAIL_TABLES = {
+    'services': {
+        'table': 'customer_services',
+        'row': '_service_row',
+        'key': ('customer_id', 'service_id', 'created_date'),
+        'tracked': ('quantity', 'used_quantity', 'total', 'paid', 'debt', 'status'),
+        'insert_log': ('service_id', 'service_name'),
+        'stat': 'services_saved',
+    },
+    'treatments': {
+        'table': 'customer_treatments',
+        'row': '_treatment_row',
+        'key': ('customer_id', 'treatment_id'),
+        'tracked': ('status', 'employee_id', 'treatment_date'),
+        'insert_log': ('treatment_id', 'service_name'),
+        'stat': 'treatments_saved',
+    },
+    'payments': {
+        'table': 'customer_payments',
+        'row': '_payment_row',
+        'key': ('customer_id', 'payment_id'),
+        'tracked': ('amount', 'payment_method', 'payment_type'),
+        'insert_log': ('payment_id', 'amount'),
+        'stat': 'payments_saved',
+    },
+    'appointments': {
+        'table': 'customer_appointments',
+        'row': '_appointment_row',
+        'key': ('customer_id', 'appointment_id'),
+        'tracked': ('appointment_date', 'status', 'employee_id'),
+        'insert_log': ('appointment_id', 'service_name'),
+        'stat': 'appointments_saved',
+    },
+    'history': {
+        'table': 'customer_history',
+        'row': '_history_row',
+        'key': ('customer_id', 'history_id'),
+        'tracked': ('content', 'result'),
+        'insert_log': ('history_id', 'action_type'),
+        'stat': 'history_saved',
+    },
+}
+
 # ============== LOGGING ==============
 logging.basicConfig(
     level=logging.INFO,
@@ -66,19 +120,24 @@ class CustomerDetailSync:
     4. Lấy payments: /Customer/Payment/PaymentList/PaymentList_Service/?handler=LoadataPayment
     5. Lấy appointments: /Customer/ScheduleList_Schedule/?handler=Loadata
     6. Lấy history: /Customer/History/HistoryList_Care/?handler=LoadataHistory
+    
+    Chế độ worker pool (workers > 1): mỗi worker có session đăng nhập riêng
+    (server giữ customer context theo session), dùng chung 1 RateLimiter,
+    kết quả được ghi vào DB bởi 1 writer thread duy nhất
     """
     
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.token = None
-        self.xsrf_tokens = {}
+    def __init__(self, client: VTTechClient = None):
+        self.client = client or get_client(BASE_URL, USERNAME, PASSWORD, use_session_cache=False)
+        self._stats_lock = threading.Lock()
+        self._base_xsrf = ''
+        self.current_xsrf = ''
         self.current_customer_id = None
+        # customer_id -> list_fingerprint lúc chọn customer để sync
+        self._list_fingerprints = {}
         self.stats = {
             'total_customers': 0,
             'processed': 0,
+            'skipped_unchanged': 0,
             'services_saved': 0,
             'treatments_saved': 0,
             'payments_saved': 0,
@@ -88,140 +147,60 @@ class CustomerDetailSync:
             'start_time': None
         }
     
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
-        """Đăng nhập và lấy token"""
+        """Đăng nhập và lấy token (dùng chung phiên của process)"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "",
-                    "from": "",
-                    "sso": "",
-                    "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            
-            if data.get("Session"):
-                self.token = data["Session"]
-                self.session.cookies.set("WebToken", self.token)
-                logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')} (ID: {data.get('ID')})")
-                return True
-            else:
-                logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
-                return False
-        except Exception as e:
-            logger.error(f"❌ Lỗi đăng nhập: {e}")
-            return False
+        return self.client.login()
     
     def init_xsrf_token(self) -> str:
         """Lấy XSRF token từ ListCustomer page (cần gọi 1 lần sau login)"""
-        try:
-            resp = self.session.get(f"{BASE_URL}/Customer/ListCustomer", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    return match.group(1)
-        except Exception as e:
-            logger.error(f"❌ Lỗi lấy XSRF token: {e}")
-        return ''
+        return self.client.get_xsrf("/Customer/ListCustomer")
     
     def set_customer_context(self, customer_id: int) -> bool:
         """
         Set context cho customer bằng cách GET trang MainCustomer
         Đây là bước BẮT BUỘC trước khi gọi các handler lấy chi tiết
         """
-        try:
-            # Nếu chưa có XSRF token, lấy từ ListCustomer
-            if not hasattr(self, '_base_xsrf') or not self._base_xsrf:
-                self._base_xsrf = self.init_xsrf_token()
-            
-            # Access MainCustomer để set session context
-            resp = self.session.get(
-                f"{BASE_URL}/Customer/MainCustomer?CustomerID={customer_id}",
-                timeout=30
-            )
-            if resp.status_code == 200:
-                # Thử lấy XSRF từ MainCustomer page
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_tokens[customer_id] = match.group(1)
-                else:
-                    # Fallback: dùng XSRF từ ListCustomer
-                    self.xsrf_tokens[customer_id] = self._base_xsrf
-                
-                self.current_customer_id = customer_id
-                return True
-        except Exception as e:
-            logger.error(f"❌ Lỗi set_customer_context cho ID {customer_id}: {e}")
-        return False
+        # Nếu chưa có XSRF token, lấy từ ListCustomer
+        if not self._base_xsrf:
+            self._base_xsrf = self.init_xsrf_token()
+        
+        # Access MainCustomer để set session context
+        token = self.client.set_customer_context(customer_id)
+        if token is None:
+            logger.error(f"❌ Lỗi set_customer_context cho ID {customer_id}")
+            return False
+        
+        # Fallback: dùng XSRF từ ListCustomer nếu MainCustomer không có token
+        self.current_xsrf = token or self._base_xsrf
+        self.current_customer_id = customer_id
+        return True
     
     def call_handler(self, page_url: str, handler: str, data: Dict = None, retry: int = 3) -> Any:
         """Gọi handler với XSRF token và CustomerID"""
-        for attempt in range(retry):
-            try:
-                xsrf = self.xsrf_tokens.get(self.current_customer_id, '')
-                
-                # Tạo form data với CustomerID - BẮT BUỘC để server biết customer nào
-                form_data = {
-                    '__RequestVerificationToken': xsrf,
-                    'CustomerID': self.current_customer_id,
-                    '__CUSTOMERID': self.current_customer_id
-                }
-                # Merge với data truyền vào
-                if data:
-                    form_data.update(data)
-                
-                resp = self.session.post(
-                    f"{BASE_URL}{page_url}?handler={handler}",
-                    data=form_data,
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'X-Requested-With': 'XMLHttpRequest',
-                        'XSRF-TOKEN': xsrf,
-                        'xsrf-token': xsrf,
-                        'Accept': '*/*',
-                        'Origin': BASE_URL,
-                        'Referer': f'{BASE_URL}/Customer/MainCustomer?CustomerID={self.current_customer_id}'
-                    },
-                    timeout=60
-                )
-                
-                if resp.status_code == 200 and resp.content:
-                    # Kiểm tra không phải HTML error page
-                    if not resp.text.startswith('<!DOCTYPE'):
-                        return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(0.5)
-                    continue
-                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
-                self.stats['errors'] += 1
-        return None
+        # Form data với CustomerID - BẮT BUỘC để server biết customer nào
+        form_data = {
+            'CustomerID': self.current_customer_id,
+            '__CUSTOMERID': self.current_customer_id
+        }
+        if data:
+            form_data.update(data)
+        
+        result = self.client.call_handler(
+            page_url, handler, form_data,
+            retry=retry,
+            xsrf_token=self.current_xsrf,
+            form_token=True,
+            referer=f'{BASE_URL}/Customer/MainCustomer?CustomerID={self.current_customer_id}',
+            timeout=60
+        )
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def get_conn(self) -> sqlite3.Connection:
         """Get database connection"""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        return get_writer(DB_PATH)
     
     def ensure_tables(self):
         """Đảm bảo các bảng customer detail tồn tại"""
@@ -375,6 +354,21 @@ class CustomerDetailSync:
             )
         """)
         
+        # Bảng customer_detail_state - fingerprint dòng LoadData lúc sync detail thành công
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS customer_detail_state (
+                customer_id INTEGER PRIMARY KEY,
+                fingerprint TEXT,
+                synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # customers.list_fingerprint do sync_customer_by_branch.py ghi
+        try:
+            cursor.execute("ALTER TABLE customers ADD COLUMN list_fingerprint TEXT")
+        except:
+            pass  # Cột đã tồn tại (hoặc chưa có bảng customers)
+        
         # Tạo indexes cho change logs
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_logs_table ON data_change_logs(table_name)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_logs_record ON data_change_logs(record_id)")
@@ -387,11 +381,15 @@ class CustomerDetailSync:
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_ca_customer ON customer_appointments(customer_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_ch_customer ON customer_history(customer_id)")
         
+        # Số dòng / bảng cho trang DB của dashboard (trigger table_stats)
+        ensure_table_stats(conn)
+        
         conn.commit()
         conn.close()
         logger.info("✅ Database tables for customer detail ensured")
     
-    def get_customer_ids_to_sync(self, sync_date: str = None, date_from: str = None, date_to: str = None) -> List[int]:
+    def get_customer_ids_to_sync(self, sync_date: str = None, date_from: str = None, date_to: str = None,
+                                 incremental: bool = False) -> List[tuple]:
         """Lấy danh sách CustomerID cần sync từ database
         
         Logic: Lấy customers dựa vào cột sync_date (ngày dữ liệu được sync)
@@ -400,35 +398,45 @@ class CustomerDetailSync:
             sync_date: Sync customers từ ngày cụ thể (YYYY-MM-DD)
             date_from: Ngày bắt đầu khoảng thời gian (YYYY-MM-DD)
             date_to: Ngày kết thúc khoảng thời gian (YYYY-MM-DD)
+            incremental: Bỏ qua customers có list_fingerprint không đổi so với
+                lần sync detail thành công gần nhất (customer_detail_state)
         """
         conn = self.get_conn()
         
         if date_from and date_to:
             # Lấy customers theo khoảng sync_date
-            cursor = conn.execute("""
-                SELECT DISTINCT c.id, c.name, c.branch_id
-                FROM customers c
-                WHERE c.sync_date BETWEEN ? AND ?
-                ORDER BY c.id
-            """, (date_from, date_to))
+            where, params = "WHERE c.sync_date BETWEEN ? AND ?", (date_from, date_to)
         elif sync_date:
             # Lấy customers theo sync_date cụ thể
-            cursor = conn.execute("""
-                SELECT DISTINCT c.id, c.name, c.branch_id
-                FROM customers c
-                WHERE c.sync_date = ?
-                ORDER BY c.id
-            """, (sync_date,))
+            where, params = "WHERE c.sync_date = ?", (sync_date,)
         else:
             # Lấy tất cả customers
-            cursor = conn.execute("""
-                SELECT id, name, branch_id FROM customers ORDER BY id
-            """)
+            where, params = "", ()
+        
+        cursor = conn.execute(f"""
+            SELECT c.id, c.name, c.branch_id, c.list_fingerprint,
+                   s.fingerprint AS synced_fingerprint
+            FROM customers c
+            LEFT JOIN customer_detail_state s ON s.customer_id = c.id
+            {where}
+            ORDER BY c.id
+        """, params)
         
         customers = cursor.fetchall()
         conn.close()
         
-        return [(row['id'], row['name'], row['branch_id']) for row in customers]
+        result = []
+        for row in customers:
+            fingerprint = row['list_fingerprint']
+            # Chưa sync lần nào / chưa có fingerprint (ghi bởi script khác) -> luôn sync
+            unchanged = fingerprint is not None and fingerprint == row['synced_fingerprint']
+            if incremental and unchanged:
+                self.stats['skipped_unchanged'] += 1
+                continue
+            self._list_fingerprints[row['id']] = fingerprint
+            result.append((row['id'], row['name'], row['branch_id']))
+        
+        return result
     
     def get_customer_services(self, customer_id: int) -> List[Dict]:
         """Lấy dịch vụ của customer"""
@@ -518,378 +526,195 @@ class CustomerDetailSync:
         
         return history
     
-    def log_data_change(self, conn, table_name: str, record_id: int, change_type: str, 
-                        field_name: str = None, old_value: str = None, new_value: str = None):
-        """Ghi log thay đổi dữ liệu"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        try:
-            conn.execute("""
-                INSERT INTO data_change_logs 
-                (table_name, record_id, change_type, field_name, old_value, new_value, sync_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (table_name, record_id, change_type, field_name, 
-                  str(old_value) if old_value is not None else None,
-                  str(new_value) if new_value is not None else None, 
-                  today))
-        except Exception as e:
-            logger.debug(f"Error logging change: {e}")
+    # ============== BULK UPSERT ==============
     
-    def compare_and_log_changes(self, conn, table_name: str, record_id: int, 
-                                 old_data: dict, new_data: dict, tracked_fields: list):
-        """So sánh và log các thay đổi"""
-        changes = []
-        for field in tracked_fields:
-            old_val = old_data.get(field) if old_data else None
-            new_val = new_data.get(field)
-            
-            old_str = str(old_val) if old_val is not None else ''
-            new_str = str(new_val) if new_val is not None else ''
-            
-            if old_str != new_str:
-                self.log_data_change(conn, table_name, record_id, 'UPDATE', field, old_str, new_str)
-                changes.append(field)
+    @staticmethod
+    def _service_row(customer_id: int, svc: Dict) -> Dict:
+        return {
+            'customer_id': customer_id,
+            'service_id': svc.get('ServiceID', svc.get('ID')),
+            'service_name': svc.get('ServiceName', svc.get('Name', '')),
+            'service_code': svc.get('ServiceCode', svc.get('Code', '')),
+            'quantity': svc.get('Quantity', svc.get('Qty', 1)),
+            'used_quantity': svc.get('UsedQuantity', svc.get('Used', 0)),
+            'price': svc.get('Price', 0),
+            'discount': svc.get('Discount', 0),
+            'total': svc.get('Total', svc.get('Amount', 0)),
+            'paid': svc.get('Paid', 0),
+            'debt': svc.get('Debt', 0),
+            'status': svc.get('Status', svc.get('StatusName', '')),
+            'created_date': svc.get('CreatedDate', svc.get('CreateDate')),
+            'branch_id': svc.get('BranchID'),
+            'branch_name': svc.get('BranchName', ''),
+            'note': svc.get('Note', ''),
+            'raw_data': json.dumps(svc, ensure_ascii=False),
+        }
+    
+    @staticmethod
+    def _treatment_row(customer_id: int, t: Dict) -> Dict:
+        return {
+            'customer_id': customer_id,
+            'treatment_id': t.get('ID', t.get('TreatmentID')),
+            'service_id': t.get('ServiceID'),
+            'service_name': t.get('ServiceName', ''),
+            'employee_id': t.get('EmployeeID', t.get('DoctorID')),
+            'employee_name': t.get('EmployeeName', t.get('DoctorName', '')),
+            'treatment_date': t.get('TreatmentDate', t.get('Date')),
+            'branch_id': t.get('BranchID'),
+            'branch_name': t.get('BranchName', ''),
+            'status': t.get('Status', t.get('StatusName', '')),
+            'note': t.get('Note', ''),
+            'raw_data': json.dumps(t, ensure_ascii=False),
+        }
+    
+    @staticmethod
+    def _payment_row(customer_id: int, p: Dict) -> Dict:
+        return {
+            'customer_id': customer_id,
+            'payment_id': p.get('ID', p.get('PaymentID')),
+            'amount': p.get('Amount', p.get('Money', 0)),
+            'payment_date': p.get('PaymentDate', p.get('Date')),
+            'payment_method': p.get('PaymentMethod', p.get('Method', '')),
+            'payment_type': p.get('PaymentType', p.get('Type', '')),
+            'branch_id': p.get('BranchID'),
+            'branch_name': p.get('BranchName', ''),
+            'service_name': p.get('ServiceName', ''),
+            'note': p.get('Note', ''),
+            'raw_data': json.dumps(p, ensure_ascii=False),
+        }
+    
+    @staticmethod
+    def _appointment_row(customer_id: int, a: Dict) -> Dict:
+        return {
+            'customer_id': customer_id,
+            'appointment_id': a.get('ID', a.get('AppointmentID')),
+            'appointment_date': a.get('AppointmentDate', a.get('Date', a.get('DateApp'))),
+            'service_id': a.get('ServiceID'),
+            'service_name': a.get('ServiceName', ''),
+            'employee_id': a.get('EmployeeID', a.get('DoctorID')),
+            'employee_name': a.get('EmployeeName', a.get('DoctorName', '')),
+            'branch_id': a.get('BranchID'),
+            'branch_name': a.get('BranchName', ''),
+            'status': a.get('Status'),
+            'status_name': a.get('StatusName', ''),
+            'note': a.get('Note', ''),
+            'raw_data': json.dumps(a, ensure_ascii=False),
+        }
+    
+    @staticmethod
+    def _history_row(customer_id: int, h: Dict) -> Dict:
+        return {
+            'customer_id': customer_id,
+            'history_id': h.get('ID', h.get('HistoryID')),
+            'action_type': h.get('ActionType', h.get('Type', '')),
+            'action_date': h.get('ActionDate', h.get('Date')),
+            'employee_id': h.get('EmployeeID'),
+            'employee_name': h.get('EmployeeName', h.get('UserName', '')),
+            'content': h.get('Content', h.get('Description', '')),
+            'result': h.get('Result', ''),
+            'note': h.get('Note', ''),
+            'raw_data': json.dumps(h, ensure_ascii=False),
+        }
+    
+    def _bulk_upsert(self, conn, spec: Dict, rows: List[Dict], sync_date: str, synced_at: str) -> int:
+        """
+        Ghi 1 bảng detail cho cả batch:
+        1. executemany vào bảng tạm _stage_<table>
+        2. 1 lệnh LEFT JOIN với bảng chính -> data_change_logs (INSERT + UPDATE theo tracked fields)
+        3. 1 lệnh INSERT ... ON CONFLICT DO UPDATE
+        """
+        table = spec['table']
+        stage = f"_stage_{table}"
+        columns = list(rows[0].keys())
+        col_list = ', '.join(columns)
         
-        return changes
-
-    def save_customer_services(self, customer_id: int, services: List[Dict]) -> int:
-        """Lưu services vào database - Kiểm tra thay đổi và log"""
-        if not services:
-            return 0
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} AS SELECT {col_list} FROM {table} WHERE 0")
+        conn.execute(f"DELETE FROM {stage}")
+        conn.executemany(
+            f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(row[c] for c in columns) for row in rows]
+        )
         
-        conn = self.get_conn()
-        count = 0
-        new_count = 0
-        updated_count = 0
+        # Log thay đổi: so sánh dạng text, NULL coi như ''.
+        # Dòng API không có id (record_id NOT NULL) vẫn được lưu, chỉ không ghi log INSERT
+        id_col, value_col = spec['insert_log']
+        selects = [f"""
+            SELECT '{table}', {id_col}, 'INSERT', '{value_col}', NULL, CAST({value_col} AS TEXT), :sync_date
+            FROM j WHERE old_id IS NULL AND {id_col} IS NOT NULL"""]
+        for field in spec['tracked']:
+            old_val = f"COALESCE(CAST(old_{field} AS TEXT), '')"
+            new_val = f"COALESCE(CAST({field} AS TEXT), '')"
+            selects.append(f"""
+            SELECT '{table}', old_id, 'UPDATE', '{field}', {old_val}, {new_val}, :sync_date
+            FROM j WHERE old_id IS NOT NULL AND {old_val} != {new_val}""")
         
-        # Fields cần track
-        tracked_fields = ['quantity', 'used_quantity', 'total', 'paid', 'debt', 'status']
+        conn.execute(f"""
+            WITH j AS (
+                SELECT s.*, t.id AS old_id, {', '.join(f't.{f} AS old_{f}' for f in spec['tracked'])}
+                FROM {stage} s
+                LEFT JOIN {table} t ON {' AND '.join(f't.{k} = s.{k}' for k in spec['key'])}
+            )
+            INSERT INTO data_change_logs
+            (table_name, record_id, change_type, field_name, old_value, new_value, sync_date)
+            {' UNION ALL '.join(selects)}
+        """, {'sync_date': sync_date})
         
-        try:
-            conn.execute("BEGIN TRANSACTION")
-            
-            for svc in services:
-                service_id = svc.get('ServiceID', svc.get('ID'))
-                created_date = svc.get('CreatedDate', svc.get('CreateDate'))
-                
-                # Kiểm tra record cũ
-                cursor = conn.execute("""
-                    SELECT * FROM customer_services 
-                    WHERE customer_id = ? AND service_id = ? AND created_date = ?
-                """, (customer_id, service_id, created_date))
-                existing = cursor.fetchone()
-                
-                new_data = {
-                    'quantity': svc.get('Quantity', svc.get('Qty', 1)),
-                    'used_quantity': svc.get('UsedQuantity', svc.get('Used', 0)),
-                    'total': svc.get('Total', svc.get('Amount', 0)),
-                    'paid': svc.get('Paid', 0),
-                    'debt': svc.get('Debt', 0),
-                    'status': svc.get('Status', svc.get('StatusName', '')),
-                }
-                
-                if existing:
-                    old_data = dict(existing)
-                    self.compare_and_log_changes(conn, 'customer_services', existing['id'], old_data, new_data, tracked_fields)
-                    updated_count += 1
-                else:
-                    self.log_data_change(conn, 'customer_services', service_id, 'INSERT', 
-                                        'service_name', None, svc.get('ServiceName', svc.get('Name', '')))
-                    new_count += 1
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_services 
-                    (customer_id, service_id, service_name, service_code, quantity, used_quantity,
-                     price, discount, total, paid, debt, status, created_date, 
-                     branch_id, branch_name, note, raw_data, synced_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    service_id,
-                    svc.get('ServiceName', svc.get('Name', '')),
-                    svc.get('ServiceCode', svc.get('Code', '')),
-                    new_data['quantity'],
-                    new_data['used_quantity'],
-                    svc.get('Price', 0),
-                    svc.get('Discount', 0),
-                    new_data['total'],
-                    new_data['paid'],
-                    new_data['debt'],
-                    new_data['status'],
-                    created_date,
-                    svc.get('BranchID'),
-                    svc.get('BranchName', ''),
-                    svc.get('Note', ''),
-                    json.dumps(svc, ensure_ascii=False),
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error saving services for customer {customer_id}: {e}")
-        finally:
-            conn.close()
+        # Upsert (WHERE true: tránh nhầm ON CONFLICT với ON của JOIN khi parse)
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns + ['synced_at'] if c not in spec['key'])
+        conn.execute(f"""
+            INSERT INTO {table} ({col_list}, synced_at)
+            SELECT {col_list}, ? FROM {stage} WHERE true ORDER BY rowid
+            ON CONFLICT({', '.join(spec['key'])}) DO UPDATE SET {updates}
+        """, (synced_at,))
         
-        return count
+        return len(rows)
     
-    def save_customer_treatments(self, customer_id: int, treatments: List[Dict]) -> int:
-        """Lưu treatments vào database - Kiểm tra thay đổi và log"""
-        if not treatments:
-            return 0
-        
-        conn = self.get_conn()
-        count = 0
-        tracked_fields = ['status', 'employee_id', 'treatment_date']
+    def save_customer_details(self, items: List[tuple]) -> List[Dict]:
+        """
+        Ghi chi tiết của 1 batch customers [(customer_id, detail), ...] trong 1 transaction,
+        mỗi bảng 1 lần upsert. Lỗi -> rollback cả batch và raise
+        """
+        rows_by_table = {key: [] for key in DETAIL_TABLES}
+        results = []
+        for customer_id, detail in items:
+            result = {
+                'customer_id': customer_id,
+                'services': 0,
+                'treatments': 0,
+                'payments': 0,
+                'appointments': 0,
+                'history': 0,
+                'status': 'success',
+                'complete': detail.get('complete', True)
+            }
+            for key, spec in DETAIL_TABLES.items():
+                make_row = getattr(self, spec['row'])
+                rows = detail.get(key) or []
+                rows_by_table[key].extend(make_row(customer_id, r) for r in rows)
+                result[key] = len(rows)
+            results.append(result)
         
-        try:
-            conn.execute("BEGIN TRANSACTION")
-            
-            for t in treatments:
-                treatment_id = t.get('ID', t.get('TreatmentID'))
-                
-                # Kiểm tra record cũ
-                cursor = conn.execute("""
-                    SELECT * FROM customer_treatments 
-                    WHERE customer_id = ? AND treatment_id = ?
-                """, (customer_id, treatment_id))
-                existing = cursor.fetchone()
-                
-                new_data = {
-                    'status': t.get('Status', t.get('StatusName', '')),
-                    'employee_id': t.get('EmployeeID', t.get('DoctorID')),
-                    'treatment_date': t.get('TreatmentDate', t.get('Date')),
-                }
-                
-                if existing:
-                    old_data = dict(existing)
-                    self.compare_and_log_changes(conn, 'customer_treatments', existing['id'], old_data, new_data, tracked_fields)
-                else:
-                    self.log_data_change(conn, 'customer_treatments', treatment_id, 'INSERT',
-                                        'service_name', None, t.get('ServiceName', ''))
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_treatments 
-                    (customer_id, treatment_id, service_id, service_name, employee_id, employee_name,
-                     treatment_date, branch_id, branch_name, status, note, raw_data, synced_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    treatment_id,
-                    t.get('ServiceID'),
-                    t.get('ServiceName', ''),
-                    new_data['employee_id'],
-                    t.get('EmployeeName', t.get('DoctorName', '')),
-                    new_data['treatment_date'],
-                    t.get('BranchID'),
-                    t.get('BranchName', ''),
-                    new_data['status'],
-                    t.get('Note', ''),
-                    json.dumps(t, ensure_ascii=False),
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error saving treatments for customer {customer_id}: {e}")
-        finally:
-            conn.close()
-        return count
-    
-    def save_customer_payments(self, customer_id: int, payments: List[Dict]) -> int:
-        """Lưu payments vào database - Kiểm tra thay đổi và log"""
-        if not payments:
-            return 0
+        today = datetime.now().strftime('%Y-%m-%d')
+        synced_at = datetime.now().isoformat()
         
         conn = self.get_conn()
-        count = 0
-        tracked_fields = ['amount', 'payment_method', 'payment_type']
-        
         try:
             conn.execute("BEGIN TRANSACTION")
-            
-            for p in payments:
-                payment_id = p.get('ID', p.get('PaymentID'))
-                
-                # Kiểm tra record cũ
-                cursor = conn.execute("""
-                    SELECT * FROM customer_payments 
-                    WHERE customer_id = ? AND payment_id = ?
-                """, (customer_id, payment_id))
-                existing = cursor.fetchone()
-                
-                new_data = {
-                    'amount': p.get('Amount', p.get('Money', 0)),
-                    'payment_method': p.get('PaymentMethod', p.get('Method', '')),
-                    'payment_type': p.get('PaymentType', p.get('Type', '')),
-                }
-                
-                if existing:
-                    old_data = dict(existing)
-                    self.compare_and_log_changes(conn, 'customer_payments', existing['id'], old_data, new_data, tracked_fields)
-                else:
-                    self.log_data_change(conn, 'customer_payments', payment_id, 'INSERT',
-                                        'amount', None, str(new_data['amount']))
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_payments 
-                    (customer_id, payment_id, amount, payment_date, payment_method, payment_type,
-                     branch_id, branch_name, service_name, note, raw_data, synced_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    payment_id,
-                    new_data['amount'],
-                    p.get('PaymentDate', p.get('Date')),
-                    new_data['payment_method'],
-                    new_data['payment_type'],
-                    p.get('BranchID'),
-                    p.get('BranchName', ''),
-                    p.get('ServiceName', ''),
-                    p.get('Note', ''),
-                    json.dumps(p, ensure_ascii=False),
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            
+            for key, spec in DETAIL_TABLES.items():
+                if rows_by_table[key]:
+                    self._bulk_upsert(conn, spec, rows_by_table[key], today, synced_at)
             conn.commit()
-        except Exception as e:
+        except Exception:
             conn.rollback()
-            logger.error(f"Error saving payments for customer {customer_id}: {e}")
+            raise
         finally:
             conn.close()
-        return count
-    
-    def save_customer_appointments(self, customer_id: int, appointments: List[Dict]) -> int:
-        """Lưu appointments vào database - Kiểm tra thay đổi và log"""
-        if not appointments:
-            return 0
-        
-        conn = self.get_conn()
-        count = 0
-        tracked_fields = ['appointment_date', 'status', 'employee_id']
         
-        try:
-            conn.execute("BEGIN TRANSACTION")
-            
-            for a in appointments:
-                appointment_id = a.get('ID', a.get('AppointmentID'))
-                
-                # Kiểm tra record cũ
-                cursor = conn.execute("""
-                    SELECT * FROM customer_appointments 
-                    WHERE customer_id = ? AND appointment_id = ?
-                """, (customer_id, appointment_id))
-                existing = cursor.fetchone()
-                
-                new_data = {
-                    'appointment_date': a.get('AppointmentDate', a.get('Date', a.get('DateApp'))),
-                    'status': a.get('Status'),
-                    'employee_id': a.get('EmployeeID', a.get('DoctorID')),
-                }
-                
-                if existing:
-                    old_data = dict(existing)
-                    self.compare_and_log_changes(conn, 'customer_appointments', existing['id'], old_data, new_data, tracked_fields)
-                else:
-                    self.log_data_change(conn, 'customer_appointments', appointment_id, 'INSERT',
-                                        'service_name', None, a.get('ServiceName', ''))
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_appointments 
-                    (customer_id, appointment_id, appointment_date, service_id, service_name,
-                     employee_id, employee_name, branch_id, branch_name, status, status_name,
-                     note, raw_data, synced_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    appointment_id,
-                    new_data['appointment_date'],
-                    a.get('ServiceID'),
-                    a.get('ServiceName', ''),
-                    a.get('EmployeeID', a.get('DoctorID')),
-                    a.get('EmployeeName', a.get('DoctorName', '')),
-                    a.get('BranchID'),
-                    a.get('BranchName', ''),
-                    a.get('Status'),
-                    a.get('StatusName', ''),
-                    a.get('Note', ''),
-                    json.dumps(a, ensure_ascii=False),
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error saving appointments for customer {customer_id}: {e}")
-        finally:
-            conn.close()
-        return count
+        for result in results:
+            for key, spec in DETAIL_TABLES.items():
+                self.stats[spec['stat']] += result[key]
+        return results
     
-    def save_customer_history(self, customer_id: int, history: List[Dict]) -> int:
-        """Lưu history vào database - Kiểm tra thay đổi và log"""
-        if not history:
-            return 0
-        
-        conn = self.get_conn()
-        count = 0
-        tracked_fields = ['content', 'result']
-        
-        try:
-            conn.execute("BEGIN TRANSACTION")
-            
-            for h in history:
-                history_id = h.get('ID', h.get('HistoryID'))
-                
-                # Kiểm tra record cũ
-                cursor = conn.execute("""
-                    SELECT * FROM customer_history 
-                    WHERE customer_id = ? AND history_id = ?
-                """, (customer_id, history_id))
-                existing = cursor.fetchone()
-                
-                new_data = {
-                    'content': h.get('Content', h.get('Description', '')),
-                    'result': h.get('Result', ''),
-                }
-                
-                if existing:
-                    old_data = dict(existing)
-                    self.compare_and_log_changes(conn, 'customer_history', existing['id'], old_data, new_data, tracked_fields)
-                else:
-                    self.log_data_change(conn, 'customer_history', history_id, 'INSERT',
-                                        'action_type', None, h.get('ActionType', h.get('Type', '')))
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_history 
-                    (customer_id, history_id, action_type, action_date, employee_id, employee_name,
-                     content, result, note, raw_data, synced_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    customer_id,
-                    history_id,
-                    h.get('ActionType', h.get('Type', '')),
-                    h.get('ActionDate', h.get('Date')),
-                    h.get('EmployeeID'),
-                    h.get('EmployeeName', h.get('UserName', '')),
-                    new_data['content'],
-                    new_data['result'],
-                    h.get('Note', ''),
-                    json.dumps(h, ensure_ascii=False),
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Error saving history for customer {customer_id}: {e}")
-        finally:
-            conn.close()
-        return count
     
     def log_sync(self, customer_id: int, sync_date: str, 
                  services_count: int, treatments_count: int, 
@@ -911,57 +736,76 @@ class CustomerDetailSync:
         finally:
             conn.close()
     
-    def sync_customer_detail(self, customer_id: int, customer_name: str = '') -> Dict:
-        """Sync chi tiết của một customer"""
-        result = {
-            'customer_id': customer_id,
-            'services': 0,
-            'treatments': 0,
-            'payments': 0,
-            'appointments': 0,
-            'history': 0,
-            'status': 'success'
-        }
-        
+    def refresh_table_stats(self):
+        """Đếm lại các bảng detail + data_change_logs (không có trigger đếm) cho trang DB của dashboard"""
+        conn = self.get_conn()
+        try:
+            recount_table_stats(conn, DETAIL_COUNTED_TABLES)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error counting table_stats: {e}")
+        finally:
+            conn.close()
+    
+    def mark_detail_synced(self, customer_id: int):
+        """Ghi nhận fingerprint đã sync detail (dùng cho --incremental)"""
+        fingerprint = self._list_fingerprints.get(customer_id)
+        if not fingerprint:
+            return
+        conn = self.get_conn()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO customer_detail_state (customer_id, fingerprint, synced_at)
+                VALUES (?, ?, ?)
+            """, (customer_id, fingerprint, datetime.now().isoformat()))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving detail state: {e}")
+        finally:
+            conn.close()
+    
+    def fetch_customer_detail(self, customer_id: int) -> Optional[Dict[str, List[Dict]]]:
+        """Lấy 5 tab chi tiết của một customer (không ghi DB). None nếu không set được context"""
         # Bước 1: Set context
         if not self.set_customer_context(customer_id):
-            result['status'] = 'error'
-            result['error'] = 'Failed to set customer context'
-            return result
-        
-        # Bước 2: Lấy services
-        services = self.get_customer_services(customer_id)
-        if services:
-            result['services'] = self.save_customer_services(customer_id, services)
-            self.stats['services_saved'] += result['services']
-        
-        # Bước 3: Lấy treatments
-        treatments = self.get_customer_treatments(customer_id)
-        if treatments:
-            result['treatments'] = self.save_customer_treatments(customer_id, treatments)
-            self.stats['treatments_saved'] += result['treatments']
-        
-        # Bước 4: Lấy payments
-        payments = self.get_customer_payments(customer_id)
-        if payments:
-            result['payments'] = self.save_customer_payments(customer_id, payments)
-            self.stats['payments_saved'] += result['payments']
-        
-        # Bước 5: Lấy appointments
-        appointments = self.get_customer_appointments(customer_id)
-        if appointments:
-            result['appointments'] = self.save_customer_appointments(customer_id, appointments)
-            self.stats['appointments_saved'] += result['appointments']
-        
-        # Bước 6: Lấy history
-        history = self.get_customer_history(customer_id)
-        if history:
-            result['history'] = self.save_customer_history(customer_id, history)
-            self.stats['history_saved'] += result['history']
+            return None
         
-        return result
+        # Bước 2-6: services, treatments, payments, appointments, history
+        errors_before = self.stats['errors']
+        detail = {
+            'services': self.get_customer_services(customer_id),
+            'treatments': self.get_customer_treatments(customer_id),
+            'payments': self.get_customer_payments(customer_id),
+            'appointments': self.get_customer_appointments(customer_id),
+            'history': self.get_customer_history(customer_id)
+        }
+        # Có tab lỗi -> không ghi nhận fingerprint để lần sau lấy lại
+        detail['complete'] = self.stats['errors'] == errors_before
+        return detail
+    
+    def save_customer_detail(self, customer_id: int, detail: Dict[str, List[Dict]]) -> Dict:
+        """Ghi chi tiết đã lấy được của 1 customer vào database"""
+        return self.save_customer_details([(customer_id, detail)])[0]
     
-    def sync_all_customer_details(self, sync_date: str = None, date_from: str = None, date_to: str = None, limit: int = None):
+    def sync_customer_detail(self, customer_id: int, customer_name: str = '') -> Dict:
+        """Sync chi tiết của một customer"""
+        detail = self.fetch_customer_detail(customer_id)
+        if detail is None:
+            return {
+                'customer_id': customer_id,
+                'services': 0,
+                'treatments': 0,
+                'payments': 0,
+                'appointments': 0,
+                'history': 0,
+                'status': 'error',
+                'error': 'Failed to set customer context'
+            }
+        return self.save_customer_detail(customer_id, detail)
+    
+    def sync_all_customer_details(self, sync_date: str = None, date_from: str = None, date_to: str = None,
+                                  limit: int = None, workers: int = 1, rps: float = None,
+                                  incremental: bool = False):
         """
         Sync chi tiết của tất cả customers
         
@@ -970,6 +814,9 @@ class CustomerDetailSync:
             date_from: Ngày bắt đầu khoảng thời gian
             date_to: Ngày kết thúc khoảng thời gian
             limit: Giới hạn số lượng customers để sync (cho test)
+            workers: Số worker song song (mỗi worker 1 session riêng)
+            rps: Giới hạn tổng số request/giây cho tất cả workers
+            incremental: Chỉ lấy detail của customers mới hoặc có dòng LoadData thay đổi
         """
         self.stats['start_time'] = datetime.now()
         
@@ -985,13 +832,13 @@ class CustomerDetailSync:
         # Đảm bảo tables tồn tại
         self.ensure_tables()
         
-        # Đăng nhập
-        if not self.login():
+        # Đăng nhập (worker pool: mỗi worker tự đăng nhập session riêng)
+        if workers <= 1 and not self.login():
             logger.error("❌ Không thể đăng nhập. Dừng sync.")
             return
         
         # Lấy danh sách customers cần sync
-        customers = self.get_customer_ids_to_sync(sync_date, date_from, date_to)
+        customers = self.get_customer_ids_to_sync(sync_date, date_from, date_to, incremental=incremental)
         
         if limit:
             customers = customers[:limit]
@@ -999,29 +846,28 @@ class CustomerDetailSync:
         self.stats['total_customers'] = len(customers)
         
         logger.info(f"📋 Tìm thấy {len(customers)} customers cần sync")
+        if incremental:
+            logger.info(f"⏭️ Bỏ qua {self.stats['skipped_unchanged']} customers không thay đổi (incremental)")
         
         today = datetime.now().strftime('%Y-%m-%d')
         
+        if workers > 1:
+            self._sync_with_workers(customers, today, workers, rps)
+        else:
+            self._sync_sequential(customers, today)
+        self.refresh_table_stats()
+        
+        # In tổng kết
+        self.print_summary()
+    
+    def _sync_sequential(self, customers: List[tuple], today: str):
+        """Sync lần lượt từng customer (chế độ mặc định)"""
         for i, (customer_id, customer_name, branch_id) in enumerate(customers, 1):
             logger.info(f"\n👤 [{i}/{len(customers)}] Customer ID: {customer_id} - {customer_name}")
             
             try:
                 result = self.sync_customer_detail(customer_id, customer_name)
-                
-                logger.info(f"   ✅ Services: {result['services']}, Treatments: {result['treatments']}, "
-                           f"Payments: {result['payments']}, Appointments: {result['appointments']}, "
-                           f"History: {result['history']}")
-                
-                # Log sync
-                self.log_sync(
-                    customer_id, today,
-                    result['services'], result['treatments'],
-                    result['payments'], result['appointments'],
-                    result['history'], result['status']
-                )
-                
-                self.stats['processed'] += 1
-                
+                self._log_result(result, today)
             except Exception as e:
                 logger.error(f"   ❌ Lỗi: {e}")
                 self.log_sync(customer_id, today, 0, 0, 0, 0, 0, 'error', str(e))
@@ -1029,9 +875,150 @@ class CustomerDetailSync:
             
             # Delay giữa các customers
             time.sleep(0.3)
+    
+    def _log_result(self, result: Dict, today: str):
+        """Log kết quả sync 1 customer vào console + customer_detail_sync_logs"""
+        logger.info(f"   ✅ Services: {result['services']}, Treatments: {result['treatments']}, "
+                   f"Payments: {result['payments']}, Appointments: {result['appointments']}, "
+                   f"History: {result['history']}")
         
-        # In tổng kết
-        self.print_summary()
+        self.log_sync(
+            result['customer_id'], today,
+            result['services'], result['treatments'],
+            result['payments'], result['appointments'],
+            result['history'], result['status'],
+            result.get('error')
+        )
+        
+        if result['status'] == 'success':
+            self.stats['processed'] += 1
+            if result.get('complete'):
+                self.mark_detail_synced(result['customer_id'])
+        else:
+            self.stats['errors'] += 1
+    
+    # ============== WORKER POOL ==============
+    
+    def _sync_with_workers(self, customers: List[tuple], today: str, workers: int, rps: float = None):
+        """
+        Worker pool: N worker threads lấy dữ liệu (mỗi worker 1 session),
+        1 writer thread ghi DB. Hàng đợi kết quả có giới hạn để worker không chạy quá xa writer
+        """
+        if not customers:
+            return
+        workers = min(workers, len(customers))
+        limiter = RateLimiter(rps) if rps else None
+        logger.info(f"⚡ Worker pool: {workers} workers"
+                    + (f", tối đa {rps} request/giây" if rps else ""))
+        
+        tasks = queue.Queue()
+        for i, customer in enumerate(customers, 1):
+            tasks.put((i, customer))
+        results = queue.Queue(maxsize=workers * 2)
+        
+        writer = threading.Thread(
+            target=self._writer_loop, args=(results, today, len(customers)),
+            name='detail-writer', daemon=True
+        )
+        writer.start()
+        
+        threads = [
+            threading.Thread(target=self._worker_loop, args=(n, tasks, results, limiter),
+                             name=f'detail-worker-{n}', daemon=True)
+            for n in range(1, workers + 1)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        # Customers còn lại (tất cả worker đều không đăng nhập được)
+        while not tasks.empty():
+            i, (customer_id, customer_name, branch_id) = tasks.get_nowait()
+            results.put((i, customer_id, customer_name, None, 'Worker login failed'))
+        
+        results.put(None)  # Báo writer dừng
+        writer.join()
+    
+    def _worker_loop(self, worker_id: int, tasks: queue.Queue, results: queue.Queue,
+                     limiter: Optional[RateLimiter]):
+        """Worker: session riêng, lấy chi tiết customer và đẩy sang writer"""
+        fetcher = CustomerDetailSync(client=VTTechClient(
+            BASE_URL, USERNAME, PASSWORD,
+            rate_limiter=limiter,
+            use_session_cache=False
+        ))
+        if not fetcher.client.login():
+            logger.error(f"❌ Worker {worker_id}: không thể đăng nhập")
+            return
+        
+        while True:
+            try:
+                i, (customer_id, customer_name, branch_id) = tasks.get_nowait()
+            except queue.Empty:
+                break
+            
+            try:
+                detail = fetcher.fetch_customer_detail(customer_id)
+                error = None if detail is not None else 'Failed to set customer context'
+            except Exception as e:
+                detail, error = None, str(e)
+            results.put((i, customer_id, customer_name, detail, error))
+        
+        with self._stats_lock:
+            self.stats['errors'] += fetcher.stats['errors']
+        fetcher.client.close()
+    
+    def _writer_loop(self, results: queue.Queue, today: str, total: int):
+        """Writer thread duy nhất ghi vào SQLite, gom tối đa DETAIL_WRITE_BATCH customers / transaction"""
+        done = False
+        while not done:
+            batch = [results.get()]
+            while len(batch) < DETAIL_WRITE_BATCH:
+                try:
+                    batch.append(results.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            
+            items = []
+            headers = {}
+            for i, customer_id, customer_name, detail, error in batch:
+                header = f"\n👤 [{i}/{total}] Customer ID: {customer_id} - {customer_name}"
+                if detail is None:
+                    logger.info(header)
+                    self._log_error(customer_id, today, error)
+                else:
+                    headers[customer_id] = header
+                    items.append((customer_id, detail))
+            if not items:
+                continue
+            
+            try:
+                saved = self.save_customer_details(items)
+            except Exception as e:
+                # Lỗi cả batch -> ghi lại từng customer để khoanh vùng customer lỗi
+                logger.warning(f"⚠️ Lỗi ghi batch {len(items)} customers ({e}), ghi lại từng customer")
+                saved = []
+                for customer_id, detail in items:
+                    try:
+                        saved.append(self.save_customer_detail(customer_id, detail))
+                    except Exception as e:
+                        logger.info(headers[customer_id])
+                        self._log_error(customer_id, today, str(e))
+            
+            with self._stats_lock:
+                for result in saved:
+                    logger.info(headers[result['customer_id']])
+                    self._log_result(result, today)
+    
+    def _log_error(self, customer_id: int, today: str, error: str):
+        logger.error(f"   ❌ Lỗi: {error}")
+        self.log_sync(customer_id, today, 0, 0, 0, 0, 0, 'error', error)
+        with self._stats_lock:
+            self.stats['errors'] += 1
     
     def print_summary(self):
         """In tổng kết sync"""
@@ -1042,6 +1029,7 @@ class CustomerDetailSync:
         logger.info("=" * 70)
         logger.info(f"   👥 Tổng customers: {self.stats['total_customers']}")
         logger.info(f"   ✅ Đã xử lý: {self.stats['processed']}")
+        logger.info(f"   ⏭️ Không đổi (bỏ qua): {self.stats['skipped_unchanged']}")
         logger.info(f"   ❌ Lỗi: {self.stats['errors']}")
         logger.info(f"   📦 Services: {self.stats['services_saved']}")
         logger.info(f"   💊 Treatments: {self.stats['treatments_saved']}")
@@ -1088,6 +1076,10 @@ def main():
     parser.add_argument('--date-to', type=str, help='Ngày kết thúc khoảng thời gian (YYYY-MM-DD)')
     parser.add_argument('--limit', type=int, help='Giới hạn số customers để sync (cho test)')
     parser.add_argument('--customer-id', type=int, help='Sync chi tiết của một customer cụ thể')
+    parser.add_argument('--workers', type=int, default=1, help='Số worker song song, mỗi worker 1 session (mặc định: 1)')
+    parser.add_argument('--rps', type=float, default=None, help='Giới hạn tổng số request/giây khi chạy nhiều workers')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Chỉ sync customers mới hoặc có dòng ListCustomer thay đổi (theo fingerprint)')
     
     args = parser.parse_args()
     
@@ -1106,12 +1098,17 @@ def main():
             syncer.sync_all_customer_details(
                 date_from=args.date_from, 
                 date_to=args.date_to, 
-                limit=args.limit
+                limit=args.limit,
+                workers=args.workers,
+                rps=args.rps,
+                incremental=args.incremental
             )
         else:
             # Nếu có --date, sử dụng date đó, nếu không dùng ngày hôm nay
             sync_date = args.date or datetime.now().strftime('%Y-%m-%d')
-            syncer.sync_all_customer_details(sync_date=sync_date, limit=args.limit)
+            syncer.sync_all_customer_details(sync_date=sync_date, limit=args.limit,
+                                             workers=args.workers, rps=args.rps,
+                                             incremental=args.incremental)
 
 
 if __name__ == "__main__":
@@ -10,18 +10,19 @@ Usage:
     python3 sync_date_range.py --days 7                 # 7 ngày gần nhất
 """
 
-import requests
-import json
-import base64
-import zlib
-import re
-import sqlite3
+import sys
 import argparse
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List
 
+from vttech import get_client
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from init_db import refresh_revenue_summaries
+
 # ============== CONFIGURATION ==============
 BASE_URL = 'https://tmtaza.vttechsolution.com'
 USERNAME = 'ittest123'
@@ -30,6 +31,9 @@ PASSWORD = 'ittest123'
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'database' / 'vttech.db'
 LOG_DIR = BASE_DIR / 'logs'
+
+# Trang lấy XSRF token dùng chung cho các handler
+XSRF_PAGE = '/Customer/ListCustomer'
 LOG_DIR.mkdir(exist_ok=True)
 
 # Logging
@@ -46,101 +50,31 @@ logger = logging.getLogger(__name__)
 
 class DateRangeSync:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
-        })
-        self.token = None
-        self.xsrf_token = None
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
         self.db_conn = None
         
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            data = data.strip('"')
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
         """Đăng nhập"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(f'{BASE_URL}/api/Author/Login', json={
-                'username': USERNAME,
-                'password': PASSWORD,
-                'passwordcrypt': '', 'from': '', 'sso': '', 'ssotoken': ''
-            })
-            data = resp.json()
-            
-            if data.get('Session'):
-                self.token = data['Session']
-                self.session.cookies.set('WebToken', self.token)
-                logger.info(f"✅ Login: {data.get('FullName')} (ID: {data.get('ID')})")
-                
-                # Get XSRF token
-                resp = self.session.get(f'{BASE_URL}/Customer/ListCustomer')
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_token = match.group(1)
-                    logger.info("✅ Got XSRF token")
-                
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Login error: {e}")
+        if not self.client.login():
             return False
+        
+        # Get XSRF token (cache trong client)
+        if self.client.get_xsrf(XSRF_PAGE):
+            logger.info("✅ Got XSRF token")
+        return True
     
     def call_handler(self, page: str, handler: str, data: dict = None) -> Any:
         """Gọi page handler"""
-        try:
-            form_data = {'__RequestVerificationToken': self.xsrf_token or ''}
-            if data:
-                form_data.update(data)
-            
-            resp = self.session.post(
-                f'{BASE_URL}{page}?handler={handler}',
-                data=form_data,
-                headers={
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'xsrf-token': self.xsrf_token or '',
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                }
-            )
-            
-            if resp.status_code == 200 and not resp.text.startswith('<!DOCTYPE'):
-                return self.decompress(resp.text)
-            return None
-        except Exception as e:
-            logger.error(f"❌ Handler error: {e}")
-            return None
+        return self.client.call_handler(page, handler, data, xsrf_page=XSRF_PAGE, form_token=True)
     
     def call_api(self, endpoint: str, data: dict = None) -> Any:
         """Gọi API endpoint"""
-        try:
-            resp = self.session.post(
-                f'{BASE_URL}{endpoint}',
-                json=data or {},
-                headers={
-                    'Authorization': f'Bearer {self.token}',
-                    'Content-Type': 'application/json'
-                }
-            )
-            if resp.status_code == 200:
-                return self.decompress(resp.text)
-            return None
-        except:
-            return None
+        return self.client.call_api(endpoint, data)
     
     def connect_db(self):
         """Kết nối database"""
-        self.db_conn = sqlite3.connect(DB_PATH)
-        self.db_conn.row_factory = sqlite3.Row
+        self.db_conn = get_writer(DB_PATH)
         logger.info(f"📦 Connected to {DB_PATH}")
     
     def sync_master_data(self):
@@ -230,6 +164,7 @@ class DateRangeSync:
                 
                 total_revenue += paid
         
+        refresh_revenue_summaries(self.db_conn, [date])
         self.db_conn.commit()
         return total_revenue
     
@@ -324,7 +259,7 @@ class DateRangeSync:
     def sync_customer_detail(self, customer_id: int) -> int:
         """Sync chi tiết 1 customer"""
         # Set context
-        self.session.get(f'{BASE_URL}/Customer/MainCustomer?CustomerID={customer_id}')
+        self.client.set_customer_context(customer_id)
         
         cursor = self.db_conn.cursor()
         count = 0
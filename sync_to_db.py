@@ -16,16 +16,13 @@ Features:
 Usage:
     python3 sync_to_db.py                    # Sync tất cả và lưu vào DB
     python3 sync_to_db.py --master-only      # Chỉ master data  
+    python3 sync_to_db.py --master-only --force-master  # Ghi lại master data kể cả khi không đổi
     python3 sync_to_db.py --daily            # Dữ liệu hôm qua
     python3 sync_to_db.py --date 2025-12-25  # Ngày cụ thể
     python3 sync_to_db.py --date-from 2025-12-01 --date-to 2025-12-25  # Khoảng ngày
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
 import os
 import sys
 import argparse
@@ -36,6 +33,15 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 
+from vttech import get_client
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from init_db import refresh_revenue_summaries
+from search_index import ensure_search_index, fold_text
+from table_stats import ensure_table_stats
+from master_sync import content_hash, get_master_hash, set_master_hash, sync_rows
+
 # ============== CONFIG ==============
 BASE_URL = "https://tmtaza.vttechsolution.com"
 USERNAME = "ittest123"
@@ -75,10 +81,7 @@ class DatabaseHelper:
     
     def get_conn(self):
         """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        return get_writer(self.db_path)
     
     def _ensure_tables(self):
         """Đảm bảo các bảng cần thiết tồn tại"""
@@ -200,237 +203,152 @@ class DatabaseHelper:
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_treatments_customer ON treatments(customer_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_treatments_date ON treatments(treatment_date)")
         
+        # Full-text search (tên/SĐT/mã, không dấu) cho dashboard
+        ensure_search_index(conn, 'customers_fts')
+        
+        # Số dòng / bảng cho trang DB của dashboard (trigger table_stats)
+        ensure_table_stats(conn)
+        
         conn.commit()
         conn.close()
     
-    def upsert_branches(self, branches: List[Dict]) -> int:
-        """Insert or update branches"""
+    def sync_master_table(self, table: str, columns, rows, touch_column: str = None) -> Optional[int]:
+        """
+        Ghi bảng master theo diff khoá chính (chỉ dòng mới / thay đổi).
+        Dòng không còn trên API được giữ nguyên. Trả về số dòng đã ghi, None nếu lỗi
+        """
         conn = self.get_conn()
-        count = 0
         try:
-            for data in branches:
-                conn.execute("""
-                    INSERT OR REPLACE INTO branches (id, code, name, address, phone, email, is_active, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Code', data.get('ShortName', '')),
-                    data.get('Name'),
-                    data.get('Address', ''),
-                    data.get('Phone', ''),
-                    data.get('Email', ''),
-                    1 if data.get('IsActive', True) else 0,
-                    datetime.now().isoformat()
-                ))
-                count += 1
+            result = sync_rows(conn, table, columns, rows, touch_column=touch_column)
             conn.commit()
-            logger.info(f"  💾 DB: Saved {count} branches")
+            logger.info(f"  💾 DB: {table} +{result['inserted']} ~{result['updated']} "
+                        f"(không đổi {result['unchanged']})")
+            return result['inserted'] + result['updated']
         except Exception as e:
-            logger.error(f"  ❌ Error saving branches: {e}")
+            logger.error(f"  ❌ Error saving {table}: {e}")
+            return None
         finally:
             conn.close()
-        return count
     
-    def upsert_services(self, services: List[Dict]) -> int:
-        """Insert or update services"""
+    def get_master_hash(self, scope: str) -> Optional[str]:
+        """Hash nội dung lần sync master trước"""
         conn = self.get_conn()
-        count = 0
         try:
-            for data in services:
-                conn.execute("""
-                    INSERT OR REPLACE INTO services (id, code, name, group_id, price, is_active, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Code', ''),
-                    data.get('Name'),
-                    data.get('GroupID', data.get('Type')),
-                    data.get('Price', 0),
-                    1 if data.get('State', 1) == 1 else 0,
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} services")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving services: {e}")
+            return get_master_hash(conn, scope)
         finally:
             conn.close()
-        return count
     
-    def upsert_service_groups(self, groups: List[Dict]) -> int:
-        """Insert or update service groups"""
+    def set_master_hash(self, scope: str, digest: str, row_count: int):
+        """Lưu hash nội dung sau khi sync master thành công"""
         conn = self.get_conn()
-        count = 0
         try:
-            for data in groups:
-                conn.execute("""
-                    INSERT OR REPLACE INTO service_groups (id, code, name, parent_id, is_active)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Code', ''),
-                    data.get('Name'),
-                    data.get('ParentID'),
-                    1
-                ))
-                count += 1
+            set_master_hash(conn, scope, digest, row_count)
             conn.commit()
-            logger.info(f"  💾 DB: Saved {count} service groups")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving service groups: {e}")
         finally:
             conn.close()
-        return count
     
-    def upsert_employees(self, employees: List[Dict]) -> int:
+    def upsert_branches(self, branches: List[Dict]) -> Optional[int]:
+        """Insert or update branches"""
+        return self.sync_master_table('branches', (
+            'id', 'code', 'name', 'address', 'phone', 'email', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Code', data.get('ShortName', '')),
+            data.get('Name'),
+            data.get('Address', ''),
+            data.get('Phone', ''),
+            data.get('Email', ''),
+            1 if data.get('IsActive', True) else 0
+        ) for data in branches], touch_column='updated_at')
+    
+    def upsert_services(self, services: List[Dict]) -> Optional[int]:
+        """Insert or update services"""
+        return self.sync_master_table('services', (
+            'id', 'code', 'name', 'group_id', 'price', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Code', ''),
+            data.get('Name'),
+            data.get('GroupID', data.get('Type')),
+            data.get('Price', 0),
+            1 if data.get('State', 1) == 1 else 0
+        ) for data in services], touch_column='updated_at')
+    
+    def upsert_service_groups(self, groups: List[Dict]) -> Optional[int]:
+        """Insert or update service groups"""
+        return self.sync_master_table('service_groups', (
+            'id', 'code', 'name', 'parent_id', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Code', ''),
+            data.get('Name'),
+            data.get('ParentID'),
+            1
+        ) for data in groups])
+    
+    def upsert_employees(self, employees: List[Dict]) -> Optional[int]:
         """Insert or update employees"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in employees:
-                conn.execute("""
-                    INSERT OR REPLACE INTO employees (id, code, name, branch_id, position, is_active, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Code', ''),
-                    data.get('Name'),
-                    data.get('BranchID'),
-                    data.get('Position', ''),
-                    1 if data.get('State', 1) == 1 else 0,
-                    datetime.now().isoformat()
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} employees")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving employees: {e}")
-        finally:
-            conn.close()
-        return count
-    
-    def upsert_users(self, users: List[Dict]) -> int:
+        return self.sync_master_table('employees', (
+            'id', 'code', 'name', 'branch_id', 'position', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Code', ''),
+            data.get('Name'),
+            data.get('BranchID'),
+            data.get('Position', ''),
+            1 if data.get('State', 1) == 1 else 0
+        ) for data in employees], touch_column='updated_at')
+    
+    def upsert_users(self, users: List[Dict]) -> Optional[int]:
         """Insert or update users"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in users:
-                conn.execute("""
-                    INSERT OR REPLACE INTO users (id, username, full_name, email, phone, branch_id, role, is_active)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Username', data.get('Name', '')),
-                    data.get('FullName', data.get('EmployeeName', data.get('Name', ''))),
-                    data.get('Email', ''),
-                    data.get('Phone', ''),
-                    data.get('BranchID'),
-                    data.get('RoleID', ''),
-                    1
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} users")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving users: {e}")
-        finally:
-            conn.close()
-        return count
-    
-    def upsert_customer_sources(self, sources: List[Dict]) -> int:
+        return self.sync_master_table('users', (
+            'id', 'username', 'full_name', 'email', 'phone', 'branch_id', 'role', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Username', data.get('Name', '')),
+            data.get('FullName', data.get('EmployeeName', data.get('Name', ''))),
+            data.get('Email', ''),
+            data.get('Phone', ''),
+            data.get('BranchID'),
+            data.get('RoleID', ''),
+            1
+        ) for data in users])
+    
+    def upsert_customer_sources(self, sources: List[Dict]) -> Optional[int]:
         """Insert or update customer sources"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in sources:
-                conn.execute("""
-                    INSERT OR REPLACE INTO customer_sources (id, code, name, parent_id, is_active)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Code', ''),
-                    data.get('Name'),
-                    data.get('ParentID', data.get('SPID')),
-                    1
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} customer sources")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving customer sources: {e}")
-        finally:
-            conn.close()
-        return count
-    
-    def upsert_cities(self, cities: List[Dict]) -> int:
+        return self.sync_master_table('customer_sources', (
+            'id', 'code', 'name', 'parent_id', 'is_active'
+        ), [(
+            data.get('ID'),
+            data.get('Code', ''),
+            data.get('Name'),
+            data.get('ParentID', data.get('SPID')),
+            1
+        ) for data in sources])
+    
+    def upsert_cities(self, cities: List[Dict]) -> Optional[int]:
         """Insert or update cities"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in cities:
-                conn.execute("""
-                    INSERT OR REPLACE INTO cities (id, name, code)
-                    VALUES (?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Name'),
-                    data.get('Code', '')
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} cities")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving cities: {e}")
-        finally:
-            conn.close()
-        return count
+        return self.sync_master_table('cities', ('id', 'name', 'code'), [(
+            data.get('ID'),
+            data.get('Name'),
+            data.get('Code', '')
+        ) for data in cities])
     
-    def upsert_districts(self, districts: List[Dict]) -> int:
+    def upsert_districts(self, districts: List[Dict]) -> Optional[int]:
         """Insert or update districts"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in districts:
-                conn.execute("""
-                    INSERT OR REPLACE INTO districts (id, name, city_id)
-                    VALUES (?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Name'),
-                    data.get('CityID')
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} districts")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving districts: {e}")
-        finally:
-            conn.close()
-        return count
+        return self.sync_master_table('districts', ('id', 'name', 'city_id'), [(
+            data.get('ID'),
+            data.get('Name'),
+            data.get('CityID')
+        ) for data in districts])
     
-    def upsert_wards(self, wards: List[Dict]) -> int:
+    def upsert_wards(self, wards: List[Dict]) -> Optional[int]:
         """Insert or update wards"""
-        conn = self.get_conn()
-        count = 0
-        try:
-            for data in wards:
-                conn.execute("""
-                    INSERT OR REPLACE INTO wards (id, name, district_id)
-                    VALUES (?, ?, ?)
-                """, (
-                    data.get('ID'),
-                    data.get('Name'),
-                    data.get('DistrictID')
-                ))
-                count += 1
-            conn.commit()
-            logger.info(f"  💾 DB: Saved {count} wards")
-        except Exception as e:
-            logger.error(f"  ❌ Error saving wards: {e}")
-        finally:
-            conn.close()
-        return count
+        return self.sync_master_table('wards', ('id', 'name', 'district_id'), [(
+            data.get('ID'),
+            data.get('Name'),
+            data.get('DistrictID')
+        ) for data in wards])
     
     def upsert_memberships(self, memberships: List[Dict]) -> int:
         """Insert or update memberships"""
@@ -506,6 +424,7 @@ class DatabaseHelper:
                     datetime.now().isoformat()
                 ))
                 count += 1
+            refresh_revenue_summaries(conn, [date])
             conn.commit()
             logger.info(f"  💾 DB: Saved {count} revenue records for {date}")
         except Exception as e:
@@ -520,16 +439,18 @@ class DatabaseHelper:
         count = 0
         try:
             for data in customers:
+                name = data.get('Name', data.get('CustomerName', ''))
                 conn.execute("""
                     INSERT OR REPLACE INTO customers 
                     (id, code, name, phone, email, gender, birthday, address, 
                      city_id, district_id, ward_id, branch_id, source_id, 
-                     membership_id, total_spent, total_debt, point, is_active, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                     membership_id, total_spent, total_debt, point, is_active, updated_at,
+                     search_name)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     data.get('ID'),
                     data.get('Code', ''),
-                    data.get('Name', data.get('CustomerName', '')),
+                    name,
                     data.get('Phone', data.get('Mobile', '')),
                     data.get('Email', ''),
                     data.get('Gender', data.get('Sex', 0)),
@@ -545,7 +466,8 @@ class DatabaseHelper:
                     data.get('TotalDebt', data.get('Debt', 0)),
                     data.get('Point', 0),
                     1,
-                    datetime.now().isoformat()
+                    datetime.now().isoformat(),
+                    fold_text(name)
                 ))
                 count += 1
             conn.commit()
@@ -636,14 +558,11 @@ class VTTechSyncToDB:
     """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        self.token = None
-        self.xsrf_tokens = {}
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
         self.branches = []
         self.db = DatabaseHelper(DB_PATH)
+        # True -> sync master data kể cả khi content hash không đổi
+        self.force_master = False
         self.stats = {
             'total_records': 0,
             'db_saved': 0,
@@ -652,124 +571,30 @@ class VTTechSyncToDB:
             'start_time': None
         }
     
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
-        """Đăng nhập và lấy token"""
+        """Đăng nhập và lấy token (dùng chung phiên của process)"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(
-                f"{BASE_URL}/api/Author/Login",
-                json={
-                    "username": USERNAME,
-                    "password": PASSWORD,
-                    "passwordcrypt": "",
-                    "from": "",
-                    "sso": "",
-                    "ssotoken": ""
-                },
-                timeout=30
-            )
-            data = resp.json()
-            
-            if data.get("Session"):
-                self.token = data["Session"]
-                self.session.cookies.set("WebToken", self.token)
-                logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')} (ID: {data.get('ID')})")
-                return True
-            else:
-                logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
-                return False
-        except Exception as e:
-            logger.error(f"❌ Lỗi đăng nhập: {e}")
-            return False
+        return self.client.login()
     
     def init_page(self, page_url: str) -> bool:
         """Lấy XSRF token từ trang"""
-        if page_url in self.xsrf_tokens:
-            return True
-            
-        try:
-            resp = self.session.get(f"{BASE_URL}{page_url}", timeout=30)
-            if resp.status_code == 200:
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_tokens[page_url] = match.group(1)
-                    return True
-        except Exception as e:
-            logger.error(f"❌ Lỗi init_page {page_url}: {e}")
-        return False
+        return self.client.init_page(page_url)
     
     def call_handler(self, page_url: str, handler: str, data: Dict, retry: int = 3) -> Any:
         """Gọi handler với XSRF token"""
-        for attempt in range(retry):
-            try:
-                if not self.init_page(page_url):
-                    continue
-                    
-                resp = self.session.post(
-                    f"{BASE_URL}{page_url}?handler={handler}",
-                    data=data,
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'X-Requested-With': 'XMLHttpRequest',
-                        'XSRF-TOKEN': self.xsrf_tokens.get(page_url, ''),
-                        'Accept': '*/*',
-                        'Origin': BASE_URL,
-                        'Referer': f'{BASE_URL}{page_url}'
-                    },
-                    timeout=120
-                )
-                
-                self.stats['endpoints_called'] += 1
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
-                self.stats['errors'] += 1
-        return None
+        result = self.client.call_handler(page_url, handler, data, retry=retry)
+        self.stats['endpoints_called'] += 1
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def call_api(self, endpoint: str, data: Dict = None, retry: int = 3) -> Any:
         """Gọi API trực tiếp"""
-        for attempt in range(retry):
-            try:
-                resp = self.session.post(
-                    f"{BASE_URL}{endpoint}",
-                    json=data or {},
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.token}"
-                    },
-                    timeout=120
-                )
-                
-                self.stats['endpoints_called'] += 1
-                
-                if resp.status_code == 200 and resp.content:
-                    return self.decompress(resp.text)
-                    
-            except Exception as e:
-                if attempt < retry - 1:
-                    time.sleep(1)
-                    continue
-                logger.error(f"❌ Lỗi call_api {endpoint}: {e}")
-                self.stats['errors'] += 1
-        return None
+        result = self.client.call_api(endpoint, data, retry=retry)
+        self.stats['endpoints_called'] += 1
+        if result is None:
+            self.stats['errors'] += 1
+        return result
     
     def save_json(self, data: Any, filename: str, subdir: str = None) -> str:
         """Lưu dữ liệu ra file JSON (backup)"""
@@ -790,7 +615,11 @@ class VTTechSyncToDB:
     # ==========================================
     
     def sync_session_data(self) -> Dict:
-        """Lấy tất cả dữ liệu từ SessionData API và lưu vào DB"""
+        """
+        Lấy tất cả dữ liệu từ SessionData API và lưu vào DB
+        Bảng có nội dung trùng lần sync trước (content hash) -> bỏ qua, không ghi JSON / DB;
+        bảng thay đổi -> chỉ ghi các dòng khác biệt. force_master=True -> luôn diff lại với DB
+        """
         logger.info("\n" + "=" * 60)
         logger.info("📦 SYNC SESSION DATA (Master)")
         logger.info("=" * 60)
@@ -800,99 +629,44 @@ class VTTechSyncToDB:
             logger.error("Không lấy được SessionData")
             return {}
         
+        # Key trong SessionData -> (tên bảng, hàm ghi DB)
+        master_tables = [
+            ("Table", "branches", self.db.upsert_branches),
+            ("Table2", "services", self.db.upsert_services),
+            ("Table3", "service_groups", self.db.upsert_service_groups),
+            ("Table4", "employees", self.db.upsert_employees),
+            ("Table5", "users", self.db.upsert_users),
+            ("Table6", "cities", self.db.upsert_cities),
+            ("Table7", "districts", self.db.upsert_districts),
+            ("Table9", "wards", self.db.upsert_wards),
+            ("Table10", "customer_sources", self.db.upsert_customer_sources),
+        ]
+        
         today = datetime.now().strftime("%Y%m%d")
         saved_data = {}
         
-        # Branches
-        if "Table" in result:
-            data = result["Table"]
-            self.branches = data
-            self.save_json(data, f"branches_{today}", "master")
-            self.db.upsert_branches(data)
-            saved_data['branches'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ branches: {len(data)} records")
-        
-        # Services
-        if "Table2" in result:
-            data = result["Table2"]
-            self.save_json(data, f"services_{today}", "master")
-            self.db.upsert_services(data)
-            saved_data['services'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ services: {len(data)} records")
-        
-        # Service Groups
-        if "Table3" in result:
-            data = result["Table3"]
-            self.save_json(data, f"service_groups_{today}", "master")
-            self.db.upsert_service_groups(data)
-            saved_data['service_groups'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ service_groups: {len(data)} records")
-        
-        # Employees
-        if "Table4" in result:
-            data = result["Table4"]
-            self.save_json(data, f"employees_{today}", "master")
-            self.db.upsert_employees(data)
-            saved_data['employees'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ employees: {len(data)} records")
-        
-        # Users
-        if "Table5" in result:
-            data = result["Table5"]
-            self.save_json(data, f"users_{today}", "master")
-            self.db.upsert_users(data)
-            saved_data['users'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ users: {len(data)} records")
-        
-        # Cities
-        if "Table6" in result:
-            data = result["Table6"]
-            self.save_json(data, f"cities_{today}", "master")
-            self.db.upsert_cities(data)
-            saved_data['cities'] = len(data)
+        for key, name, upsert in master_tables:
+            if key not in result:
+                continue
+            data = result[key]
+            if name == "branches":
+                self.branches = data
+            saved_data[name] = len(data)
             self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ cities: {len(data)} records")
-        
-        # Districts
-        if "Table7" in result:
-            data = result["Table7"]
-            self.save_json(data, f"districts_{today}", "master")
-            self.db.upsert_districts(data)
-            saved_data['districts'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ districts: {len(data)} records")
-        
-        # Wards
-        if "Table9" in result:
-            data = result["Table9"]
-            self.save_json(data, f"wards_{today}", "master")
-            self.db.upsert_wards(data)
-            saved_data['wards'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ wards: {len(data)} records")
-        
-        # Customer Sources
-        if "Table10" in result:
-            data = result["Table10"]
-            self.save_json(data, f"customer_sources_{today}", "master")
-            self.db.upsert_customer_sources(data)
-            saved_data['customer_sources'] = len(data)
-            self.stats['total_records'] += len(data)
-            self.stats['db_saved'] += len(data)
-            logger.info(f"  ✅ customer_sources: {len(data)} records")
+            
+            scope = f"sync_to_db:{name}"
+            digest = content_hash(data)
+            if not self.force_master and self.db.get_master_hash(scope) == digest:
+                logger.info(f"  ⏭️  {name}: {len(data)} records, không đổi")
+                continue
+            
+            self.save_json(data, f"{name}_{today}", "master")
+            written = upsert(data)
+            if written is None:
+                continue
+            self.db.set_master_hash(scope, digest, len(data))
+            self.stats['db_saved'] += written
+            logger.info(f"  ✅ {name}: {len(data)} records")
         
         return saved_data
     
@@ -1218,9 +992,12 @@ def main():
                        help='Ngày bắt đầu (YYYY-MM-DD)')
     parser.add_argument('--date-to', type=str,
                        help='Ngày kết thúc (YYYY-MM-DD)')
+    parser.add_argument('--force-master', action='store_true',
+                       help='Ghi lại master data kể cả khi không đổi (so lại với DB)')
     args = parser.parse_args()
     
     crawler = VTTechSyncToDB()
+    crawler.force_master = args.force_master
     
     if args.daily:
         crawler.daily_sync(args.date or datetime.now().strftime("%Y-%m-%d"))
@@ -0,0 +1,51 @@
+"""Test ghi batch chi tiết khách hàng (sync_customer_detail_full.CustomerDetailSync)"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('requests')
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'database'))
+
+import sync_customer_detail_full as detail_sync
+
+
+@pytest.fixture
+def syncer(tmp_path, monkeypatch):
+    db_path = tmp_path / 'vttech.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("INSERT INTO customers (id, name) VALUES (1, 'Khách 1')")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(detail_sync, 'DB_PATH', db_path)
+    syncer = detail_sync.CustomerDetailSync(client=object())
+    syncer.ensure_tables()
+    return syncer, db_path
+
+
+def test_row_without_id_is_saved_without_insert_log(syncer):
+    syncer, db_path = syncer
+    results = syncer.save_customer_details([
+        (1, {'history': [{'Content': 'no id'}, {'ID': 7, 'Content': 'có id', 'ActionType': 'Call'}]}),
+    ])
+    assert results[0]['history'] == 2
+
+    conn = sqlite3.connect(db_path)
+    try:
+        saved = conn.execute(
+            "SELECT history_id, content FROM customer_history ORDER BY content"
+        ).fetchall()
+        assert saved == [(7, 'có id'), (None, 'no id')]
+        logs = conn.execute(
+            "SELECT record_id, change_type FROM data_change_logs WHERE table_name = 'customer_history'"
+        ).fetchall()
+        assert logs == [(7, 'INSERT')]
+    finally:
+        conn.close()
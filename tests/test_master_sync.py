@@ -0,0 +1,67 @@
+"""Test sync_rows (database/master_sync.py) trên SQLite in-memory"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'database'))
+from master_sync import sync_rows
+
+
+def make_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE cities (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("""
+        CREATE TABLE branches (
+            id INTEGER PRIMARY KEY, name TEXT, is_active INTEGER DEFAULT 1, updated_at DATETIME
+        )
+    """)
+    conn.executemany("INSERT INTO cities (id, name) VALUES (?, ?)", [(1, 'HCM'), (2, 'HN')])
+    conn.executemany("INSERT INTO branches (id, name) VALUES (?, ?)", [(1, 'Q1'), (2, 'Q3')])
+    return conn
+
+
+def test_insert_update_unchanged():
+    conn = make_conn()
+    result = sync_rows(conn, 'cities', ['id', 'name'], [(1, 'HCM'), (2, 'Hà Nội'), (3, 'ĐN')])
+    assert result == {'inserted': 1, 'updated': 1, 'deactivated': 0, 'unchanged': 1}
+    assert conn.execute("SELECT id, name FROM cities ORDER BY id").fetchall() == [
+        (1, 'HCM'), (2, 'Hà Nội'), (3, 'ĐN')]
+
+
+def test_missing_rows_are_kept_by_default():
+    conn = make_conn()
+    result = sync_rows(conn, 'cities', ['id', 'name'], [(1, 'HCM')])
+    assert result == {'inserted': 0, 'updated': 0, 'deactivated': 0, 'unchanged': 1}
+    assert conn.execute("SELECT COUNT(*) FROM cities").fetchone()[0] == 2
+
+
+def test_keys_compared_after_type_affinity():
+    conn = make_conn()
+    result = sync_rows(conn, 'cities', ['id', 'name'], [('1', 'HCM'), ('2', 'HN')])
+    assert result == {'inserted': 0, 'updated': 0, 'deactivated': 0, 'unchanged': 2}
+
+    result = sync_rows(conn, 'branches', ['id', 'name'], [('2', 'Q3')], missing='deactivate')
+    assert result['deactivated'] == 1
+    assert conn.execute("SELECT id, is_active FROM branches ORDER BY id").fetchall() == [(1, 0), (2, 1)]
+
+
+def test_duplicate_keys_keep_last_row():
+    conn = make_conn()
+    result = sync_rows(conn, 'cities', ['id', 'name'], [(2, 'x'), ('2', 'Hà Nội')])
+    assert result == {'inserted': 0, 'updated': 1, 'deactivated': 0, 'unchanged': 0}
+    assert conn.execute("SELECT name FROM cities WHERE id = 2").fetchone()[0] == 'Hà Nội'
+
+
+def test_empty_rows_change_nothing():
+    conn = make_conn()
+    result = sync_rows(conn, 'branches', ['id', 'name'], [], touch_column='updated_at', missing='deactivate')
+    assert result == {'inserted': 0, 'updated': 0, 'deactivated': 0, 'unchanged': 0}
+    assert conn.execute("SELECT COUNT(*) FROM branches WHERE is_active = 1").fetchone()[0] == 2
+
+
+def test_touch_column_only_on_written_rows():
+    conn = make_conn()
+    sync_rows(conn, 'branches', ['id', 'name'], [(1, 'Q1'), (2, 'Quận 3')], touch_column='updated_at')
+    touched = conn.execute("SELECT id FROM branches WHERE updated_at IS NOT NULL").fetchall()
+    assert touched == [(2,)]
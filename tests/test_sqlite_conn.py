@@ -0,0 +1,74 @@
+"""Test checkout writer dùng chung (database/sqlite_conn.py)"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'database'))
+import sqlite_conn
+from sqlite_conn import get_writer
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield tmp_path / 'writer.db'
+    sqlite_conn.close_all()
+
+
+def test_nested_checkout_refused(db_path):
+    conn = get_writer(db_path)
+    try:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+        conn.execute("INSERT INTO t VALUES (1)")
+        with pytest.raises(RuntimeError):
+            get_writer(db_path)
+        # Transaction của caller ngoài không bị ảnh hưởng
+        assert conn.in_transaction
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Sau khi trả, checkout lại được và dùng lại đúng connection chung
+    again = get_writer(db_path)
+    try:
+        assert again is conn
+        assert [row[0] for row in again.execute("SELECT id FROM t")] == [1]
+    finally:
+        again.close()
+
+
+def test_close_rolls_back_uncommitted(db_path):
+    conn = get_writer(db_path)
+    try:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+    finally:
+        conn.close()
+
+    conn = get_writer(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_close_from_other_thread_refused(db_path):
+    conn = get_writer(db_path)
+    errors = []
+
+    def close_elsewhere():
+        try:
+            conn.close()
+        except RuntimeError as e:
+            errors.append(e)
+
+    try:
+        worker = threading.Thread(target=close_elsewhere)
+        worker.start()
+        worker.join()
+        assert len(errors) == 1
+    finally:
+        conn.close()
@@ -11,11 +11,8 @@ Usage:
     python3 unified_sync.py --date 2025-12-25  # Sync cho ngày cụ thể
 """
 
-import requests
 import json
-import base64
-import zlib
-import re
+import sys
 import sqlite3
 import argparse
 import logging
@@ -23,6 +20,14 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+from vttech import get_client
+
+sys.path.insert(0, str(Path(__file__).parent / 'database'))
+from sqlite_conn import get_writer
+from init_db import refresh_revenue_summaries
+from table_stats import SYNC_COUNTED_TABLES, recount_table_stats, refresh_table_sizes
+from master_sync import content_hash, get_master_hash, set_master_hash, sync_rows
+
 # ============== CONFIGURATION ==============
 BASE_URL = 'https://tmtaza.vttechsolution.com'
 USERNAME = 'ittest123'
@@ -31,6 +36,9 @@ PASSWORD = 'ittest123'
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'database' / 'vttech.db'
 LOG_DIR = BASE_DIR / 'logs'
+
+# Trang lấy XSRF token dùng chung cho các handler
+XSRF_PAGE = '/Customer/MainCustomer?CustomerID=1'
 LOG_DIR.mkdir(exist_ok=True)
 
 # Logging
@@ -51,13 +59,7 @@ class VTTechUnifiedSync:
     """
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
-            'Accept-Language': 'vi,en-US;q=0.9,en;q=0.8',
-        })
-        self.token = None
-        self.xsrf_token = None
+        self.client = get_client(BASE_URL, USERNAME, PASSWORD)
         self.db_conn = None
         self.stats = {
             'master': 0,
@@ -68,102 +70,28 @@ class VTTechUnifiedSync:
             'errors': 0
         }
     
-    def decompress(self, data: str) -> Any:
-        """Giải nén response base64+gzip"""
-        try:
-            data = data.strip('"')
-            decoded = base64.b64decode(data)
-            decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
-            return json.loads(decompressed.decode('utf-8'))
-        except:
-            try:
-                return json.loads(data)
-            except:
-                return data
-    
     def login(self) -> bool:
         """Đăng nhập và lấy token"""
         logger.info("🔐 Đang đăng nhập...")
-        try:
-            resp = self.session.post(f'{BASE_URL}/api/Author/Login', json={
-                'username': USERNAME,
-                'password': PASSWORD,
-                'passwordcrypt': '',
-                'from': '',
-                'sso': '',
-                'ssotoken': ''
-            })
-            data = resp.json()
-            
-            if data.get('Session'):
-                self.token = data['Session']
-                self.session.cookies.set('WebToken', self.token)
-                logger.info(f"✅ Login: {data.get('FullName')} (ID: {data.get('ID')})")
-                
-                # Get XSRF token
-                resp = self.session.get(f'{BASE_URL}/Customer/MainCustomer?CustomerID=1')
-                match = re.search(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)', resp.text)
-                if match:
-                    self.xsrf_token = match.group(1)
-                    logger.info("✅ Got XSRF token")
-                
-                return True
-            else:
-                logger.error(f"❌ Login failed: {data.get('RESULT')}")
-                return False
-        except Exception as e:
-            logger.error(f"❌ Login error: {e}")
+        if not self.client.login():
             return False
+        
+        # Get XSRF token (cache trong client)
+        if self.client.get_xsrf(XSRF_PAGE):
+            logger.info("✅ Got XSRF token")
+        return True
     
     def call_handler(self, page: str, handler: str, data: dict = None) -> Any:
         """Gọi page handler"""
-        try:
-            form_data = {'__RequestVerificationToken': self.xsrf_token or ''}
-            if data:
-                form_data.update(data)
-            
-            resp = self.session.post(
-                f'{BASE_URL}{page}?handler={handler}',
-                data=form_data,
-                headers={
-                    'X-Requested-With': 'XMLHttpRequest',
-                    'xsrf-token': self.xsrf_token or '',
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                }
-            )
-            
-            if resp.status_code == 200 and not resp.text.startswith('<!DOCTYPE'):
-                return self.decompress(resp.text)
-            return None
-        except Exception as e:
-            logger.error(f"❌ Handler error {page}?handler={handler}: {e}")
-            self.stats['errors'] += 1
-            return None
+        return self.client.call_handler(page, handler, data, xsrf_page=XSRF_PAGE, form_token=True)
     
     def call_api(self, endpoint: str, data: dict = None) -> Any:
         """Gọi API endpoint"""
-        try:
-            resp = self.session.post(
-                f'{BASE_URL}{endpoint}',
-                json=data or {},
-                headers={
-                    'Authorization': f'Bearer {self.token}',
-                    'Content-Type': 'application/json'
-                }
-            )
-            
-            if resp.status_code == 200:
-                return self.decompress(resp.text)
-            return None
-        except Exception as e:
-            logger.error(f"❌ API error {endpoint}: {e}")
-            self.stats['errors'] += 1
-            return None
+        return self.client.call_api(endpoint, data)
     
     def connect_db(self):
         """Kết nối database"""
-        self.db_conn = sqlite3.connect(DB_PATH)
-        self.db_conn.row_factory = sqlite3.Row
+        self.db_conn = get_writer(DB_PATH)
         logger.info(f"📦 Connected to {DB_PATH}")
     
     def close_db(self):
@@ -200,33 +128,38 @@ class VTTechUnifiedSync:
         for table_key, (table_name, field_mapping) in tables.items():
             if table_key in data and isinstance(data[table_key], list):
                 records = data[table_key]
-                count = 0
                 
-                for record in records:
-                    try:
-                        # Map API fields to DB columns
-                        db_fields = []
-                        values = []
-                        for api_field, db_field in field_mapping.items():
-                            if api_field in record:
-                                db_fields.append(db_field)
-                                values.append(record.get(api_field))
-                        
-                        if db_fields:
-                            placeholders = ', '.join(['?' for _ in db_fields])
-                            field_names = ', '.join(db_fields)
-                            
-                            cursor.execute(f'''
-                                INSERT OR REPLACE INTO {table_name} ({field_names})
-                                VALUES ({placeholders})
-                            ''', values)
-                            count += 1
-                    except Exception as e:
-                        pass
+                # Nội dung không đổi so với lần trước -> bỏ qua cả bảng
+                scope = f"unified_sync:{table_name}"
+                digest = content_hash(records)
+                if get_master_hash(self.db_conn, scope) == digest:
+                    logger.info(f"  ⏭️  {table_name}: {len(records)} records, không đổi")
+                    continue
                 
-                self.db_conn.commit()
+                # Map API fields to DB columns, chỉ ghi dòng mới / thay đổi
+                columns = list(field_mapping.values())
+                rows = [tuple(record.get(api_field) for api_field in field_mapping)
+                        for record in records if isinstance(record, dict)]
+                has_active = any(col['name'] == 'is_active'
+                                 for col in cursor.execute(f"PRAGMA table_info({table_name})"))
+                if has_active:
+                    columns.append('is_active')
+                    rows = [row + (1,) for row in rows]
+                
+                try:
+                    result = sync_rows(self.db_conn, table_name, columns, rows)
+                    set_master_hash(self.db_conn, scope, digest, len(records))
+                    self.db_conn.commit()
+                except sqlite3.Error as e:
+                    self.db_conn.rollback()
+                    self.stats['errors'] += 1
+                    logger.error(f"  ❌ {table_name}: {e}")
+                    continue
+                
+                count = result['inserted'] + result['updated']
                 self.stats['master'] += count
-                logger.info(f"  ✅ {table_name}: {count} records")
+                logger.info(f"  ✅ {table_name}: {len(records)} records "
+                            f"(+{result['inserted']} ~{result['updated']})")
         
         # Sync additional data from handlers
         
@@ -322,6 +255,7 @@ class VTTechUnifiedSync:
                 if paid > 0:
                     logger.info(f"  ✅ {branch_name}: {paid:,.0f} VND")
         
+        refresh_revenue_summaries(self.db_conn, [date_from])
         self.db_conn.commit()
         logger.info(f"  💰 Tổng doanh thu ngày {date_from}: {total_revenue:,.0f} VND")
     
@@ -472,7 +406,7 @@ class VTTechUnifiedSync:
         - LoadataHistory: Lịch sử chăm sóc
         """
         # Initialize session với CustomerID - BẮT BUỘC
-        self.session.get(f'{BASE_URL}/Customer/MainCustomer?CustomerID={customer_id}')
+        self.client.set_customer_context(customer_id)
         
         cursor = self.db_conn.cursor()
         total_records = 0
@@ -613,7 +547,7 @@ class VTTechUnifiedSync:
         logger.info("="*60)
         
         # Initialize session với CustomerID - BẮT BUỘC phải GET trang customer trước
-        self.session.get(f'{BASE_URL}/Customer/MainCustomer?CustomerID={customer_id}')
+        self.client.set_customer_context(customer_id)
         
         from pathlib import Path
         output_dir = BASE_DIR / 'data_sync' / 'customer_detail'
@@ -758,6 +692,12 @@ class VTTechUnifiedSync:
             ))
             self.db_conn.commit()
             
+            # Số dòng bảng ghi nhiều (không có trigger đếm), dung lượng bảng / index
+            # + sqlite_stat1 cho trang DB của dashboard
+            recount_table_stats(self.db_conn, SYNC_COUNTED_TABLES)
+            refresh_table_sizes(self.db_conn)
+            self.db_conn.commit()
+            
             return True
             
         finally:
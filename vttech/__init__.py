@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+VTTech Client Module
+HTTP client dùng chung cho các script sync VTTech
+"""
+
+from .config import config, VTTechConfig
+from .client import VTTechClient, RetryPolicy, decompress, get_client
+from .rate_limit import RateLimiter, AdaptiveRateLimiter
+
+# Optional imports - may fail if httpx not installed
+try:
+    from .async_client import AsyncVTTechClient
+except ImportError:
+    AsyncVTTechClient = None
+
+__all__ = [
+    # Config
+    'config',
+    'VTTechConfig',
+
+    # Client
+    'VTTechClient',
+    'RetryPolicy',
+    'decompress',
+    'get_client',
+    'RateLimiter',
+    'AdaptiveRateLimiter',
+    'AsyncVTTechClient',
+]
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+VTTech Async Client
+Bản asyncio (httpx) của VTTechClient: cùng cách gọi call_handler/call_api
+(XSRF form + header, giải nén base64+gzip, retry) nhưng chạy đồng thời
+nhiều request, giới hạn bởi semaphore
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .config import config
+from .client import VTTechClient, RetryPolicy, XSRF_PATTERN, decompress
+
+logger = logging.getLogger('vttech.async_client')
+
+
+class AsyncVTTechClient:
+    """Async client để giao tiếp với VTTech (Razor page handlers + /api)"""
+
+    def __init__(self, base_url: str = None, username: str = None, password: str = None,
+                 retry_policy: RetryPolicy = None, concurrency: int = None):
+        self.base_url = (base_url or config.base_url).rstrip('/')
+        self.username = username or config.username
+        self.password = password or config.password
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.concurrency = concurrency or config.async_concurrency
+
+        self.client = httpx.AsyncClient(
+            headers={
+                'User-Agent': config.user_agent,
+                'Accept-Language': 'vi,en-US;q=0.9,en;q=0.8'
+            },
+            limits=httpx.Limits(
+                max_connections=max(self.concurrency, config.pool_maxsize),
+                max_keepalive_connections=self.concurrency
+            ),
+            timeout=config.request_timeout,
+            transport=httpx.AsyncHTTPTransport(retries=config.connect_retries)
+        )
+        self.token = None
+        self.xsrf_tokens = {}
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'errors': 0,
+            'logins': 0
+        }
+
+        # Tạo lazy trong event loop đang chạy
+        self._semaphore = None
+        self._login_lock = None
+        self._xsrf_locks = {}
+
+    @classmethod
+    def from_client(cls, client: VTTechClient, concurrency: int = None) -> 'AsyncVTTechClient':
+        """Dùng lại phiên đăng nhập (WebToken + cookies + XSRF cache) của client đồng bộ"""
+        async_client = cls(client.base_url, client.username, client.password,
+                           retry_policy=client.retry_policy, concurrency=concurrency)
+        for cookie in client.session.cookies:
+            async_client.client.cookies.set(cookie.name, cookie.value, domain=cookie.domain, path=cookie.path)
+        async_client.token = client.token
+        async_client.xsrf_tokens = dict(client.xsrf_tokens)
+        return async_client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _sem(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    # ============== LOGIN ==============
+
+    async def login(self, force: bool = False) -> bool:
+        """Đăng nhập (chỉ 1 coroutine thực sự login)"""
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        stale_token = self.token
+        async with self._login_lock:
+            if self.token and (not force or self.token != stale_token):
+                return True
+            try:
+                resp = await self.client.post(
+                    f"{self.base_url}/api/Author/Login",
+                    json={
+                        "username": self.username,
+                        "password": self.password,
+                        "passwordcrypt": "",
+                        "from": "",
+                        "sso": "",
+                        "ssotoken": ""
+                    },
+                    timeout=config.login_timeout
+                )
+                data = resp.json()
+                if data.get("Session"):
+                    self.token = data["Session"]
+                    self.client.cookies.set('WebToken', self.token)
+                    self.xsrf_tokens.clear()
+                    self.stats['logins'] += 1
+                    logger.info(f"✅ Đăng nhập thành công (async): {data.get('FullName')}")
+                    return True
+                logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
+            except Exception as e:
+                logger.error(f"❌ Lỗi đăng nhập: {e}")
+            return False
+
+    async def ensure_login(self) -> bool:
+        return bool(self.token) or await self.login()
+
+    # ============== XSRF ==============
+
+    async def get_xsrf(self, page_url: str, force: bool = False) -> str:
+        """Lấy XSRF token của trang (cache theo page_url, mỗi trang chỉ GET 1 lần)"""
+        lock = self._xsrf_locks.setdefault(page_url, asyncio.Lock())
+        async with lock:
+            if not force and self.xsrf_tokens.get(page_url):
+                return self.xsrf_tokens[page_url]
+            if not await self.ensure_login():
+                return ''
+            try:
+                async with self._sem():
+                    resp = await self.client.get(f"{self.base_url}{page_url}", timeout=config.page_timeout)
+                self.stats['requests'] += 1
+                if resp.status_code == 200:
+                    match = XSRF_PATTERN.search(resp.text)
+                    if match:
+                        self.xsrf_tokens[page_url] = match.group(1)
+                        return match.group(1)
+            except Exception as e:
+                logger.error(f"❌ Lỗi lấy XSRF {page_url}: {e}")
+                self.stats['errors'] += 1
+            return ''
+
+    # ============== CALLS ==============
+
+    def _policy(self, retry: int = None, policy: RetryPolicy = None) -> RetryPolicy:
+        policy = policy or self.retry_policy
+        if retry is not None and retry != policy.max_attempts:
+            policy = policy.with_attempts(retry)
+        return policy
+
+    async def call_handler(self, page_url: str, handler: str, data: Dict = None, retry: int = None,
+                           xsrf_page: str = None, form_token: bool = False, referer: str = None,
+                           timeout: int = None, policy: RetryPolicy = None) -> Any:
+        """Gọi page handler với XSRF token (giống VTTechClient.call_handler)"""
+        policy = self._policy(retry, policy)
+        if not await self.ensure_login():
+            return None
+
+        token_page = xsrf_page or page_url
+        relogged = False
+
+        for attempt in range(policy.max_attempts):
+            if attempt > 0:
+                self.stats['retries'] += 1
+
+            token = await self.get_xsrf(token_page)
+            if not token:
+                if attempt < policy.max_attempts - 1:
+                    await asyncio.sleep(policy.delay(attempt))
+                continue
+
+            form_data = {'__RequestVerificationToken': token} if form_token else {}
+            if data:
+                form_data.update(data)
+
+            try:
+                async with self._sem():
+                    resp = await self.client.post(
+                        f"{self.base_url}{page_url}?handler={handler}",
+                        data=form_data,
+                        headers={
+                            'Content-Type': 'application/x-www-form-urlencoded',
+                            'X-Requested-With': 'XMLHttpRequest',
+                            'XSRF-TOKEN': token,
+                            'Accept': '*/*',
+                            'Origin': self.base_url,
+                            'Referer': referer or f'{self.base_url}{page_url}'
+                        },
+                        timeout=timeout or config.request_timeout
+                    )
+                self.stats['requests'] += 1
+            except Exception as e:
+                if attempt < policy.max_attempts - 1:
+                    await asyncio.sleep(policy.delay(attempt))
+                    continue
+                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
+                self.stats['errors'] += 1
+                return None
+
+            if resp.status_code == 200 and resp.content:
+                if not resp.text.startswith('<!DOCTYPE'):
+                    return decompress(resp.text)
+                if relogged or not await self.login(force=True):
+                    return None
+                relogged = True
+                continue
+
+            if resp.status_code == 401 and not relogged:
+                relogged = await self.login(force=True)
+                continue
+
+            if resp.status_code == 400:
+                self.xsrf_tokens.pop(token_page, None)
+                continue
+
+            if policy.should_retry(resp.status_code) and attempt < policy.max_attempts - 1:
+                retry_after = resp.headers.get('Retry-After')
+                wait = policy.delay(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                logger.warning(f"⏳ {handler}: HTTP {resp.status_code}, chờ {wait:.1f}s")
+                await asyncio.sleep(wait)
+                continue
+
+            if resp.status_code != 200:
+                logger.error(f"❌ {page_url}?handler={handler}: HTTP {resp.status_code}")
+                self.stats['errors'] += 1
+            return None
+
+        self.stats['errors'] += 1
+        return None
+
+    async def call_api(self, endpoint: str, data: Dict = None, retry: int = None,
+                       timeout: int = None, policy: RetryPolicy = None) -> Any:
+        """Gọi API trực tiếp với Bearer token"""
+        policy = self._policy(retry, policy)
+        if not await self.ensure_login():
+            return None
+
+        relogged = False
+        for attempt in range(policy.max_attempts):
+            if attempt > 0:
+                self.stats['retries'] += 1
+            try:
+                async with self._sem():
+                    resp = await self.client.post(
+                        f"{self.base_url}{endpoint}",
+                        json=data or {},
+                        headers={
+                            "Content-Type": "application/json",
+                            "Authorization": f"Bearer {self.token}"
+                        },
+                        timeout=timeout or config.request_timeout
+                    )
+                self.stats['requests'] += 1
+            except Exception as e:
+                if attempt < policy.max_attempts - 1:
+                    await asyncio.sleep(policy.delay(attempt))
+                    continue
+                logger.error(f"❌ Lỗi call_api {endpoint}: {e}")
+                self.stats['errors'] += 1
+                return None
+
+            if resp.status_code == 200:
+                return decompress(resp.text) if resp.content else None
+
+            if resp.status_code == 401 and not relogged:
+                relogged = await self.login(force=True)
+                continue
+
+            if policy.should_retry(resp.status_code) and attempt < policy.max_attempts - 1:
+                await asyncio.sleep(policy.delay(attempt))
+                continue
+
+            logger.error(f"❌ {endpoint}: HTTP {resp.status_code}")
+            self.stats['errors'] += 1
+            return None
+
+        self.stats['errors'] += 1
+        return None
+
+    async def call_handler_many(self, page_url: str, handler: str, payloads: List[Dict],
+                                **kwargs) -> List[Optional[Any]]:
+        """Gọi cùng 1 handler với nhiều payload đồng thời, kết quả giữ đúng thứ tự payloads"""
+        return await asyncio.gather(*[
+            self.call_handler(page_url, handler, payload, **kwargs) for payload in payloads
+        ])
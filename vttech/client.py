@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+VTTech HTTP Client
+Client dùng chung cho các script sync: connection pool + keep-alive,
+đăng nhập 1 lần cho cả process, cache XSRF token theo trang, retry/backoff
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .config import config
+from .rate_limit import RateLimiter
+
+# Không gọi logging.basicConfig ở đây - mỗi script tự cấu hình handler của mình
+logger = logging.getLogger('vttech.client')
+
+XSRF_PATTERN = re.compile(r'name=__RequestVerificationToken[^>]*value=([^\s/>]+)')
+
+
+def decompress(data: str) -> Any:
+    """Giải nén response base64+gzip"""
+    try:
+        decoded = base64.b64decode(data.strip('"'))
+        decompressed = zlib.decompress(decoded, 16 + zlib.MAX_WBITS)
+        return json.loads(decompressed.decode('utf-8'))
+    except Exception:
+        try:
+            return json.loads(data)
+        except Exception:
+            return data
+
+
+class RetryPolicy:
+    """
+    Chính sách retry/backoff cho call_handler và call_api
+
+    Truyền policy khác vào VTTechClient (hoặc từng lời gọi) để đổi
+    số lần thử, thời gian chờ và các HTTP status được retry
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_attempts: int = None, backoff_base: float = None,
+                 backoff_max: float = None, retry_statuses: Tuple[int, ...] = None,
+                 jitter: bool = True):
+        self.max_attempts = max(1, max_attempts or config.max_attempts)
+        self.backoff_base = config.backoff_base if backoff_base is None else backoff_base
+        self.backoff_max = config.backoff_max if backoff_max is None else backoff_max
+        self.retry_statuses = tuple(retry_statuses or self.RETRY_STATUSES)
+        self.jitter = jitter
+
+    def should_retry(self, status_code: int) -> bool:
+        return status_code in self.retry_statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Thời gian chờ (giây) trước lần thử thứ attempt + 1"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        wait = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        if self.jitter:
+            wait *= random.uniform(0.5, 1.0)
+        return wait
+
+    def with_attempts(self, max_attempts: int) -> 'RetryPolicy':
+        """Copy policy với số lần thử khác (giữ tương thích tham số retry=)"""
+        return RetryPolicy(max_attempts, self.backoff_base, self.backoff_max,
+                           self.retry_statuses, self.jitter)
+
+
+class VTTechClient:
+    """Client để giao tiếp với VTTech (Razor page handlers + /api)"""
+
+    def __init__(self, base_url: str = None, username: str = None, password: str = None,
+                 retry_policy: RetryPolicy = None, pool_maxsize: int = None,
+                 use_session_cache: bool = False, rate_limiter: RateLimiter = None):
+        self.base_url = (base_url or config.base_url).rstrip('/')
+        self.username = username or config.username
+        self.password = password or config.password
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Cache WebToken ra file (dùng chung giữa các process) chỉ khi được bật: server giữ
+        # customer context theo session, client chọn customer (detail sync) không được bật
+        self.use_session_cache = use_session_cache
+        self.rate_limiter = rate_limiter  # Có thể dùng chung giữa nhiều client
+
+        self.session = self._build_session(pool_maxsize or config.pool_maxsize)
+        self.token = None
+        self.user_info = {}
+        self.xsrf_tokens = {}  # page_url -> XSRF token
+
+        self._login_lock = threading.Lock()
+        self._xsrf_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'errors': 0,
+            'logins': 0
+        }
+
+    def _build_session(self, pool_maxsize: int) -> requests.Session:
+        """Tạo Session với connection pool đủ lớn cho nhiều thread"""
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': config.user_agent,
+            'Accept-Language': 'vi,en-US;q=0.9,en;q=0.8',
+            'Connection': 'keep-alive'
+        })
+        # urllib3 chỉ retry lỗi kết nối; retry theo status do RetryPolicy xử lý
+        adapter = HTTPAdapter(
+            pool_connections=config.pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=config.connect_retries,
+                connect=config.connect_retries,
+                read=0,
+                status=0,
+                backoff_factor=0.5,
+                raise_on_status=False
+            )
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _throttle(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+    def _feedback(self, resp: requests.Response):
+        """Báo status thật cho rate limiter (AdaptiveRateLimiter tự giảm/tăng rate)"""
+        if self.rate_limiter is not None and hasattr(self.rate_limiter, 'on_response'):
+            self.rate_limiter.on_response(resp.status_code, self._retry_after(resp))
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    # ============== LOGIN ==============
+
+    def _set_token(self, token: str):
+        self.token = token
+        self.session.cookies.set('WebToken', token)
+        with self._xsrf_lock:
+            self.xsrf_tokens.clear()
+
+    def _load_cached_session(self) -> bool:
+        """Dùng lại WebToken đã lưu bởi process khác (còn hạn)"""
+        path = config.session_cache
+        try:
+            if not path.exists():
+                return False
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('base_url') != self.base_url or cached.get('username') != self.username:
+                return False
+            saved_at = datetime.fromisoformat(cached['saved_at'])
+            if datetime.now() - saved_at > timedelta(minutes=config.session_ttl_minutes):
+                return False
+            self._set_token(cached['token'])
+            self.user_info = cached.get('user_info', {})
+            logger.info(f"♻️ Dùng lại phiên đăng nhập: {self.user_info.get('FullName')}")
+            return True
+        except Exception as e:
+            logger.debug(f"Bỏ qua session cache: {e}")
+            return False
+
+    def _save_cached_session(self):
+        path = config.session_cache
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'base_url': self.base_url,
+                    'username': self.username,
+                    'token': self.token,
+                    'user_info': self.user_info,
+                    'saved_at': datetime.now().isoformat()
+                }, f, ensure_ascii=False)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.debug(f"Không lưu được session cache: {e}")
+
+    def _clear_cached_session(self):
+        try:
+            config.session_cache.unlink()
+        except (FileNotFoundError, OSError):
+            pass
+
+    def login(self, force: bool = False) -> bool:
+        """Đăng nhập 1 lần cho cả process (thread-safe)"""
+        with self._login_lock:
+            if self.token and not force:
+                return True
+            if not force and self.use_session_cache and self._load_cached_session():
+                return True
+            return self._do_login()
+
+    def _do_login(self) -> bool:
+        try:
+            resp = self.session.post(
+                f"{self.base_url}/api/Author/Login",
+                json={
+                    "username": self.username,
+                    "password": self.password,
+                    "passwordcrypt": "",
+                    "from": "",
+                    "sso": "",
+                    "ssotoken": ""
+                },
+                timeout=config.login_timeout
+            )
+            data = resp.json()
+
+            if data.get("Session"):
+                self.user_info = {'ID': data.get('ID'), 'FullName': data.get('FullName')}
+                self._set_token(data["Session"])
+                self._count('logins')
+                if self.use_session_cache:
+                    self._save_cached_session()
+                logger.info(f"✅ Đăng nhập thành công: {data.get('FullName')} (ID: {data.get('ID')})")
+                return True
+
+            logger.error(f"❌ Đăng nhập thất bại: {data.get('RESULT')}")
+        except Exception as e:
+            logger.error(f"❌ Lỗi đăng nhập: {e}")
+        return False
+
+    def relogin(self, stale_token: str = None) -> bool:
+        """Đăng nhập lại khi phiên hết hạn (chỉ 1 thread thực sự login)"""
+        with self._login_lock:
+            if self.token and self.token != stale_token:
+                # Thread khác đã login lại rồi
+                return True
+            logger.warning("🔄 Phiên đăng nhập hết hạn, đăng nhập lại...")
+            if self.use_session_cache:
+                self._clear_cached_session()
+            return self._do_login()
+
+    def ensure_login(self) -> bool:
+        return bool(self.token) or self.login()
+
+    # ============== PAGES / XSRF ==============
+
+    def get_page(self, page_url: str, timeout: int = None) -> Optional[requests.Response]:
+        """GET một trang (dùng session đã đăng nhập)"""
+        if not self.ensure_login():
+            return None
+        self._throttle()
+        try:
+            resp = self.session.get(f"{self.base_url}{page_url}", timeout=timeout or config.page_timeout)
+            self._count('requests')
+            self._feedback(resp)
+            return resp
+        except Exception as e:
+            logger.error(f"❌ Lỗi GET {page_url}: {e}")
+            self._count('errors')
+            return None
+
+    def get_xsrf(self, page_url: str, force: bool = False) -> str:
+        """Lấy XSRF token của trang (cache theo page_url)"""
+        if not force:
+            with self._xsrf_lock:
+                token = self.xsrf_tokens.get(page_url)
+            if token:
+                return token
+
+        resp = self.get_page(page_url)
+        if resp is not None and resp.status_code == 200:
+            match = XSRF_PATTERN.search(resp.text)
+            if match:
+                with self._xsrf_lock:
+                    self.xsrf_tokens[page_url] = match.group(1)
+                return match.group(1)
+        return ''
+
+    def init_page(self, page_url: str) -> bool:
+        """Lấy XSRF token từ trang"""
+        return bool(self.get_xsrf(page_url))
+
+    def invalidate_xsrf(self, page_url: str):
+        with self._xsrf_lock:
+            self.xsrf_tokens.pop(page_url, None)
+
+    def set_customer_context(self, customer_id: int) -> Optional[str]:
+        """
+        GET /Customer/MainCustomer để server gắn customer vào session.
+        Trả về XSRF token của trang ('' nếu trang không có token, None nếu lỗi).
+        Không cache vì mỗi customer có 1 trang riêng
+        """
+        resp = self.get_page(f"/Customer/MainCustomer?CustomerID={customer_id}")
+        if resp is None or resp.status_code != 200:
+            return None
+        match = XSRF_PATTERN.search(resp.text)
+        return match.group(1) if match else ''
+
+    # ============== CALLS ==============
+
+    def _retry_after(self, resp: requests.Response) -> Optional[float]:
+        value = resp.headers.get('Retry-After')
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def _policy(self, retry: int = None, policy: RetryPolicy = None) -> RetryPolicy:
+        policy = policy or self.retry_policy
+        if retry is not None and retry != policy.max_attempts:
+            policy = policy.with_attempts(retry)
+        return policy
+
+    def call_handler(self, page_url: str, handler: str, data: Dict = None, retry: int = None,
+                     xsrf_page: str = None, xsrf_token: str = None, form_token: bool = False,
+                     referer: str = None, timeout: int = None,
+                     policy: RetryPolicy = None) -> Any:
+        """
+        Gọi page handler với XSRF token
+
+        Args:
+            page_url: Trang chứa handler (vd: /Customer/ListCustomer/)
+            handler: Tên handler
+            data: Form data
+            retry: Số lần thử (ghi đè policy)
+            xsrf_page: Lấy XSRF từ trang khác thay vì page_url
+            xsrf_token: Dùng token có sẵn (vd: token của customer context)
+            form_token: Gửi kèm __RequestVerificationToken trong form
+            referer: Referer header (mặc định page_url)
+        """
+        policy = self._policy(retry, policy)
+        if not self.ensure_login():
+            return None
+
+        token_page = xsrf_page or page_url
+        relogged = False
+
+        for attempt in range(policy.max_attempts):
+            if attempt > 0:
+                self._count('retries')
+
+            token = xsrf_token if xsrf_token is not None else self.get_xsrf(token_page)
+            if not token and xsrf_token is None:
+                if attempt < policy.max_attempts - 1:
+                    time.sleep(policy.delay(attempt))
+                continue
+
+            form_data = {'__RequestVerificationToken': token} if form_token else {}
+            if data:
+                form_data.update(data)
+
+            session_token = self.token
+            self._throttle()
+            try:
+                resp = self.session.post(
+                    f"{self.base_url}{page_url}?handler={handler}",
+                    data=form_data,
+                    headers={
+                        'Content-Type': 'application/x-www-form-urlencoded',
+                        'X-Requested-With': 'XMLHttpRequest',
+                        'XSRF-TOKEN': token,
+                        'Accept': '*/*',
+                        'Origin': self.base_url,
+                        'Referer': referer or f'{self.base_url}{page_url}'
+                    },
+                    timeout=timeout or config.request_timeout
+                )
+                self._count('requests')
+                self._feedback(resp)
+            except Exception as e:
+                if attempt < policy.max_attempts - 1:
+                    time.sleep(policy.delay(attempt))
+                    continue
+                logger.error(f"❌ Lỗi call_handler {page_url}?handler={handler}: {e}")
+                self._count('errors')
+                return None
+
+            if resp.status_code == 200 and resp.content:
+                if not resp.text.startswith('<!DOCTYPE'):
+                    return decompress(resp.text)
+                # Trang HTML = phiên hết hạn → login lại 1 lần rồi thử tiếp
+                if relogged or not self.relogin(session_token):
+                    return None
+                relogged = True
+                continue
+
+            if resp.status_code == 401 and not relogged:
+                relogged = self.relogin(session_token)
+                continue
+
+            if resp.status_code == 400 and xsrf_token is None:
+                # Token hết hạn/sai → xoá cache để lấy token mới
+                self.invalidate_xsrf(token_page)
+                continue
+
+            if policy.should_retry(resp.status_code) and attempt < policy.max_attempts - 1:
+                wait = policy.delay(attempt, self._retry_after(resp))
+                logger.warning(f"⏳ {handler}: HTTP {resp.status_code}, chờ {wait:.1f}s")
+                time.sleep(wait)
+                continue
+
+            if resp.status_code != 200:
+                logger.error(f"❌ {page_url}?handler={handler}: HTTP {resp.status_code}")
+                self._count('errors')
+            return None
+
+        self._count('errors')
+        return None
+
+    def call_api(self, endpoint: str, data: Dict = None, retry: int = None,
+                 timeout: int = None, policy: RetryPolicy = None) -> Any:
+        """Gọi API trực tiếp với Bearer token"""
+        policy = self._policy(retry, policy)
+        if not self.ensure_login():
+            return None
+
+        relogged = False
+        for attempt in range(policy.max_attempts):
+            if attempt > 0:
+                self._count('retries')
+
+            session_token = self.token
+            self._throttle()
+            try:
+                resp = self.session.post(
+                    f"{self.base_url}{endpoint}",
+                    json=data or {},
+                    headers={
+                        "Content-Type": "application/json",
+                        "Authorization": f"Bearer {session_token}"
+                    },
+                    timeout=timeout or config.request_timeout
+                )
+                self._count('requests')
+                self._feedback(resp)
+            except Exception as e:
+                if attempt < policy.max_attempts - 1:
+                    time.sleep(policy.delay(attempt))
+                    continue
+                logger.error(f"❌ Lỗi call_api {endpoint}: {e}")
+                self._count('errors')
+                return None
+
+            if resp.status_code == 200:
+                return decompress(resp.text) if resp.content else None
+
+            if resp.status_code == 401 and not relogged:
+                relogged = self.relogin(session_token)
+                continue
+
+            if policy.should_retry(resp.status_code) and attempt < policy.max_attempts - 1:
+                wait = policy.delay(attempt, self._retry_after(resp))
+                logger.warning(f"⏳ {endpoint}: HTTP {resp.status_code}, chờ {wait:.1f}s")
+                time.sleep(wait)
+                continue
+
+            logger.error(f"❌ {endpoint}: HTTP {resp.status_code}")
+            self._count('errors')
+            return None
+
+        self._count('errors')
+        return None
+
+    def close(self):
+        self.session.close()
+
+
+# ============== SHARED INSTANCE ==============
+
+_clients: Dict[Tuple[str, str, bool], VTTechClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str = None, username: str = None, password: str = None,
+               use_session_cache: bool = False) -> VTTechClient:
+    """
+    Lấy client dùng chung cho cả process (1 login, 1 connection pool)
+    theo (base_url, username, use_session_cache).
+    use_session_cache=True chỉ cho script không chọn customer (không dùng customer context)
+    """
+    key = ((base_url or config.base_url).rstrip('/'), username or config.username, use_session_cache)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = VTTechClient(base_url, username, password, use_session_cache=use_session_cache)
+            _clients[key] = client
+        return client
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+VTTech Client Configuration
+Cấu hình cho HTTP client dùng chung khi gọi VTTech TMTaza
+"""
+
+import os
+from pathlib import Path
+from dataclasses import dataclass
+
+
+@dataclass
+class VTTechConfig:
+    """Cấu hình VTTech Client"""
+
+    # VTTech Account
+    base_url: str = os.getenv('VTTECH_BASE_URL', 'https://tmtaza.vttechsolution.com')
+    username: str = os.getenv('VTTECH_USERNAME', 'ittest123')
+    password: str = os.getenv('VTTECH_PASSWORD', 'ittest123')
+
+    # Connection pool (requests HTTPAdapter)
+    pool_connections: int = int(os.getenv('VTTECH_POOL_CONNECTIONS', '10'))
+    pool_maxsize: int = int(os.getenv('VTTECH_POOL_MAXSIZE', '20'))
+    connect_retries: int = int(os.getenv('VTTECH_CONNECT_RETRIES', '2'))
+
+    # Số request đồng thời tối đa của AsyncVTTechClient
+    async_concurrency: int = int(os.getenv('VTTECH_ASYNC_CONCURRENCY', '5'))
+
+    # Timeout (seconds)
+    login_timeout: int = int(os.getenv('VTTECH_LOGIN_TIMEOUT', '30'))
+    page_timeout: int = int(os.getenv('VTTECH_PAGE_TIMEOUT', '30'))
+    request_timeout: int = int(os.getenv('VTTECH_REQUEST_TIMEOUT', '120'))
+
+    # Retry / backoff mặc định cho call_handler, call_api
+    max_attempts: int = int(os.getenv('VTTECH_MAX_ATTEMPTS', '3'))
+    backoff_base: float = float(os.getenv('VTTECH_BACKOFF_BASE', '1.0'))
+    backoff_max: float = float(os.getenv('VTTECH_BACKOFF_MAX', '30.0'))
+
+    # Cache phiên đăng nhập (opt-in: get_client(use_session_cache=True)) để các process con
+    # (run.py) không phải login lại
+    session_cache: Path = Path(os.getenv(
+        'VTTECH_SESSION_CACHE',
+        str(Path(__file__).parent.parent / "logs" / ".vttech_session.json")
+    ))
+    session_ttl_minutes: int = int(os.getenv('VTTECH_SESSION_TTL_MINUTES', '30'))
+
+    user_agent: str = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+# Global config instance
+config = VTTechConfig()
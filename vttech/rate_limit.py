@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+VTTech Rate Limiter
+Giới hạn số request/giây dùng chung cho nhiều thread/session
+"""
+
+import time
+import threading
+
+
+class RateLimiter:
+    """Token bucket: tối đa `rate` request/giây, cho phép burst `burst` request"""
+
+    def __init__(self, rate: float, burst: int = None):
+        if rate <= 0:
+            raise ValueError("rate phải > 0")
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Chờ đến khi được phép gửi 1 request"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Token bucket tự điều chỉnh theo HTTP status thật của server (AIMD):
+    - 429/503: giảm rate theo cấp số nhân (decrease), tạm dừng cả bucket
+      đến hết Retry-After nếu server có gửi
+    - 2xx: tăng rate cộng dần (increase) về lại max_rate
+    Dùng chung 1 instance cho mọi client/thread gọi cùng server
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, rate: float, burst: int = None, min_rate: float = None,
+                 increase: float = None, decrease: float = 0.5):
+        super().__init__(rate, burst)
+        self.max_rate = self.rate
+        self.min_rate = min(self.rate, min_rate or max(0.2, self.rate / 10))
+        self.increase = increase if increase is not None else self.rate / 20
+        self.decrease = decrease
+        self.paused_until = 0.0
+        self.stats = {
+            'throttled': 0,
+            'slowdowns': 0
+        }
+
+    def acquire(self):
+        with self._lock:
+            pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        super().acquire()
+
+    def on_response(self, status_code: int, retry_after: float = None):
+        """Báo status của 1 response để điều chỉnh rate"""
+        with self._lock:
+            if status_code in self.THROTTLE_STATUSES:
+                self.stats['throttled'] += 1
+                self._refill()
+                new_rate = max(self.min_rate, self.rate * self.decrease)
+                if new_rate < self.rate:
+                    self.stats['slowdowns'] += 1
+                self.rate = new_rate
+                self.tokens = min(self.tokens, 0.0)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif 200 <= status_code < 300 and self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.increase)